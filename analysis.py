@@ -0,0 +1,253 @@
+"""
+analysis.py
+
+Vectorized mechanical properties analysis of tension test data.
+
+Everything here works on whole NumPy arrays at once, so a test with a
+hundred thousand points takes milliseconds rather than the seconds a
+row-by-row Python loop would. NumPy must be installed to use this module.
+
+Data can be BasicTest.data (or any list of datapoints), a CSV file written by
+write_file, or a stream file from datastream.py. Given the specimen geometry,
+analyze() computes:
+
+    - engineering stress (MPa) and strain
+    - elastic modulus (MPa), by least-squares fit over the linear region,
+      which is found automatically
+    - 0.2% offset yield strength and strain
+    - ultimate strength and the strain where it occurred
+    - break stress and strain
+
+For example:
+
+    spec = Specimen(area = 4.0, gauge_length = 25.0)
+    print analyze(test.data, spec)
+    results = analyze_batch(glob.glob("archive/*.csv"), spec, processes = 4)
+
+Run this module directly to analyze CSV files from the command line:
+
+    python analysis.py area gauge_length file1.csv file2.csv ...
+"""
+
+import gzip, multiprocessing
+import numpy as np
+
+# Conversion from the Loadstar's lbs to newtons.
+LBS_TO_N = 4.4482216152605
+
+class Specimen():
+    """
+    Specimen geometry. area is the cross-sectional area in mm^2 and
+    gauge_length the initial gauge length in mm. Loads are given in lbs
+    unless load_scale says otherwise (it converts loads to newtons).
+    """
+
+    def __init__(self, area, gauge_length, load_scale = LBS_TO_N):
+        self.area = float(area)
+        self.gauge_length = float(gauge_length)
+        self.load_scale = load_scale
+
+def read_csv(fname):
+    """
+    Reads a CSV written by BasicTest.write_file (or csvexport), optionally
+    gzipped. Returns (header, data), where header is the free text at the top
+    and data a 2D array with one row per datapoint.
+    """
+    opener = gzip.open if fname.endswith(".gz") else open
+    f = opener(fname, 'rb')
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    # The header is every line before the first one which is all numbers.
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end < 0:
+            end = len(text)
+        line = text[start:end].strip()
+        try:
+            ncols = len([float(v) for v in line.split(",")])
+            break
+        except ValueError:
+            start = end + 1
+    else:
+        return text, np.zeros((0, 0))
+    values = np.fromstring(text[start:].replace("\n", ","), sep = ",")
+    return text[:start], values[:len(values) - len(values) % ncols].reshape(-1, ncols)
+
+def load_data(source):
+    """
+    Turns any supported data source into a 2D array: a list of datapoints,
+    an array, a CSV file name, or a datastream stream file name (.pyld).
+    """
+    if isinstance(source, basestring):
+        if source.endswith(".pyld"):
+            import datastream
+            columns, header, data = datastream.read_stream(source)
+            return np.asarray(data, dtype = float)
+        return read_csv(source)[1]
+    return np.asarray(source, dtype = float)
+
+def stress_strain(data, specimen, col = None):
+    """
+    Returns (stress, strain) arrays. Stress is in MPa, strain is the
+    displacement since the first point divided by the gauge length.
+    col maps "position" and "load" to columns, like BasicTest.col.
+    """
+    col = col or {'time': 0, 'position': 1, 'load': 2}
+    data = load_data(data)
+    displacement = data[:, col['position']] - data[0, col['position']]
+    stress = data[:, col['load']] * specimen.load_scale / specimen.area
+    return stress, displacement / specimen.gauge_length
+
+def _window_fits(x, y, n):
+    """
+    Least-squares fits of y against x over every window of n consecutive points,
+    all at once using cumulative sums. Returns (slopes, intercepts, r_squared).
+    """
+    def wsum(a):
+        c = np.concatenate(([0.0], np.cumsum(a)))
+        return c[n:] - c[:-n]
+    # Center the data, which keeps the cumulative sums well conditioned.
+    x = x - x.mean()
+    y0 = y.mean()
+    y = y - y0
+    sx, sy = wsum(x), wsum(y)
+    sxx, syy, sxy = wsum(x * x), wsum(y * y), wsum(x * y)
+    vx = n * sxx - sx * sx
+    vy = n * syy - sy * sy
+    cov = n * sxy - sx * sy
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        slopes = cov / vx
+        r2 = cov * cov / (vx * vy)
+    slopes[~np.isfinite(slopes)] = 0.0
+    r2[~np.isfinite(r2)] = 0.0
+    intercepts = (sy - slopes * sx) / n
+    return slopes, intercepts, r2
+
+def elastic_modulus(stress, strain, window = .1, min_r2 = .995):
+    """
+    Finds the linear region before the ultimate strength and fits it.
+    Every window of (window * points up to the peak) points is fitted at once;
+    among the fits with r^2 of at least min_r2 (or the best available), the
+    steepest is taken as the linear region. Returns (modulus, intercept,
+    first index, last index), where the fit is stress = modulus * strain + intercept.
+    """
+    peak = int(np.argmax(stress))
+    n = max(int((peak + 1) * window), 3)
+    if peak + 1 < n:
+        return float('nan'), float('nan'), 0, peak
+    x = strain[:peak + 1]
+    y = stress[:peak + 1]
+    slopes, intercepts, r2 = _window_fits(x, y, n)
+    good = r2 >= min(min_r2, r2.max())
+    best = int(np.argmax(np.where(good, slopes, -np.inf)))
+    modulus = slopes[best]
+    # Undo the centering done in _window_fits.
+    intercept = intercepts[best] + y.mean() - modulus * x.mean()
+    return float(modulus), float(intercept), best, best + n - 1
+
+def offset_yield(stress, strain, modulus, intercept, start = 0, offset = .002):
+    """
+    Returns (yield stress, yield strain) by the offset method: where the curve
+    crosses a line of slope modulus, shifted offset strain to the right of the
+    elastic fit. The search begins at index start. Returns NaNs if the curve
+    never crosses it.
+    """
+    line = modulus * (strain - offset) + intercept
+    diff = stress[start:] - line[start:]
+    below = np.nonzero(diff <= 0)[0]
+    if not len(below) or modulus <= 0:
+        return float('nan'), float('nan')
+    i = start + int(below[0])
+    if i == 0:
+        return float(stress[0]), float(strain[0])
+    # Interpolate between the points either side of the crossing.
+    d0, d1 = diff[i - 1 - start], diff[i - start]
+    f = d0 / (d0 - d1) if d0 != d1 else 0.0
+    return float(stress[i - 1] + f * (stress[i] - stress[i - 1])), \
+           float(strain[i - 1] + f * (strain[i] - strain[i - 1]))
+
+def break_point(stress, strain, drop = .5):
+    """
+    Returns (break stress, break strain, index): the last point before stress
+    first falls below (1 - drop) times the ultimate strength, after the
+    ultimate. If it never does, the last point is returned.
+    """
+    peak = int(np.argmax(stress))
+    fallen = np.nonzero(stress[peak:] < (1 - drop) * stress[peak])[0]
+    i = peak + int(fallen[0]) - 1 if len(fallen) else len(stress) - 1
+    return float(stress[i]), float(strain[i]), i
+
+def analyze(data, specimen, col = None, window = .1, min_r2 = .995, drop = .5):
+    """
+    Analyzes one tension test. data is anything load_data accepts. Returns
+    a dictionary of results; stresses are in MPa and the modulus in MPa.
+    See elastic_modulus and break_point for window, min_r2 and drop.
+    """
+    stress, strain = stress_strain(data, specimen, col)
+    if len(stress) < 3:
+        raise ValueError("Not enough data to analyze.")
+    modulus, intercept, lin_start, lin_end = elastic_modulus(stress, strain,
+                                                             window, min_r2)
+    ys, ye = offset_yield(stress, strain, modulus, intercept, lin_end)
+    peak = int(np.argmax(stress))
+    bs, be, bi = break_point(stress, strain, drop)
+    return {'points': len(stress), 'modulus': modulus, 'intercept': intercept,
+            'linear_start': lin_start, 'linear_end': lin_end,
+            'yield_strength': ys, 'yield_strain': ye,
+            'ultimate_strength': float(stress[peak]),
+            'ultimate_strain': float(strain[peak]),
+            'break_strength': bs, 'break_strain': be, 'break_index': bi}
+
+def _analyze_one(args):
+    """Batch worker. Errors are returned rather than raised, so one bad file
+    doesn't stop a whole batch."""
+    source, specimen, kwargs = args
+    try:
+        result = analyze(source, specimen, **kwargs)
+    except Exception as e:
+        result = {'error': str(e)}
+    if isinstance(source, basestring):
+        result['file'] = source
+    return result
+
+def analyze_batch(sources, specimen, processes = None, **kwargs):
+    """
+    Analyzes many tests. sources is a list of anything analyze accepts,
+    usually file names, and specimen is either one Specimen for all of them
+    or a list with one per source. Extra keyword arguments go to analyze.
+    With processes > 1, that many worker processes share the work.
+    Returns a list of result dictionaries in the same order; failed ones
+    hold an 'error' message instead.
+    """
+    if isinstance(specimen, Specimen):
+        specimen = [specimen] * len(sources)
+    jobs = [(s, spec, kwargs) for s, spec in zip(sources, specimen)]
+    if processes is None or processes <= 1:
+        return [_analyze_one(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_analyze_one, jobs, chunksize = max(1, len(jobs) // (processes * 4)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 4:
+        print "Usage: python analysis.py area_mm2 gauge_length_mm file1.csv ..."
+        sys.exit(1)
+    spec = Specimen(float(sys.argv[1]), float(sys.argv[2]))
+    files = sys.argv[3:]
+    results = analyze_batch(files, spec, processes = multiprocessing.cpu_count())
+    print "file,modulus_MPa,yield_MPa,ultimate_MPa,break_MPa,break_strain"
+    for r in results:
+        if 'error' in r:
+            print r['file'] + ",error: " + r['error']
+        else:
+            print "%s,%.1f,%.2f,%.2f,%.2f,%.4f" % (r['file'], r['modulus'],
+                r['yield_strength'], r['ultimate_strength'], r['break_strength'],
+                r['break_strain'])
@@ -0,0 +1,348 @@
+"""
+archive.py
+
+An indexed archive of completed tests, which can be searched in milliseconds.
+
+write_file leaves a heap of hand-named CSVs, each with a free-form text
+header, so finding every test run at a given speed means parsing every one
+of them. An Archive is a directory instead, holding:
+    - one compact columnar binary file per test, in data/
+    - index.sqlite, a SQLite database of every test's header, parameters
+      (such as speed or break detect load) and summary statistics (the
+      minimum, maximum, mean, first and last value of every column)
+
+Queries only touch the index, whose parameters and statistics are indexed by
+name and value, so they stay fast with thousands of tests. Data is only read
+when it is used: Dataset.column memory-maps a single column with NumPy.
+
+    arc = Archive("archive")
+    test_id = self.archive_data(arc, h, {"speed": 10, "material": "PLA"})
+    ...
+    for test_id in arc.find({"load.max": (100, None)}, speed = 10):
+        load = arc.dataset(test_id).column("load")
+
+Parameters are numbers or strings. A condition of find is a value, which
+must match exactly, or a (low, high) range, either end of which may be None.
+Statistics are named column.stat, for example "load.max" or "time.last".
+
+Layout of a data file (all little-endian):
+    - 32 byte header: 8 byte magic "PYLDCOLS", uint32 version, uint32
+      number of columns, uint64 number of rows, uint32 length of the column
+      JSON, then padding
+    - The column labels as JSON, padded to a multiple of 8 bytes
+    - Each column in turn, as rows doubles
+
+Existing CSV and stream files can be added from the command line, with
+parameters taken from "label: value" lines of their headers:
+
+    python archive.py archive add *.csv *.pyld
+    python archive.py archive find "Speed setting (mm/min)=10" load.max=100:
+    python archive.py archive show 12
+"""
+
+import os, sys, json, time, array, struct, sqlite3, argparse
+
+MAGIC = "PYLDCOLS"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQI4x")
+INDEX = "index.sqlite"
+STATS = ["min", "max", "mean", "first", "last"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, name TEXT,
+    created REAL, file TEXT, rows INTEGER, columns TEXT, header TEXT);
+CREATE TABLE IF NOT EXISTS fields (test_id INTEGER, name TEXT, num REAL,
+    text TEXT, stat INTEGER);
+CREATE INDEX IF NOT EXISTS fields_num ON fields (name, num, test_id);
+CREATE INDEX IF NOT EXISTS fields_text ON fields (name, text, test_id);
+CREATE INDEX IF NOT EXISTS fields_test ON fields (test_id);
+"""
+
+def write_columns(fname, columns, data):
+    """
+    Writes data, a list of datapoints with one value per label in columns,
+    to the columnar file fname. The file only appears once it is complete.
+    """
+    for point in data:
+        if len(point) != len(columns):
+            raise ValueError("Every datapoint must have one value per column.")
+    info = json.dumps(list(columns))
+    info += " " * (-len(info) % 8)
+    values = zip(*data) if data else [()] * len(columns)
+    tmp = fname + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(columns), len(data), len(info)))
+        f.write(info)
+        for column in values:
+            a = array.array("d", column)
+            if sys.byteorder == "big":
+                a.byteswap()
+            f.write(a.tostring())
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, fname)
+
+class Dataset():
+    """
+    The data of one archived test, in the columnar file fname. Only the
+    header is read up front; columns are read when asked for.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, "rb") as f:
+            magic, version, ncols, self.nrows, info_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a PyLoader archive file.")
+            self.columns = json.loads(f.read(info_len))
+        self._offset = _HEADER.size + info_len
+
+    def _start(self, name):
+        if name not in self.columns:
+            raise KeyError(name)
+        return self._offset + self.columns.index(name) * self.nrows * 8
+
+    def column(self, name):
+        """
+        A read-only NumPy array of column name, memory-mapped from the file,
+        so only the parts used are ever read. Needs NumPy.
+        """
+        import numpy as np
+        start = self._start(name)
+        if not self.nrows:
+            return np.zeros(0)
+        return np.memmap(self.fname, "<f8", "r", start, (self.nrows,))
+
+    __getitem__ = column
+
+    def values(self, name):
+        """Column name as a list of floats. Doesn't need NumPy."""
+        with open(self.fname, "rb") as f:
+            f.seek(self._start(name))
+            return list(struct.unpack("<%dd" % self.nrows, f.read(self.nrows * 8)))
+
+    def rows(self):
+        """Every datapoint, as a list of lists like BasicTest.data."""
+        return [list(p) for p in zip(*[self.values(c) for c in self.columns])]
+
+def summarize(columns, data):
+    """Returns {"column.stat": value} for every column and every stat in STATS."""
+    out = {}
+    if not data:
+        return out
+    for name, values in zip(columns, zip(*data)):
+        out[name + ".min"] = min(values)
+        out[name + ".max"] = max(values)
+        out[name + ".mean"] = float(sum(values)) / len(values)
+        out[name + ".first"] = values[0]
+        out[name + ".last"] = values[-1]
+    return out
+
+def header_params(h):
+    """
+    Picks parameters out of a free-form header: every "label: value" line
+    gives a parameter named label, a number if value is one.
+    """
+    params = {}
+    for line in h.splitlines():
+        label, colon, value = line.partition(":")
+        label = label.strip()
+        value = value.strip()
+        if not colon or not label or not value:
+            continue
+        try:
+            params[label] = float(value)
+        except ValueError:
+            params[label] = value
+    return params
+
+class Archive():
+    """The archive in directory, which is created if it doesn't exist yet."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.data_dir = os.path.join(directory, "data")
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db = sqlite3.connect(os.path.join(directory, INDEX))
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, data, columns, header = "", params = None, name = None,
+            created = None):
+        """
+        Archives data, a list of datapoints, whose column labels are columns.
+        header is free text, params a dictionary of parameters to search by,
+        and name a description (the file name, say). created is the time the
+        test was run, now by default. Returns the new test's id.
+        """
+        created = time.time() if created is None else created
+        with self.db:
+            cursor = self.db.execute("INSERT INTO tests (name, created, rows, "
+                "columns, header) VALUES (?, ?, ?, ?, ?)", (name, created,
+                len(data), json.dumps(list(columns)), header))
+            test_id = cursor.lastrowid
+            fname = "%08d.pyla" % test_id
+            write_columns(os.path.join(self.data_dir, fname), columns, data)
+            self.db.execute("UPDATE tests SET file = ? WHERE id = ?", (fname, test_id))
+            rows = [self._field(test_id, k, v, 0) for k, v in (params or {}).items()]
+            rows += [self._field(test_id, k, v, 1)
+                     for k, v in summarize(columns, data).items()]
+            self.db.executemany("INSERT INTO fields VALUES (?, ?, ?, ?, ?)", rows)
+        return test_id
+
+    def _field(self, test_id, name, value, stat):
+        if isinstance(value, basestring):
+            return (test_id, name, None, value, stat)
+        return (test_id, name, float(value), None, stat)
+
+    def add_file(self, fname, params = None):
+        """
+        Archives a CSV written by write_file, or a stream file (.pyld). Its
+        header's "label: value" lines become parameters, along with params.
+        Reading CSVs needs NumPy. Returns the new test's id.
+        """
+        if fname.endswith(".pyld"):
+            import datastream
+            columns, header, data = datastream.read_stream(fname)
+        else:
+            import analysis
+            header, values = analysis.read_csv(fname)
+            data = values.tolist()
+            n = values.shape[1] if len(data) else 0
+            columns = ["time", "position", "load"][:n] + \
+                ["column%d" % i for i in range(3, n)]
+        found = header_params(header)
+        found.update(params or {})
+        return self.add(data, columns, header, found, os.path.basename(fname),
+                        os.path.getmtime(fname))
+
+    def find(self, conditions = None, **params):
+        """
+        Returns the ids, oldest first, of every test matching all conditions,
+        a dictionary of parameter or statistic names to values or (low,
+        high) ranges. Keyword arguments are further conditions.
+        """
+        conditions = dict(conditions or {}, **params)
+        sql = "SELECT id FROM tests"
+        clauses = []
+        args = []
+        for name, value in sorted(conditions.items()):
+            sub = "id IN (SELECT test_id FROM fields WHERE name = ?"
+            args.append(name)
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    sub += " AND num >= ?"
+                    args.append(low)
+                if high is not None:
+                    sub += " AND num <= ?"
+                    args.append(high)
+            elif isinstance(value, basestring):
+                sub += " AND text = ?"
+                args.append(value)
+            else:
+                sub += " AND num = ?"
+                args.append(float(value))
+            clauses.append(sub + ")")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return [row[0] for row in self.db.execute(sql + " ORDER BY created, id", args)]
+
+    def info(self, test_id):
+        """
+        Everything the index knows about a test, as a dictionary: id, name,
+        created, rows, columns, header, params and stats.
+        """
+        row = self.db.execute("SELECT id, name, created, rows, columns, header "
+                              "FROM tests WHERE id = ?", (test_id,)).fetchone()
+        if row is None:
+            raise KeyError(test_id)
+        out = dict(zip(["id", "name", "created", "rows", "columns", "header"], row))
+        out["columns"] = json.loads(out["columns"])
+        out["params"] = {}
+        out["stats"] = {}
+        for name, num, text, stat in self.db.execute("SELECT name, num, text, stat "
+                "FROM fields WHERE test_id = ?", (test_id,)):
+            out["stats" if stat else "params"][name] = text if num is None else num
+        return out
+
+    def fields(self):
+        """The names of every parameter and statistic in the archive."""
+        return [row[0] for row in
+                self.db.execute("SELECT DISTINCT name FROM fields ORDER BY name")]
+
+    def dataset(self, test_id):
+        """The Dataset of a test, for reading its data."""
+        row = self.db.execute("SELECT file FROM tests WHERE id = ?", (test_id,)).fetchone()
+        if row is None:
+            raise KeyError(test_id)
+        return Dataset(os.path.join(self.data_dir, row[0]))
+
+    def remove(self, test_id):
+        """Removes a test from the index, and deletes its data."""
+        row = self.db.execute("SELECT file FROM tests WHERE id = ?", (test_id,)).fetchone()
+        if row is None:
+            raise KeyError(test_id)
+        with self.db:
+            self.db.execute("DELETE FROM fields WHERE test_id = ?", (test_id,))
+            self.db.execute("DELETE FROM tests WHERE id = ?", (test_id,))
+        os.remove(os.path.join(self.data_dir, row[0]))
+
+def _parse_condition(text):
+    """Turns name=value or name=low:high from the command line into a condition."""
+    name, equals, value = text.partition("=")
+    if not equals:
+        raise ValueError("Conditions look like name=value or name=low:high.")
+    def number(v):
+        if v == "":
+            return None
+        return float(v)
+    try:
+        if ":" in value:
+            low, colon, high = value.partition(":")
+            return name, (number(low), number(high))
+        return name, float(value)
+    except ValueError:
+        return name, value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Add tests to an archive, and search it.")
+    parser.add_argument("directory")
+    commands = parser.add_subparsers(dest = "command")
+    add = commands.add_parser("add", help = "archive CSV and stream files")
+    add.add_argument("files", nargs = "+")
+    find = commands.add_parser("find", help = "list tests matching every condition")
+    find.add_argument("conditions", nargs = "*", help = "name=value or name=low:high")
+    show = commands.add_parser("show", help = "show everything indexed about a test")
+    show.add_argument("id", type = int)
+    args = parser.parse_args()
+
+    arc = Archive(args.directory)
+    if args.command == "add":
+        for fname in args.files:
+            print "%s: test %d" % (fname, arc.add_file(fname))
+    elif args.command == "find":
+        try:
+            conditions = dict(_parse_condition(c) for c in args.conditions)
+        except ValueError as e:
+            print e
+            sys.exit(1)
+        start = time.time()
+        found = arc.find(conditions)
+        elapsed = time.time() - start
+        for test_id in found:
+            info = arc.info(test_id)
+            print "%6d  %s  %7d rows  %s" % (test_id, time.strftime("%Y-%m-%d %H:%M",
+                time.localtime(info["created"])), info["rows"], info["name"] or "")
+        print "%d tests found in %.1f ms" % (len(found), elapsed * 1000)
+    else:
+        info = arc.info(args.id)
+        print info["header"]
+        for kind in ["params", "stats"]:
+            for name, value in sorted(info[kind].items()):
+                print "%s = %s" % (name, value)
+    arc.close()
@@ -18,11 +18,29 @@ This basic test assumes a simple Freeloader collecting time, load, and displacem
 To specify or collect more data, you will need to override get_datapoint() 
 and call set_columns() before running the test.
 
+Nothing here needs a GUI or a particular platform unless it is used: Tk is
+only loaded when write_file has to ask for a file name. To stop a test
+early, hit a key, send the process SIGTERM, or create the file named by the
+PYLOADER_STOP_FILE environment variable (see stopsignal.py). So tests can
+also run unattended, on any operating system.
+
 For an example test class which uses this, see tensiontest.py.
 """
 
-import sys, msvcrt, time, Tkinter, tkFileDialog
+import os, sys
+import clock, profiler
 from freeloader import Freeloader, FreeloaderError
+from datastream import StreamWriter
+from csvexport import write_csv
+from scheduler import RateScheduler
+from conditions import Condition, Compare
+from reporter import StatusReporter
+from cyclic import RingBuffer, RainflowCounter, CycleTracker
+from sensors import Sensor, SensorRegistry
+from stopsignal import StopSignal, interactive
+from shmring import RingWriter
+from watchdog import Watchdog
+from archive import Archive, header_params
 
 class BasicTest():
     """Represents a basic test and provides useful methods. Meant to be extended."""
@@ -42,6 +60,37 @@ class BasicTest():
         # can be found in a datapoint, so the user doesn't have to remember.
         self.col = {'time': 0, 'position': 1, 'load': 2}
 
+        # Optional StreamWriter which receives every stored datapoint.
+        self.stream = None
+
+        # Optional shmring.RingWriter which receives every collected datapoint.
+        self.publisher = None
+
+        # Optional watchdog.Watchdog which halts the motor outside safe limits.
+        self.watchdog = None
+
+        # Timing statistics (scheduler.PhaseStats) of every collection phase,
+        # and the fraction of each sample period which may be spent busy-waiting.
+        self.phase_stats = []
+        self.spin_budget = .1
+
+        # Online statistics (see onlinestats.py) updated with every stored
+        # datapoint, by name, and the names of those shown in verbose output.
+        self.stats = {}
+        self.stats_shown = []
+
+        # The latest datapoint collected, whether or not it was stored.
+        self.last_point = None
+
+        # Lines per second printed by verbose collect_until and wait_until.
+        self.report_rate = 5
+
+        # Extra sensors, each read on its own thread (see add_sensor).
+        self.sensors = SensorRegistry()
+
+        # Reasons to end the test early: a key hit, SIGTERM or a stop file.
+        self.stop_signal = StopSignal(os.environ.get("PYLOADER_STOP_FILE"))
+
         # Collect zero data for the load
         self.load_zer = self.fl.read_cell()
     
@@ -58,29 +107,242 @@ class BasicTest():
     def exit_error(self, error):
         """Prompts before exiting, so user has time to read error."""
         print error
+        self.sensors.stop()
+        self.stop_stream()
+        self.stop_publishing()
+        self.stop_watchdog()
         self.fl.disconnect()
-        out = raw_input("Hit enter to exit program.")
+        self.stop_signal.release()
+        if interactive():
+            out = raw_input("Hit enter to exit program.")
         sys.exit(0)
 
+    def ensure_stopped(self):
+        """
+        Stops the motor on the way out of a phase, however it ends. A failure
+        is printed rather than raised, so it can't hide the error which ended
+        the phase; the motor may also be disconnected already.
+        """
+        try:
+            self.fl.stop_motor()
+        except (FreeloaderError, ValueError, IOError) as e:
+            if self.fl.dyna_online:
+                print "Could not stop the motor: " + (getattr(e, 'msg', None) or str(e))
+
+    def check_stop(self):
+        """
+        Exits, through exit_error, if the test has been asked to stop early:
+        by a key hit, SIGTERM, or the stop file (see stopsignal.py), or if the
+        watchdog has tripped.
+        """
+        if self.check_keyboard():
+            self.fl.disconnect()
+            self.exit_error("Test terminated early by user.")
+
+    def check_keyboard(self):
+        """
+        Returns True if a key has been hit, which ends a phase waiting for
+        one. Any other reason to stop (see check_stop) ends the test through
+        exit_error, since the whole test was asked to stop, not just the phase.
+        """
+        reason = self.stop_signal.check()
+        if reason == "user":
+            return True
+        if reason:
+            self.fl.disconnect()
+            self.exit_error("Test terminated early by " + reason + ".")
+        if self.watchdog is not None and self.watchdog.tripped:
+            self.exit_error("Test stopped by the watchdog: " + self.watchdog.tripped)
+        return False
+
     def collect_data(self):
         """
-        Collects time, position, and load from the Freeloader.
-        If you would like to collect additional data, you must override
-        this method and add to the returned list.
+        Collects time, position, and load from the Freeloader, followed by the
+        latest reading of every sensor added with add_sensor.
+        If you would like to collect additional data, you can either add a
+        sensor, or override this method and add to the returned list.
         """
-        time_point = time.time() - self.start_time
+        t = profiler.tic()
+        time_point = clock.now() - self.start_time
         position_point = self.fl.get_linear_position()
+        t = profiler.lap("collect_data.position", t)
         load_point = self.fl.read_cell() - self.load_zer
+        profiler.toc("collect_data.load", t)
+        if self.sensors.sensors:
+            return [time_point, position_point, load_point] + self.sensors.latest()
         return [time_point, position_point, load_point]
 
+    def add_sensor(self, name, read, rate = None):
+        """
+        Adds a sensor, such as an extensometer, as a new column called name.
+        read is a function returning a reading and rate the rate in Hz to read
+        it at (None for as fast as possible). The sensor is read on its own
+        thread, starting now, so it doesn't slow down position and load; each
+        datapoint gets its latest reading. See sensors.py. This extends the
+        columns set with set_columns, so call that first if you use it.
+        Sensors can't be added while streaming or publishing, whose files
+        have a fixed set of columns; add them before start_stream.
+        """
+        if self.stream is not None or self.publisher is not None:
+            self.exit_error("Can't add the sensor " + name + " while streaming or "
+                            "publishing: add sensors before starting them.")
+        try:
+            sensor = self.sensors.add(Sensor(name, read, rate))
+        except ValueError as ve:
+            self.exit_error(str(ve))
+        labels = sorted(self.col, key = self.col.get)
+        self.set_columns(labels + [name])
+        sensor.start()
+        return sensor
+
+    def sensor_rows(self, times = None):
+        """
+        Returns the full-rate readings of all sensors combined into rows of
+        [time, sensor 1, sensor 2, ...], with time relative to the start of
+        the test. See SensorRegistry.rows.
+        """
+        return self.sensors.rows(times, self.start_time)
+
+    def handle_point(self, point, storage = None):
+        """
+        Handles a newly collected datapoint. Every datapoint collected by the
+        collect_ methods goes through here. Registered statistics are updated
+        with it and it is published, if start_publishing was called. Then it
+        is stored, unless a storage policy (see storage.py) is given and
+        decides otherwise.
+        """
+        self.last_point = point
+        for stat in self.stats.itervalues():
+            stat.update(point)
+        if self.publisher is not None:
+            self.publisher.append(point)
+        if storage is None:
+            self.store_point(point)
+        else:
+            for kept in storage.offer(point):
+                self.store_point(kept)
+
+    def store_point(self, point):
+        """Stores a datapoint in self.data, and in the stream file if one is open."""
+        self.data.append(point)
+        if self.stream is not None:
+            self.stream.append(point)
+
+    def bind_storage(self, storage):
+        """Binds a storage policy to this test's columns, if there is one."""
+        if storage is not None:
+            try:
+                storage.bind(self.col)
+            except KeyError as ke:
+                self.exit_error("An invalid column was asked for: " + str(ke))
+
+    def flush_storage(self, storage):
+        """Stores whatever a storage policy was holding back at the end of a phase."""
+        if storage is not None:
+            for kept in storage.flush():
+                self.store_point(kept)
+
+    def add_stat(self, name, stat, display = False):
+        """
+        Registers an accumulator from onlinestats.py under name, for example
+        add_stat("peak", MinMax("load")). It is updated with every collected
+        datapoint from then on, even ones a storage policy doesn't store, and can be read at any time as self.stats[name].
+        With display = True, its value is shown in the verbose output of
+        collect_until and wait_until. Call set_columns first, if you use it.
+        """
+        try:
+            self.stats[name] = stat.bind(self.col)
+        except KeyError as ke:
+            self.exit_error("An invalid column was asked for: " + str(ke))
+        if display and name not in self.stats_shown:
+            self.stats_shown.append(name)
+
+    def start_stream(self, fname, h = ""):
+        """
+        Starts streaming every stored datapoint to the file fname as it is
+        collected, so that a crash or early exit doesn't lose the test.
+        Data already collected is written first. h is a text header, as in
+        write_file. Writing happens on a background thread and never slows
+        down collection. See datastream.py for reading the file back.
+        """
+        self.stop_stream()
+        labels = sorted(self.col, key = self.col.get)
+        self.stream = StreamWriter(fname, labels, header = h)
+        if hasattr(self, 'data'):
+            self.stream.extend(self.data)
+
+    def stop_stream(self):
+        """Flushes and closes the stream file, if one is open."""
+        if self.stream is not None:
+            stream = self.stream
+            self.stream = None
+            try:
+                stream.close()
+            except IOError as e:
+                print "Warning: " + str(e)
+
+    def start_publishing(self, fname, capacity = 65536):
+        """
+        Starts publishing every collected datapoint, whether it is stored or
+        not, to a shared-memory ring in the file fname, which other processes
+        can read while the test runs (see shmring.py). The ring holds the
+        latest capacity datapoints. shmring.default_path gives a good fname.
+        """
+        self.stop_publishing()
+        labels = sorted(self.col, key = self.col.get)
+        self.publisher = RingWriter(fname, labels, capacity)
+
+    def stop_publishing(self):
+        """Closes the shared-memory ring, if one is open."""
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+
+    def start_watchdog(self, **limits):
+        """
+        Starts a Watchdog (see watchdog.py) which halts the motor, from its own
+        thread, if load or position leave the given limits or stop being read
+        while the motor moves. limits are keyword arguments of Watchdog, such
+        as max_load = 100; loads are relative to the test's zero load. The
+        collection loops then end the test through exit_error if it trips.
+        Each collection phase stretches its heartbeat to cover a few of its
+        sample periods (see Watchdog.pace), so a slow rate doesn't trip it.
+        While it runs, wait_for and wait_for_keyboard read the load cell as
+        well as position, so its heartbeat is kept up during waits too.
+        """
+        self.stop_watchdog()
+        self.watchdog = Watchdog(self.fl, load_offset = self.load_zer, **limits).start()
+
+    def make_scheduler(self, rate, name):
+        """
+        Returns a RateScheduler for a collection phase at rate Hz, and paces
+        the watchdog, if one is running, to it.
+        """
+        if self.watchdog is not None:
+            self.watchdog.pace(1.0 / rate if rate else None)
+        return RateScheduler(rate, self.spin_budget, name)
+
+    def feed_watchdog(self):
+        """
+        Reads the load cell, if a watchdog is running, so it keeps seeing the
+        load in loops which only need position.
+        """
+        if self.watchdog is not None:
+            self.fl.read_cell()
+
+    def stop_watchdog(self):
+        """Stops the watchdog, if one is running, and prints its report."""
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            print self.watchdog.report()
+            self.watchdog = None
+
     def get_last_value(self, value):
         """
         Returns the most recently collected value of name "value".
         For example, get_last_value("load") returns the last collected load.
         """
-        if not len(self.data):
-            self.exit_error("Tried to access last point with no data collected.")
-        return self.data[-1][self.col[value]]
+        return self.get_last_point()[self.col[value]]
 
     def get_first_value(self, value):
         """
@@ -92,10 +354,13 @@ class BasicTest():
         return self.data[0][self.col[value]]
 
     def get_last_point(self):
-        """Returns the most recently collected datapoint as a list."""
-        if not len(self.data):
+        """
+        Returns the most recently collected datapoint as a list. It may not
+        have been stored (yet), if a storage policy was used.
+        """
+        if self.last_point is None:
             self.exit_error("Tried to access last point with no data collected.")
-        return self.data[-1]
+        return self.last_point
 
     def get_first_point(self):
         """Returns the first collected datapoint."""
@@ -112,15 +377,53 @@ class BasicTest():
 
     def initialize_data(self):
         """Clears any stored data and sets reference time to 0."""
-        self.start_time = time.time()
-        self.data = [self.collect_data()]
+        self.start_time = clock.now()
+        self.data = []
+        self.last_point = None
+        for stat in self.stats.itervalues():
+            stat.reset()
+        self.handle_point(self.collect_data())
 
     def run_test(self):
         """Main test routine. Must be overriden by user."""
         print "This is the basic template test. It does nothing. You must write a test class"
         print "which inherits from BasicTest in order to define an actual test."
 
-    def collect_until(self, value, fun, threshold, rate = 1000000, verbose = True):
+    def make_condition(self, value, fun = None, threshold = None):
+        """
+        Returns a stop condition (see conditions.py) bound to this test's columns.
+        value may already be a Condition, in which case fun and threshold are
+        ignored. Otherwise it is a column name, fun is the name of a function in
+        self.funs, and threshold the value to compare against.
+        Raises KeyError if a column or function doesn't exist.
+        """
+        if isinstance(value, Condition):
+            cond = value
+        else:
+            cond = Compare(value, self.funs[fun], threshold, fun)
+        return cond.bind(self.col)
+
+    def status_line(self, cond, point):
+        """Returns a line showing the values cond watches and its target, for printing."""
+        values = "  ".join([c + ": " + str(round(point[self.col[c]],2)) \
+            for c in cond.columns()])
+        for name in self.stats_shown:
+            if self.stats[name].value is not None:
+                values += "  " + name + ": " + str(round(self.stats[name].value,2))
+        if isinstance(cond, Compare):
+            return values + "\ttarget: " + cond.name + " " + str(cond.threshold)
+        return values + "\ttarget: " + str(cond)
+
+    def start_reporter(self, cond):
+        """
+        Starts and returns a StatusReporter (see reporter.py) which prints
+        status_line for cond and the latest datapoint posted to it.
+        """
+        return StatusReporter(lambda point: self.status_line(cond, point),
+                              self.report_rate).start()
+
+    def collect_until(self, value, fun = None, threshold = None, rate = None,
+                      verbose = True, storage = None):
         """
         Important, magical function.
         Automatically constructs loop to collect data until either:
@@ -129,30 +432,55 @@ class BasicTest():
         For example, collect_until("load","greaterthan",10) will (predictably)
         continously collect data using the collect_data() method until load
         exceeds 10 lbs. 
+        Instead of a column name, value can be a condition from conditions.py,
+        such as collect_until(drop_from_peak("load", .5) | elapsed(60)). It is
+        compiled once and then checked against every new datapoint.
         The rate option specifies sampling rate in Hz. With a 9600 baud Loadstar, this
-        cannot exceed 30 Hz. The default, 1Mhz, simply means "as fast as possible."
+        cannot exceed 30 Hz; loadcal.py finds faster settings. The default, None, simply means "as fast as possible."
+        Samples are paced against absolute deadlines, so the rate doesn't drift, and
+        the achieved rate and jitter are appended to self.phase_stats afterwards.
         The verbose option prints the watched value and the threshold, so that the
         user can monitor progress themselves. This is left on by default as a safety
-        feature, but can be muted by setting verbose = False.
+        feature, but can be muted by setting verbose = False. Printing happens on
+        a separate thread, self.report_rate times per second, so it doesn't slow
+        down collection; the final value is always printed.
+        The storage option takes a storage policy from storage.py, such as
+        Decimate(10), which limits which datapoints are stored. Collection and
+        condition checking still run at full rate.
         """
         try:
-            loop_time = 1/rate
-            while not self.funs[fun](self.get_last_value(value), threshold):
-                loop_start = time.time()
-                self.data.append(self.collect_data())
-                if verbose:
-                    print value + ": " + str(round(self.get_last_value(value),2)) + \
-                        "\ttarget: " + fun + " " + str(threshold)
-                while (time.time()-loop_start) < loop_time:
-                    pass
-                if msvcrt.kbhit():
-                    msvcrt.getch()
-                    self.fl.disconnect()
-                    self.exit_error("Test terminated early by user.")
+            cond = self.make_condition(value, fun, threshold)
+            met = cond.update(self.get_last_point())
         except KeyError as ke:
             self.exit_error("An invalid column was asked for: " + str(ke))
+        self.bind_storage(storage)
+        sched = self.make_scheduler(rate, "collect_until " + str(cond))
+        if verbose:
+            reporter = self.start_reporter(cond)
+        try:
+            while not met:
+                t = profiler.tic()
+                sched.wait()
+                t = profiler.lap("collect_until.wait", t)
+                point = self.collect_data()
+                t = profiler.lap("collect_until.collect", t)
+                self.handle_point(point, storage)
+                t = profiler.lap("collect_until.store", t)
+                met = cond.update(point)
+                t = profiler.lap("collect_until.condition", t)
+                if verbose:
+                    reporter.post(point)
+                t = profiler.lap("collect_until.report", t)
+                self.check_stop()
+                profiler.toc("collect_until.keyboard", t)
+        finally:
+            if verbose:
+                reporter.stop()
+            self.stop_signal.release()
+            self.flush_storage(storage)
+            self.phase_stats.append(sched.stats)
 
-    def collect_for(self, sec, rate = 1000000):
+    def collect_for(self, sec, rate = None, storage = None):
         """ 
         More convenient way of calling collect_until with time.
         The caveat is that the this function is only as accurate as
@@ -160,26 +488,119 @@ class BasicTest():
         and sec is 120 ms, collection may occur for up to 150 ms. Keep this
         in mind.
         """
-        current_time = time.time() - self.start_time
-        self.collect_until("time", "greaterthan", sec + current_time, rate = rate)
+        current_time = clock.now() - self.start_time
+        self.collect_until("time", "greaterthan", sec + current_time, rate = rate,
+                           storage = storage)
 
-    def wait_until(self, value, fun, threshold, verbose = True):
+    def collect_cycles(self, value, low, high, speed, cycles, rate = None,
+                       verbose = True, until = None, buffer_size = 10000,
+                       keep = 1000, summary_fname = None, bin_width = 1.0):
+        """
+        Cycles the machine between two limits, collecting data with bounded memory.
+        The motor moves up at speed (mm/min) until value reaches high, then down
+        until it reaches low, which completes one cycle. This repeats until cycles
+        cycles have run, the optional condition until (see collect_until) is met,
+        or a key is hit. The motor is reversed as soon as a limit is seen, before
+        anything else is done with the sample, and stopped at the end.
+        Samples are NOT stored in self.data. The most recent buffer_size of them
+        are in self.ring (a cyclic.RingBuffer), and all of them go to the stream
+        file if start_stream was called first. Each cycle is summarized by
+        self.cycle_tracker (a cyclic.CycleTracker), which keeps the latest keep
+        summaries and writes all of them to the stream file summary_fname, if
+        given. Load is rainflow counted into self.rainflow (a cyclic.RainflowCounter)
+        with bins bin_width lbs wide. Registered stats are updated as usual.
+        rate and verbose work as for collect_until.
+        """
+        writer = None
+        try:
+            vi = self.col[value]
+            stop = None
+            if until is not None:
+                stop = self.make_condition(until)
+            if summary_fname is not None:
+                writer = StreamWriter(summary_fname, CycleTracker.COLUMNS)
+            tracker = CycleTracker(self.col, keep, writer)
+        except KeyError as ke:
+            self.exit_error("An invalid column was asked for: " + str(ke))
+        self.ring = RingBuffer(buffer_size)
+        self.rainflow = RainflowCounter(bin_width)
+        self.cycle_tracker = tracker
+        li = tracker.li
+        sched = self.make_scheduler(rate,
+            "collect_cycles %s [%s, %s]" % (value, low, high))
+        if verbose:
+            reporter = StatusReporter(lambda point: "cycle " + str(tracker.count + 1) + \
+                "  " + value + ": " + str(round(point[vi],2)) + "\tlimits: " + \
+                str(low) + " to " + str(high), self.report_rate).start()
+        going_up = True
+        self.fl.start_motor(speed, down = False)
+        try:
+            while tracker.count < cycles:
+                sched.wait()
+                point = self.collect_data()
+                x = point[vi]
+                finished = False
+                if going_up and x >= high:
+                    self.fl.start_motor(speed, down = True)
+                    going_up = False
+                elif not going_up and x <= low:
+                    self.fl.start_motor(speed, down = False)
+                    going_up = True
+                    finished = True
+                for stat in self.stats.itervalues():
+                    stat.update(point)
+                self.ring.append(point)
+                if self.stream is not None:
+                    self.stream.append(point)
+                if self.publisher is not None:
+                    self.publisher.append(point)
+                tracker.update(point)
+                if finished:
+                    tracker.finish_cycle()
+                self.rainflow.update(point[li])
+                if stop is not None and stop.update(point):
+                    break
+                if verbose:
+                    reporter.post(point)
+                self.check_stop()
+        finally:
+            self.ensure_stopped()
+            if verbose:
+                reporter.stop()
+            if writer is not None:
+                writer.close()
+            self.stop_signal.release()
+            self.phase_stats.append(sched.stats)
+
+    def wait_until(self, value, fun = None, threshold = None, verbose = True):
         """
         See collect_until. Same operation, but no data is collected.
         It does still ask for data in order to check the end condition, but
         does not store it. This means position will remain accurate during wait.
+        The data is still published, if start_publishing was called.
         """
         localdat = self.collect_data()
-        while not self.funs[fun](localdat[self.col[value]], threshold):
-            localdat = self.collect_data()
+        try:
+            cond = self.make_condition(value, fun, threshold)
+            met = cond.update(localdat)
+        except KeyError as ke:
+            self.exit_error("An invalid column was asked for: " + str(ke))
+        if verbose:
+            reporter = self.start_reporter(cond)
+        try:
+            while not met:
+                localdat = self.collect_data()
+                met = cond.update(localdat)
+                if self.publisher is not None:
+                    self.publisher.append(localdat)
+                if verbose:
+                    reporter.post(localdat)
+                clock.sleep(.01)
+                self.check_stop()
+        finally:
             if verbose:
-                print value + ": " + str(round(localdat[self.col[value]],2)) + \
-                    "\ttarget: " + fun + " " + str(threshold)
-            time.sleep(.01)
-            if msvcrt.kbhit():
-                msvcrt.getch()
-                self.fl.disconnect()
-                self.exit_error("Test terminated early by user.")
+                reporter.stop()
+            self.stop_signal.release()
 
     def wait_for(self, sec):
         """
@@ -187,45 +608,93 @@ class BasicTest():
         It keeps track of time more accurately.
         Will keep position updated if motor is moving.
         """
-        start = time.time()
-        while time.time() - start < sec:   
+        start = clock.now()
+        while clock.now() - start < sec:   
             p = self.fl.get_linear_position()  # Keeps position accurate
+            self.feed_watchdog()
 
-    def collect_until_keyboard(self, rate = 1000000):
+    def collect_until_keyboard(self, rate = None, storage = None):
         """
-        Collects data until user hits any key on the keyboard.
+        Collects data until user hits any key on the keyboard. If the test is
+        otherwise asked to stop (see check_stop), it ends through exit_error.
         The rate option specifies sampling rate in Hz. With a 9600 baud Loadstar, 
-        this cannot exceed 30 Hz. The default, 1Mhz, simply means "as fast as possible."
-        """
-        loop_time = 1/rate
-        while True:
-            loop_start = time.time()
-            self.data.append(self.collect_data())
-            while (time.time()-loop_start) < loop_time:
-                pass
-            if msvcrt.kbhit():
-                msvcrt.getch()
-                return
+        this cannot exceed 30 Hz; loadcal.py finds faster settings. The default, None, simply means "as fast as possible."
+        As with collect_until, timing statistics are appended to self.phase_stats,
+        and storage can be a storage policy which limits which datapoints are stored.
+        """
+        self.bind_storage(storage)
+        sched = self.make_scheduler(rate, "collect_until_keyboard")
+        try:
+            while True:
+                sched.wait()
+                self.handle_point(self.collect_data(), storage)
+                if self.check_keyboard():
+                    return
+        finally:
+            self.stop_signal.release()
+            self.flush_storage(storage)
+            self.phase_stats.append(sched.stats)
 
     def wait_for_keyboard(self):
         """
         Machine continues to do whatever it was doing until user hits keyboard.
+        If the test is otherwise asked to stop (see check_stop), it ends
+        through exit_error.
         Data is collected but discarded to keep position accurate.
         """
-        while True:   
-            p = self.fl.get_linear_position()  # Keeps position accurate
-            if msvcrt.kbhit():
-                msvcrt.getch()
-                return
+        try:
+            while True:
+                p = self.fl.get_linear_position()  # Keeps position accurate
+                self.feed_watchdog()
+                if self.check_keyboard():
+                    return
+        finally:
+            self.stop_signal.release()
 
-    def write_file(self, h):
+    def write_file(self, h, precision = None, fname = None):
         """
         Writes the collected data to a file.
         The user can specify a text header, h, which will be written to the top.
-        A graphical "Save As" dialogue appears to ask the user where to save the file.
+        Values keep 12 significant digits, as str() writes them, unless
+        precision is given, in which case they have that many decimal places.
+        Unless a file name is given as fname, a graphical "Save As" dialogue
+        appears to ask the user where to save the file. Give fname when
+        running without a display.
+        Choosing a name ending in .gz writes a gzip compressed file.
         """
         if not len(self.data):
             self.exit_error("Can't write file - no data available.")
+        if fname is None:
+            fname = self.ask_file_name()
+        if fname == '':
+            print "Save aborted."
+            return
+        write_csv(fname, self.data, h, precision)
+
+    def archive_data(self, archive, h = "", params = None, name = None):
+        """
+        Adds the collected data to archive, an Archive or the directory of
+        one (see archive.py), where it can be searched by its parameters and
+        summary statistics later. h is a text header like write_file's, and
+        params a dictionary of parameters, such as {"speed": 10}; by default
+        they are read from the "label: value" lines of h. Returns the test's id.
+        """
+        if not len(self.data):
+            self.exit_error("Can't archive - no data available.")
+        if params is None:
+            params = header_params(h)
+        labels = sorted(self.col, key = self.col.get)
+        if isinstance(archive, basestring):
+            archive = Archive(archive)
+            try:
+                return archive.add(self.data, labels, h, params, name)
+            finally:
+                archive.close()
+        return archive.add(self.data, labels, h, params, name)
+
+    def ask_file_name(self):
+        """Asks the user where to save data with a "Save As" dialogue. Loads Tk."""
+        import Tkinter, tkFileDialog
         root = Tkinter.Tk()         # These "root" calls are annoying Tk hacks to make
         root.withdraw()             # the file dialogue appear by itself with focus.
         root.overrideredirect(True)
@@ -234,20 +703,8 @@ class BasicTest():
         root.lift()
         root.focus_force()
         options = {'defaultextension': '.csv', \
-            'filetypes':[('CSV','.csv')], 'title': "Save Data As"}
-        fname = tkFileDialog.asksaveasfilename(**options)
-        if fname == '':
-            print "Save aborted."
-            return
-        f = open(fname,'w')
-        f.write(h)
-        for datum in self.data:
-            for value in range(0,len(datum)):
-                f.write(str(datum[value]))
-                if not (value == len(datum) - 1):
-                    f.write(",")
-            f.write("\n")
-        f.close()
+            'filetypes':[('CSV','.csv'), ('Compressed CSV','.gz')], 'title': "Save Data As"}
+        return tkFileDialog.asksaveasfilename(**options)
 
 if __name__ == '__main__':
     machine = Freeloader()
@@ -0,0 +1,241 @@
+"""
+benchmark.py
+
+End-to-end benchmarks of the acquisition path.
+
+Measures the pieces every sample is made of, and the sample rate they add up to:
+
+    interact              one Dynamixel instruction/status round trip
+    servo_read            position and load of every servo on the bus,
+                          one SYNC_READ under Protocol 2.0
+    read_cell             one load cell reading
+    get_linear_position   one position update, with the motor turning
+    collect_until         samples per second achieved by BasicTest.collect_until
+
+By default the benchmarks run against the simulated MX-64 and Loadstar from
+simulated.py, paced at realistic baud rates, so results are repeatable and
+need no machine. With --hardware they run against a real, autoconnected
+Freeloader instead.
+
+Results give latency percentiles and throughput for every scenario. They can
+be saved as JSON and compared against an earlier run, to catch regressions:
+
+    python benchmark.py --out before.json
+    ... change something ...
+    python benchmark.py --compare before.json
+
+The exit status is 1 if any scenario got slower by more than --tolerance.
+
+--protocol 2 runs everything over Dynamixel Protocol 2.0 instead of 1.0, and
+--compare-protocols runs the Dynamixel scenarios under both and compares
+them, with --servos simulated servos sharing the bus:
+
+    python benchmark.py --compare-protocols --servos 4
+"""
+
+import sys, json, time, platform, argparse
+import clock, dynamixel
+
+def percentile(ordered, p):
+    """Nearest-rank percentile p (0-100) of an already sorted list."""
+    if not ordered:
+        return float('nan')
+    i = int(round(p / 100.0 * (len(ordered) - 1)))
+    return ordered[i]
+
+def summarize(latencies, elapsed):
+    """Turns a list of latencies in seconds into the result dictionary of a scenario."""
+    ordered = sorted(latencies)
+    n = len(ordered)
+    return {'count': n,
+            'mean_ms': 1000.0 * sum(ordered) / n if n else float('nan'),
+            'p50_ms': 1000.0 * percentile(ordered, 50),
+            'p90_ms': 1000.0 * percentile(ordered, 90),
+            'p99_ms': 1000.0 * percentile(ordered, 99),
+            'max_ms': 1000.0 * ordered[-1] if n else float('nan'),
+            'throughput_hz': n / elapsed if elapsed > 0 else float('nan')}
+
+def time_calls(fun, duration):
+    """Calls fun repeatedly for duration seconds. Returns its summarized latencies."""
+    latencies = []
+    start = clock.now()
+    end = start + duration
+    t = start
+    while t < end:
+        fun()
+        t1 = clock.now()
+        latencies.append(t1 - t)
+        t = t1
+    return summarize(latencies, t - start)
+
+def servo_ids(fl):
+    """The IDs of the servos on fl's bus: 1, and any chained to a simulated one."""
+    return [1] + [servo.id for servo in getattr(fl.dyna.port, 'chain', [])]
+
+def bench_interact(fl, duration):
+    packet = fl.dyna._ReadPacket(*fl.dyna.table['present_position'])
+    return time_calls(lambda: fl.dyna.Interact(1, packet), duration)
+
+def bench_servo_read(fl, duration):
+    ids = servo_ids(fl)
+    return time_calls(lambda: fl.dyna.GetPositionsAndLoads(ids), duration)
+
+def bench_read_cell(fl, duration):
+    return time_calls(fl.read_cell, duration)
+
+def bench_get_linear_position(fl, duration):
+    fl.start_motor(30)
+    try:
+        return time_calls(fl.get_linear_position, duration)
+    finally:
+        fl.stop_motor()
+
+def bench_collect_until(fl, duration):
+    from basictest import BasicTest
+    from conditions import elapsed
+    test = BasicTest(fl)
+    test.initialize_data()
+    test.collect_until(elapsed(duration), verbose = False)
+    times = [point[test.col['time']] for point in test.data]
+    result = summarize([b - a for a, b in zip(times, times[1:])], times[-1] - times[0])
+    result['jitter_ms'] = test.phase_stats[-1].jitter * 1000
+    return result
+
+# Every scenario, in the order they run.
+SCENARIOS = [('interact', bench_interact),
+             ('servo_read', bench_servo_read),
+             ('read_cell', bench_read_cell),
+             ('get_linear_position', bench_get_linear_position),
+             ('collect_until', bench_collect_until)]
+
+def run(fl, duration = 2.0, names = None, verbose = True):
+    """
+    Runs the scenarios called names (all by default) against the connected
+    Freeloader fl, each for duration seconds. Returns {name: results}.
+    """
+    results = {}
+    for name, fun in SCENARIOS:
+        if names and name not in names:
+            continue
+        if verbose:
+            print "Running " + name + "..."
+        results[name] = fun(fl, duration)
+    return results
+
+def compare(old, new, tolerance = .1):
+    """
+    Compares two sets of scenario results. Prints the change in median latency
+    and throughput of each, and returns the names of those which got worse
+    by more than tolerance (0.1 = 10%).
+    """
+    regressions = []
+    for name in sorted(new):
+        if name not in old:
+            continue
+        a, b = old[name], new[name]
+        latency = b['p50_ms'] / a['p50_ms'] - 1 if a['p50_ms'] else 0.0
+        throughput = b['throughput_hz'] / a['throughput_hz'] - 1 \
+            if a['throughput_hz'] else 0.0
+        flag = ""
+        if latency > tolerance or throughput < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print "%-20s p50 %+6.1f%%  throughput %+6.1f%%%s" % (name, latency * 100,
+            throughput * 100, flag)
+    return regressions
+
+def compare_protocols(duration = 2.0, servos = 1, dynabaud = 1000000, verbose = True):
+    """
+    Runs the Dynamixel scenarios on a simulated bus of servos MX-64s under
+    Protocol 1.0 and then 2.0. Prints both, and how 2.0 compares with 1.0.
+    Returns {protocol: results}.
+    """
+    from simulated import simulated_freeloader
+    names = ['interact', 'servo_read', 'get_linear_position']
+    out = {}
+    for protocol in (1, 2):
+        fl = simulated_freeloader(dynabaud = dynabaud, protocol = protocol,
+                                  servos = servos)
+        try:
+            out[protocol] = run(fl, duration, names, verbose)
+        finally:
+            fl.disconnect()
+        print "Protocol %d.0, %d servos at %d baud:" % (protocol, servos, dynabaud)
+        report(out[protocol])
+    print "Protocol 2.0 compared with 1.0:"
+    compare(out[1], out[2], float('inf'))
+    return out
+
+def report(results):
+    """Prints a table of scenario results."""
+    print "%-20s %8s %8s %8s %8s %8s %10s" % ("scenario", "count", "p50 ms",
+        "p90 ms", "p99 ms", "max ms", "per sec")
+    for name, fun in SCENARIOS:
+        if name in results:
+            r = results[name]
+            print "%-20s %8d %8.3f %8.3f %8.3f %8.3f %10.1f" % (name, r['count'],
+                r['p50_ms'], r['p90_ms'], r['p99_ms'], r['max_ms'], r['throughput_hz'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmark the acquisition path.")
+    parser.add_argument("--duration", type = float, default = 2.0,
+                        help = "seconds per scenario")
+    parser.add_argument("--scenario", action = "append",
+                        help = "run only this scenario (may be repeated)")
+    parser.add_argument("--out", help = "save results to this JSON file")
+    parser.add_argument("--compare", help = "compare against this earlier JSON file")
+    parser.add_argument("--tolerance", type = float, default = .1,
+                        help = "allowed slowdown before flagging a regression")
+    parser.add_argument("--hardware", action = "store_true",
+                        help = "use a real, autoconnected Freeloader")
+    parser.add_argument("--loadbaud", type = int,
+                        help = "load cell baud rate (default: as saved by loadcal.py)")
+    parser.add_argument("--loadsps", type = int,
+                        help = "load cell SPS (default: as saved by loadcal.py)")
+    parser.add_argument("--dynabaud", type = int, default = 1000000)
+    parser.add_argument("--protocol", type = int, choices = [1, 2], default = 1,
+                        help = "Dynamixel protocol version")
+    parser.add_argument("--servos", type = int, default = 1,
+                        help = "number of simulated servos on the bus")
+    parser.add_argument("--compare-protocols", action = "store_true",
+                        help = "compare Protocol 1.0 and 2.0 on a simulated bus")
+    args = parser.parse_args()
+
+    if args.compare_protocols:
+        compare_protocols(args.duration, args.servos, args.dynabaud)
+        sys.exit(0)
+
+    if args.hardware:
+        from freeloader import Freeloader
+        fl = Freeloader()
+        fl.autoconnect(verbose = True, loadbaud = args.loadbaud,
+                       loadsps = args.loadsps, dynabaud = args.dynabaud,
+                       protocol = args.protocol)
+    else:
+        from simulated import simulated_freeloader
+        fl = simulated_freeloader(load = lambda: 10.0, noise = .01,
+            dynabaud = args.dynabaud, loadbaud = args.loadbaud or 9600, sps = args.loadsps or 120,
+            protocol = args.protocol, servos = args.servos)
+    try:
+        results = run(fl, args.duration, args.scenario)
+    finally:
+        fl.disconnect()
+    report(results)
+
+    if args.out:
+        out = {'created': time.time(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'hardware': args.hardware,
+               'config': {'loadbaud': args.loadbaud, 'loadsps': args.loadsps,
+                          'dynabaud': args.dynabaud, 'duration': args.duration,
+                          'protocol': args.protocol, 'servos': args.servos},
+               'scenarios': results}
+        with open(args.out, 'w') as f:
+            json.dump(out, f, indent = 2, sort_keys = True)
+        print "Results saved to " + args.out
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print "Compared with " + args.compare + ":"
+        if compare(old['scenarios'], results, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,91 @@
+"""
+clock.py
+
+The clock used for timing by PyLoader's test and scheduling code.
+
+On Windows, time.time() only ticks every 15.6 ms or so, which is far too
+coarse for pacing samples or measuring jitter. time.clock() has sub-microsecond
+resolution there, so now() is built from it, anchored to the wall clock once
+at import. Everywhere else time.time() is already fine-grained.
+
+Use clock.now() and clock.sleep() rather than the time module for anything
+which measures or paces acquisition.
+
+For simulations, a VirtualClock can be installed in place of the real one
+with use_virtual(). Virtual time stands still except when the thread which
+installed it sleeps, which moves it forward instantly. Together with the
+simulated devices of simulated.py, which wait by sleeping, this runs hours of
+test in seconds, with exactly the timing the real devices would give it.
+Other threads, such as those of sensors, read virtual time but can't move
+it. Their sleeps last at most a millisecond of real time, whatever they ask
+for, so a thread which sleeps in a loop polls every millisecond until virtual
+time has moved on far enough.
+"""
+
+import sys, time, threading
+
+if sys.platform == 'win32':
+    _wall_start = time.time()
+    _clock_start = time.clock()
+
+    def _real_now():
+        return _wall_start + (time.clock() - _clock_start)
+else:
+    _real_now = time.time
+
+# The installed VirtualClock, or None to use the real one.
+_virtual = None
+
+class VirtualClock():
+    """
+    Simulated time, starting at start seconds (the real time by default),
+    which advances only when the owner thread sleeps or calls advance_to.
+    """
+
+    def __init__(self, start = None, owner = None):
+        self.t = _real_now() if start is None else float(start)
+        self.owner = owner or threading.current_thread()
+
+    def sleep(self, sec):
+        """
+        Moves time forward by sec in the owner thread. In any other thread,
+        sleeps for sec or a millisecond of real time, whichever is shorter.
+        """
+        if threading.current_thread() is self.owner:
+            self.t += sec
+        else:
+            time.sleep(min(sec, .001))
+
+    def advance_to(self, t):
+        """Moves time forward to t, if it is in the future."""
+        if t > self.t:
+            self.t = t
+
+def use_virtual(start = None):
+    """Installs and returns a new VirtualClock, owned by the calling thread."""
+    global _virtual
+    _virtual = VirtualClock(start)
+    return _virtual
+
+def use_real():
+    """Goes back to the real clock."""
+    global _virtual
+    _virtual = None
+
+def virtual():
+    """The installed VirtualClock, or None if the real clock is in use."""
+    return _virtual
+
+def now():
+    """Returns the current time in seconds, with high resolution."""
+    if _virtual is not None:
+        return _virtual.t
+    return _real_now()
+
+def sleep(sec):
+    """Sleeps for sec seconds. Negative values return immediately."""
+    if sec > 0:
+        if _virtual is not None:
+            _virtual.sleep(sec)
+        else:
+            time.sleep(sec)
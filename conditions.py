@@ -0,0 +1,366 @@
+"""
+conditions.py
+
+Stop conditions for BasicTest.collect_until and wait_until.
+
+A condition is built once, before a collection phase, out of simple pieces:
+
+    above("load", 10)               load greater than 10
+    below("position", 0)            position less than 0
+    drop_from_peak("load", .5)      load has fallen 50% below its running peak
+    sharp_drop("load", 5, .05)      load has fallen by 5 within 50 ms
+    slope_below("load", "position", 1.0, window = 20)
+                                    stiffness over the last 20 samples under 1.0
+    window("position", 5, 10)       position between 5 and 10
+    elapsed(60)                     60 seconds since the phase started
+    stat_below(self.stats["noise"], .05)
+                                    a registered onlinestats accumulator
+                                    compared against a constant
+
+and combined with & (AND), | (OR) and ~ (NOT):
+
+    stop = drop_from_peak("load", .5, min_peak = 5) | elapsed(600)
+    self.collect_until(stop)
+
+Before collection starts, BasicTest binds the condition to its columns, which
+looks up every column name exactly once. After that, each new datapoint is fed
+to update(), which does a constant amount of work no matter how long the test
+has run, and returns True once the condition is met.
+"""
+
+import collections
+from onlinestats import RollingSlope
+
+class Condition():
+    """
+    Base class of all conditions. Subclasses override _bind, reset, update
+    and __str__. Conditions combine with &, | and ~.
+    """
+
+    def bind(self, col):
+        """
+        Resolves column names using col, a dictionary like BasicTest.col, and
+        resets any running state. Raises KeyError for an unknown column.
+        Returns the condition itself, so calls can be chained.
+        """
+        self._bind(col)
+        self.reset()
+        return self
+
+    def _bind(self, col):
+        pass
+
+    def reset(self):
+        """Clears running state such as peaks and windows."""
+        pass
+
+    def update(self, point):
+        """Feeds in the newest datapoint. Returns True if the condition is met."""
+        raise NotImplementedError
+
+    def columns(self):
+        """Returns the names of the columns this condition watches."""
+        return []
+
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+class Compare(Condition):
+    """Compares one column against a constant using a two-argument function."""
+
+    def __init__(self, value, fun, threshold, name = None):
+        """
+        value is the column name, fun a function like those in BasicTest.funs,
+        and threshold the constant. name describes fun when printing.
+        """
+        self.value = value
+        self.fun = fun
+        self.threshold = threshold
+        self.name = name or getattr(fun, '__name__', 'compare')
+
+    def _bind(self, col):
+        self.index = col[self.value]
+
+    def update(self, point):
+        return self.fun(point[self.index], self.threshold)
+
+    def columns(self):
+        return [self.value]
+
+    def __str__(self):
+        return "%s %s %s" % (self.value, self.name, self.threshold)
+
+def above(value, threshold):
+    """Met while column value is greater than threshold."""
+    return Compare(value, lambda x, y: x > y, threshold, "greaterthan")
+
+def below(value, threshold):
+    """Met while column value is less than threshold."""
+    return Compare(value, lambda x, y: x < y, threshold, "lessthan")
+
+class Window(Condition):
+    """Met while a column is inside (or, with inside = False, outside) [low, high]."""
+
+    def __init__(self, value, low, high, inside = True):
+        self.value = value
+        self.low = low
+        self.high = high
+        self.inside = inside
+
+    def _bind(self, col):
+        self.index = col[self.value]
+
+    def update(self, point):
+        x = point[self.index]
+        return (self.low <= x <= self.high) == self.inside
+
+    def columns(self):
+        return [self.value]
+
+    def __str__(self):
+        where = "inside" if self.inside else "outside"
+        return "%s %s [%s, %s]" % (self.value, where, self.low, self.high)
+
+window = Window
+
+class DropFromPeak(Condition):
+    """
+    Met once a column has fallen by fraction (0.5 = 50%) below its running peak.
+    Detection is only armed once the peak has reached min_peak, so noise near
+    zero at the start of a test can't trigger it.
+    """
+
+    def __init__(self, value, fraction, min_peak = 0):
+        self.value = value
+        self.fraction = fraction
+        self.min_peak = min_peak
+
+    def _bind(self, col):
+        self.index = col[self.value]
+
+    def reset(self):
+        self.peak = None
+
+    def update(self, point):
+        x = point[self.index]
+        if self.peak is None or x > self.peak:
+            self.peak = x
+            return False
+        return self.peak >= self.min_peak and \
+            x <= self.peak - abs(self.peak) * self.fraction
+
+    def columns(self):
+        return [self.value]
+
+    def __str__(self):
+        return "%s drops %g%% from peak (armed at %s)" % (self.value,
+            self.fraction * 100, self.min_peak)
+
+drop_from_peak = DropFromPeak
+
+class SharpDrop(Condition):
+    """
+    Met when a column has fallen by more than amount within the last window
+    seconds of the time column, as load does when a specimen breaks. The
+    highest value in the window is tracked with a monotonic queue, so each
+    sample costs constant time on average, whatever the sample rate.
+    """
+
+    def __init__(self, value, amount, window = .05, time_column = "time"):
+        self.value = value
+        self.amount = amount
+        self.window = window
+        self.time_column = time_column
+
+    def _bind(self, col):
+        self.index = col[self.value]
+        self.ti = col[self.time_column]
+
+    def reset(self):
+        self.highs = collections.deque()     # (time, value), values decreasing
+
+    def update(self, point):
+        t = point[self.ti]
+        x = point[self.index]
+        highs = self.highs
+        while highs and highs[-1][1] <= x:
+            highs.pop()
+        highs.append((t, x))
+        while highs[0][0] < t - self.window:
+            highs.popleft()
+        return highs[0][1] - x > self.amount
+
+    def columns(self):
+        return [self.value]
+
+    def __str__(self):
+        return "%s drops by %s within %s s" % (self.value, self.amount, self.window)
+
+sharp_drop = SharpDrop
+
+class SlopeBelow(Condition):
+    """
+    Met when the least-squares slope of column y against column x, over the
+    last window samples, falls below threshold. For example load against
+    position gives the current stiffness. Never met until the window is full.
+    The fit is an onlinestats.RollingSlope, so each sample costs the same
+    whatever the window size.
+    """
+
+    def __init__(self, y, x, threshold, window = 20):
+        self.slope = RollingSlope(y, x, window)
+        self.threshold = threshold
+
+    def _bind(self, col):
+        self.slope._bind(col)
+
+    def reset(self):
+        self.slope.reset()
+
+    def update(self, point):
+        self.slope.update(point)
+        return self.slope.value is not None and self.slope.value < self.threshold
+
+    def columns(self):
+        return [self.slope.y, self.slope.x]
+
+    def __str__(self):
+        return "%s below %s" % (self.slope, self.threshold)
+
+slope_below = SlopeBelow
+
+class StatCompare(Condition):
+    """
+    Compares the value of an accumulator from onlinestats.py against a constant.
+    The accumulator must be registered with the test (BasicTest.add_stat) so
+    that it is kept up to date; this condition only reads it.
+    """
+
+    def __init__(self, stat, fun, threshold, name = None):
+        self.stat = stat
+        self.fun = fun
+        self.threshold = threshold
+        self.name = name or getattr(fun, '__name__', 'compare')
+
+    def update(self, point):
+        return self.stat.value is not None and self.fun(self.stat.value, self.threshold)
+
+    def __str__(self):
+        return "%s %s %s" % (self.stat, self.name, self.threshold)
+
+def stat_above(stat, threshold):
+    """Met while the accumulator's value is greater than threshold."""
+    return StatCompare(stat, lambda x, y: x > y, threshold, "greaterthan")
+
+def stat_below(stat, threshold):
+    """Met while the accumulator's value is less than threshold."""
+    return StatCompare(stat, lambda x, y: x < y, threshold, "lessthan")
+
+class Elapsed(Condition):
+    """
+    Met once sec seconds have passed since the first datapoint this condition
+    saw, measured with the time column.
+    """
+
+    def __init__(self, sec, value = "time"):
+        self.sec = sec
+        self.value = value
+
+    def _bind(self, col):
+        self.index = col[self.value]
+
+    def reset(self):
+        self.start = None
+
+    def update(self, point):
+        t = point[self.index]
+        if self.start is None:
+            self.start = t
+        return t - self.start >= self.sec
+
+    def columns(self):
+        return [self.value]
+
+    def __str__(self):
+        return "%s s elapsed" % self.sec
+
+elapsed = Elapsed
+
+class All(Condition):
+    """Met when every one of its conditions is met (AND)."""
+
+    joiner = " AND "
+
+    def __init__(self, *conditions):
+        self.conditions = []
+        for c in conditions:
+            # Flatten a & b & c into a single level.
+            if c.__class__ is self.__class__:
+                self.conditions.extend(c.conditions)
+            else:
+                self.conditions.append(c)
+
+    def _bind(self, col):
+        for c in self.conditions:
+            c._bind(col)
+
+    def reset(self):
+        for c in self.conditions:
+            c.reset()
+
+    def update(self, point):
+        # Every condition sees every point, so that running state like
+        # peaks stays correct even when the result is already decided.
+        met = True
+        for c in self.conditions:
+            if not c.update(point):
+                met = False
+        return met
+
+    def columns(self):
+        out = []
+        for c in self.conditions:
+            out.extend(v for v in c.columns() if v not in out)
+        return out
+
+    def __str__(self):
+        return "(" + self.joiner.join(str(c) for c in self.conditions) + ")"
+
+class Any(All):
+    """Met when at least one of its conditions is met (OR)."""
+
+    joiner = " OR "
+
+    def update(self, point):
+        met = False
+        for c in self.conditions:
+            if c.update(point):
+                met = True
+        return met
+
+class Not(Condition):
+    """Met when its condition is not."""
+
+    def __init__(self, condition):
+        self.condition = condition
+
+    def _bind(self, col):
+        self.condition._bind(col)
+
+    def reset(self):
+        self.condition.reset()
+
+    def update(self, point):
+        return not self.condition.update(point)
+
+    def columns(self):
+        return self.condition.columns()
+
+    def __str__(self):
+        return "NOT " + str(self.condition)
@@ -0,0 +1,166 @@
+"""
+csvexport.py
+
+Fast bulk CSV export for collected data.
+
+Writing a CSV one value at a time, with a str() and an f.write() for every
+value and every comma, is very slow for long tests. The functions here instead
+format a whole chunk of rows with a single % operation and hand the result
+to a file with a large buffer. Output can optionally be gzip compressed.
+
+By default values keep 12 significant digits, exactly as str() writes
+floats, so small values such as strains aren't rounded away. Pass precision
+to write a fixed number of decimal places instead.
+
+Data can come from anywhere which can provide rows in chunks:
+    - A list of datapoints, like BasicTest.data (write_csv)
+    - Any iterable of chunks of rows, like datastream.iter_stream (write_csv_chunks)
+    - Columns of equal length, such as lists or arrays (columns_to_chunks)
+
+Running this module directly runs a benchmark which exports a 10-million-row
+dataset. Pass a different number of rows as the first argument if you like.
+"""
+
+import gzip, itertools
+
+# Rows formatted per % operation and write call.
+CHUNK_ROWS = 20000
+# Buffer size for the output file.
+BUFFER_SIZE = 1 << 20
+
+def value_format(precision = None):
+    """
+    The % format of one value: precision decimal places, or with None, the
+    12 significant digits of str().
+    """
+    if precision is None:
+        return "%.12g"
+    return "%%.%df" % precision
+
+def open_output(fname, compress = None):
+    """
+    Opens fname for writing with a large buffer. If compress is True, or if it
+    is None and fname ends in .gz, the output is gzip compressed.
+    """
+    if compress is None:
+        compress = fname.endswith(".gz")
+    if compress:
+        return gzip.GzipFile(fname, 'wb', compresslevel = 6)
+    return open(fname, 'w', BUFFER_SIZE)
+
+def format_chunk(chunk, precision = None):
+    """
+    Formats a list of rows as CSV text in one operation. All rows should have
+    the same number of values; rows which don't are formatted one at a time.
+    """
+    if not chunk:
+        return ""
+    ncols = len(chunk[0])
+    fmt = value_format(precision)
+    rowfmt = ",".join([fmt] * ncols) + "\n"
+    flat = tuple(itertools.chain.from_iterable(chunk))
+    if len(flat) == ncols * len(chunk):
+        return (rowfmt * len(chunk)) % flat
+    # Ragged data. Slower, but still correct.
+    out = []
+    for row in chunk:
+        out.append(",".join([fmt] * len(row)) % tuple(row) + "\n")
+    return "".join(out)
+
+def write_csv_chunks(fname, chunks, header = "", precision = None, compress = None):
+    """
+    Writes the CSV file fname from an iterable of chunks, where each chunk is a
+    list of rows. The text header is written first. Returns the number of rows.
+    """
+    nrows = 0
+    f = open_output(fname, compress)
+    try:
+        f.write(header)
+        for chunk in chunks:
+            f.write(format_chunk(chunk, precision))
+            nrows += len(chunk)
+    finally:
+        f.close()
+    return nrows
+
+def chunk_rows(rows, size = CHUNK_ROWS):
+    """Splits a list of rows into chunks of size rows."""
+    for i in xrange(0, len(rows), size):
+        yield rows[i:i + size]
+
+def columns_to_chunks(columns, size = CHUNK_ROWS):
+    """
+    Turns a list of equal-length columns (lists, tuples or arrays) into chunks
+    of rows, without ever building the whole table of rows in memory.
+    """
+    length = min(len(c) for c in columns)
+    for i in xrange(0, length, size):
+        yield zip(*[c[i:i + size] for c in columns])
+
+def write_csv(fname, rows, header = "", precision = None, compress = None):
+    """
+    Writes a list of datapoints, like BasicTest.data, to the CSV file fname
+    with the text header at the top. Returns the number of rows written.
+    """
+    return write_csv_chunks(fname, chunk_rows(rows), header, precision, compress)
+
+def _naive_write(fname, rows, header):
+    """The original per-value export, kept for comparison in the benchmark."""
+    f = open(fname, 'w')
+    f.write(header)
+    for datum in rows:
+        for value in range(0, len(datum)):
+            f.write(str(datum[value]))
+            if not (value == len(datum) - 1):
+                f.write(",")
+        f.write("\n")
+    f.close()
+
+def _synthetic_chunks(nrows, size = CHUNK_ROWS):
+    """Generates a plausible time/position/load dataset in chunks."""
+    for start in xrange(0, nrows, size):
+        stop = min(start + size, nrows)
+        yield [[i * .001, i * 1.25e-5, 50.0 - (i % 977) * .01]
+               for i in xrange(start, stop)]
+
+
+if __name__ == '__main__':
+    import sys, os, time, tempfile
+
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    header = "Time,Displacement,Load\nsec,mm,lbs\n"
+    tmp = tempfile.mkdtemp()
+    print "Exporting %d rows of time, position, load..." % nrows
+
+    start = time.time()
+    fname = os.path.join(tmp, "bulk.csv")
+    write_csv_chunks(fname, _synthetic_chunks(nrows), header)
+    elapsed = time.time() - start
+    print "Bulk export:  %.2f s, %.0f rows/s, %.1f MB" % (elapsed, nrows / elapsed,
+        os.path.getsize(fname) / 1e6)
+    os.remove(fname)
+
+    start = time.time()
+    fname = os.path.join(tmp, "bulk.csv.gz")
+    write_csv_chunks(fname, _synthetic_chunks(nrows), header)
+    elapsed = time.time() - start
+    print "Gzip export:  %.2f s, %.0f rows/s, %.1f MB" % (elapsed, nrows / elapsed,
+        os.path.getsize(fname) / 1e6)
+    os.remove(fname)
+
+    # The old way is too slow to run on the full set, so time a slice of it.
+    sample = min(nrows, 1000000)
+    rows = list(itertools.chain.from_iterable(_synthetic_chunks(sample)))
+    fname = os.path.join(tmp, "naive.csv")
+    start = time.time()
+    _naive_write(fname, rows, header)
+    naive = time.time() - start
+    os.remove(fname)
+    fname = os.path.join(tmp, "bulk.csv")
+    start = time.time()
+    write_csv(fname, rows, header)
+    bulk = time.time() - start
+    os.remove(fname)
+    os.rmdir(tmp)
+    print "On %d in-memory rows: per-value %.2f s, bulk %.2f s (%.1fx faster)" % \
+        (sample, naive, bulk, naive / bulk)
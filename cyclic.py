@@ -0,0 +1,188 @@
+"""
+cyclic.py
+
+Building blocks for cyclic (fatigue) tests with bounded memory.
+
+A fatigue test may run for hundreds of thousands of cycles, far more data than
+can be kept in BasicTest.data. BasicTest.collect_cycles uses the pieces here
+instead, so its memory use stays the same however many cycles run:
+
+    RingBuffer        keeps only the most recent samples
+    RainflowCounter   counts load cycles as they happen (ASTM E1049 rainflow),
+                      into a histogram of fixed size
+    CycleTracker      summarizes every machine cycle (peak, valley, hysteresis
+                      loop area) as it completes, and keeps only recent ones
+
+Every sample can still be kept on disk with BasicTest.start_stream, and every
+cycle summary with a datastream.StreamWriter given to the CycleTracker.
+"""
+
+import collections
+
+class RingBuffer():
+    """A fixed-size buffer of the most recent samples."""
+
+    def __init__(self, size):
+        self.buffer = collections.deque(maxlen = size)
+        self.total = 0
+
+    def append(self, point):
+        """Adds a sample, dropping the oldest if the buffer is full."""
+        self.buffer.append(point)
+        self.total += 1
+
+    def latest(self, n = None):
+        """Returns the n most recent samples (all of them by default), oldest first."""
+        if n is None or n >= len(self.buffer):
+            return list(self.buffer)
+        return list(self.buffer)[-n:]
+
+    def __len__(self):
+        return len(self.buffer)
+
+class RainflowCounter():
+    """
+    Incremental rainflow cycle counter. Samples go in one at a time; turning
+    points are found on the fly, ignoring wiggles smaller than gate, and cycles
+    are counted as soon as they close. Counts are kept in a histogram keyed by
+    (range bin, mean bin), bin_width wide, so memory doesn't grow with cycles.
+    """
+
+    def __init__(self, bin_width = 1.0, gate = 0.0):
+        self.bin_width = float(bin_width)
+        self.gate = gate
+        self.histogram = collections.defaultdict(float)
+        self.cycles = 0.0
+        self.reversals = 0
+        self.stack = []
+        self._extreme = None
+        self._pending = False
+        self._direction = 0
+
+    def update(self, x):
+        """Feeds in a sample. Returns True if it revealed a new turning point."""
+        if self._extreme is None:
+            self._extreme = x
+            self.reversals += 1
+            self.cycles += self._push(x, self.stack, self.histogram)
+            return False
+        turned = False
+        if self._direction >= 0 and x >= self._extreme:
+            self._direction = 1
+        elif self._direction <= 0 and x <= self._extreme:
+            self._direction = -1
+        elif abs(x - self._extreme) > self.gate:
+            # Reversed by more than the gate, so the extreme was a turning point.
+            self.reversals += 1
+            self.cycles += self._push(self._extreme, self.stack, self.histogram)
+            self._direction = -self._direction
+            turned = True
+        else:
+            return False
+        self._extreme = x
+        self._pending = True
+        return turned
+
+    def _push(self, x, stack, histogram):
+        """Adds a turning point to stack. Counts the cycles it closes into histogram."""
+        counted = 0.0
+        stack.append(x)
+        while len(stack) >= 3:
+            recent = abs(stack[-1] - stack[-2])
+            previous = abs(stack[-2] - stack[-3])
+            if recent < previous:
+                break
+            if len(stack) == 3:
+                # The range includes the starting point: half a cycle.
+                histogram[self._key(stack[0], stack[1])] += .5
+                counted += .5
+                del stack[0]
+            else:
+                histogram[self._key(stack[-3], stack[-2])] += 1.0
+                counted += 1.0
+                del stack[-3:-1]
+        return counted
+
+    def _key(self, a, b):
+        """Histogram bin of the cycle between turning points a and b."""
+        return (int(abs(a - b) / self.bin_width), int(((a + b) / 2.0) // self.bin_width))
+
+    def result(self):
+        """
+        Returns the histogram as {(range, mean): count}, with range and mean the
+        bin centers. The half cycles still open at the end of the signal are
+        included, as rainflow counting requires, without changing the counter.
+        """
+        histogram = collections.defaultdict(float, self.histogram)
+        stack = list(self.stack)
+        if self._pending:
+            self._push(self._extreme, stack, histogram)
+        for a, b in zip(stack, stack[1:]):
+            histogram[self._key(a, b)] += .5
+        w = self.bin_width
+        return dict((((r + .5) * w, (m + .5) * w), n) for (r, m), n in histogram.items())
+
+class CycleTracker():
+    """
+    Summarizes machine cycles, each one a full up-and-down stroke. For every
+    cycle it records [cycle number, end time, peak load, valley load,
+    max position, min position, hysteresis], where hysteresis is the area of
+    the load-position loop, i.e. the energy lost in the cycle. The most recent
+    keep summaries are in self.summaries; a StreamWriter may be given as writer
+    to keep all of them on disk.
+    """
+
+    COLUMNS = ["cycle", "time", "peak", "valley", "max_position", "min_position",
+               "hysteresis"]
+
+    def __init__(self, col, keep = 1000, writer = None, load = "load",
+                 position = "position", time = "time"):
+        """col is a dictionary like BasicTest.col. Raises KeyError for unknown columns."""
+        self.li = col[load]
+        self.pi = col[position]
+        self.ti = col[time]
+        self.summaries = collections.deque(maxlen = keep)
+        self.writer = writer
+        self.count = 0
+        self._last = None
+
+    def update(self, point):
+        """Feeds in a sample of the current cycle."""
+        load = point[self.li]
+        pos = point[self.pi]
+        last = self._last
+        if last is None:
+            self.peak = self.valley = load
+            self.max_position = self.min_position = pos
+            self.area = 0.0
+        else:
+            if load > self.peak:
+                self.peak = load
+            elif load < self.valley:
+                self.valley = load
+            if pos > self.max_position:
+                self.max_position = pos
+            elif pos < self.min_position:
+                self.min_position = pos
+            # Trapezoidal integral of load d(position) around the loop.
+            self.area += (pos - last[self.pi]) * (load + last[self.li]) / 2.0
+        self._last = point
+
+    def finish_cycle(self):
+        """
+        Ends the current cycle at the last sample seen. Returns its summary,
+        or None if no samples were seen. The next sample starts a new cycle.
+        """
+        if self._last is None:
+            return None
+        self.count += 1
+        summary = [self.count, self._last[self.ti], self.peak, self.valley,
+                   self.max_position, self.min_position, abs(self.area)]
+        self.summaries.append(summary)
+        if self.writer is not None:
+            self.writer.append(summary)
+        # The last sample of this cycle is also the first of the next.
+        last = self._last
+        self._last = None
+        self.update(last)
+        return summary
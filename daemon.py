@@ -0,0 +1,517 @@
+"""
+daemon.py
+
+A long-lived process which keeps a Freeloader connected and shares it.
+
+Normally every script autoconnects, probing ports and setting up the load
+cell, and then owns the machine until it exits, so the control panel and a
+test can't run at the same time. Instead, start the daemon once:
+
+    python daemon.py
+
+It autoconnects, then polls position and load continuously with a
+MachineWorker (see machineworker.py), and serves any number of local
+clients. A script then starts at once by using a RemoteFreeloader, which
+has the same methods as a Freeloader:
+
+    fl = RemoteFreeloader()
+    fl.autoconnect()
+    test = TensionTest(fl)
+
+and the control panel attaches with "python freeloader_cp.py --daemon".
+Other tools can use a DaemonClient directly, to send commands or to
+subscribe to every sample the daemon takes.
+
+The protocol is JSON, one object per line, over TCP on 127.0.0.1.
+Requests are {"id": n, "cmd": name, "args": [...]}, and are answered with
+{"id": n, "result": ...} or {"id": n, "error": message}. Subscribed clients
+are also sent {"state": {...}} for every sample, with the keys of a
+MachineWorker state. Commands are:
+
+    up, down, stop, speed, move, zero, tare, record, stop_record
+                        passed on to the MachineWorker
+    start_motor         speed in mm/min, and whether to go down
+    state               returns the latest state
+    subscribe, unsubscribe
+    ping                returns "pong"
+    shutdown            stops the daemon
+
+record only writes inside the daemon's recording directory, the directory
+it was started in unless --record-dir is given. The file name must be
+relative and must not contain "..". The reply is the full path recorded to.
+
+Motor commands from every client go to the same machine, so the last one
+wins. When the client which last set the motor moving disconnects, for
+whatever reason, the motor is stopped. Subscribers which fall too far behind miss states rather than slow
+the daemon down.
+"""
+
+import os, re, sys, json, socket, signal, threading, argparse, Queue, SocketServer
+from freeloader import Freeloader, FreeloaderError
+from machineworker import MachineWorker
+
+PORT = 47800
+
+# Commands which are handed to the MachineWorker as they are.
+WORKER_COMMANDS = set(["up", "down", "stop", "speed", "move", "zero", "tare",
+                       "record", "stop_record"])
+
+# Commands which set the motor moving.
+MOTION_COMMANDS = set(["up", "down", "move", "start_motor"])
+
+class _Connection():
+    """The daemon's side of one client: an outgoing queue and its writer thread."""
+
+    def __init__(self, wfile, max_lines):
+        self.wfile = wfile
+        self.subscribed = False
+        self.lines = Queue.Queue(max_lines)
+        self._thread = threading.Thread(target = self._run, name = "DaemonConnection")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        alive = True
+        while True:
+            line = self.lines.get()
+            if line is None:
+                return
+            if not alive:
+                continue                # Keep draining, so nobody blocks on put.
+            try:
+                self.wfile.write(line)
+                self.wfile.flush()
+            except socket.error:
+                alive = False
+
+    def reply(self, line):
+        self.lines.put(line)
+
+    def push(self, line):
+        """Queues a state, unless the client is too far behind to take it."""
+        try:
+            self.lines.put_nowait(line)
+        except Queue.Full:
+            pass
+
+    def close(self):
+        self.lines.put(None)
+        self._thread.join()
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        machine = self.server.machine
+        connection = _Connection(self.wfile, machine.max_lines)
+        machine.add_connection(connection)
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                connection.reply(machine.execute(connection, line))
+        except socket.error:
+            pass
+        finally:
+            machine.remove_connection(connection)
+            connection.close()
+
+class _Server(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class MachineDaemon():
+    """
+    Serves a connected Freeloader, fl, to clients on 127.0.0.1:port. Each
+    client may have up to max_lines replies and states waiting to be sent.
+    Recordings go in record_dir (the current directory by default).
+    """
+
+    def __init__(self, fl, port = PORT, max_lines = 10000, record_dir = None):
+        self.fl = fl
+        self.record_dir = os.path.realpath(record_dir or os.getcwd())
+        self.port = port
+        self.max_lines = max_lines
+        # Nothing drains the worker's own queue; clients get states as they come.
+        self.worker = MachineWorker(fl, max_states = 1)
+        self.worker.listeners.append(self._publish)
+        self.connections = []
+        self.driver = None          # The connection which last set the motor moving
+        self._lock = threading.Lock()
+        self.server = _Server(("127.0.0.1", port), _Handler)
+        self.server.machine = self
+
+    def add_connection(self, connection):
+        with self._lock:
+            self.connections.append(connection)
+
+    def remove_connection(self, connection):
+        """
+        Forgets a closed connection. If it was the last to set the motor
+        moving, nobody is in charge of the motor any more, so it is stopped.
+        """
+        with self._lock:
+            self.connections.remove(connection)
+            if self.driver is connection:
+                self.driver = None
+                self.worker.command("stop")
+
+    def _publish(self, state):
+        """Sends a new state to every subscriber. Runs on the worker thread."""
+        line = json.dumps({'state': state}) + "\n"
+        with self._lock:
+            for connection in self.connections:
+                if connection.subscribed:
+                    connection.push(line)
+
+    def execute(self, connection, line):
+        """Carries out one request line. Returns the reply line."""
+        id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Requests must be JSON objects.")
+            id = request.get('id')
+            args = request.get('args', [])
+            if not isinstance(args, list):
+                raise ValueError("args must be a list.")
+            result = self.command(connection, request['cmd'], args)
+            reply = {'id': id, 'result': result}
+        except (ValueError, KeyError, IndexError, TypeError, FreeloaderError) as e:
+            reply = {'id': id, 'error': getattr(e, 'msg', None) or str(e)}
+        return json.dumps(reply) + "\n"
+
+    def command(self, connection, cmd, args):
+        if cmd in MOTION_COMMANDS:
+            self.driver = connection
+        elif cmd == "stop":
+            self.driver = None
+        if cmd == "record":
+            path = self.record_path(args[0])
+            self.worker.command(cmd, path, *args[1:])
+            return path
+        elif cmd in WORKER_COMMANDS:
+            self.worker.command(cmd, *args)
+        elif cmd == "start_motor":
+            self.worker.command("speed", args[0])
+            self.worker.command("down" if len(args) > 1 and args[1] else "up")
+        elif cmd == "state":
+            return self.worker.state
+        elif cmd == "subscribe":
+            connection.subscribed = True
+        elif cmd == "unsubscribe":
+            connection.subscribed = False
+        elif cmd == "ping":
+            return "pong"
+        elif cmd == "shutdown":
+            threading.Thread(target = self.server.shutdown).start()
+        else:
+            raise ValueError("Unknown command: " + str(cmd))
+        return None
+
+    def record_path(self, fname):
+        """
+        Returns the full path of fname in record_dir. Raises ValueError if
+        fname is absolute or contains "..", or leads out of record_dir.
+        """
+        if not isinstance(fname, basestring) or not fname:
+            raise ValueError("record needs a file name.")
+        if os.path.isabs(fname) or os.path.splitdrive(fname)[0] or \
+           ".." in re.split(r"[\\/]", fname):
+            raise ValueError("Recordings must be relative to the recording "
+                             "directory, without '..': " + fname)
+        path = os.path.realpath(os.path.join(self.record_dir, fname))
+        if not path.startswith(os.path.join(self.record_dir, "")):
+            raise ValueError("Recordings must stay in " + self.record_dir + ": " + fname)
+        return path
+
+    def serve_forever(self):
+        """Starts the worker and serves clients until shut down."""
+        self.worker.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.worker.stop()
+
+    def shutdown(self):
+        """Makes serve_forever return. Call from another thread."""
+        self.server.shutdown()
+
+class DaemonClient():
+    """
+    A connection to a MachineDaemon. Requests can be sent without waiting
+    (send) or waited on for their result (call). After subscribe(), states
+    arrive in self.states, a Queue.Queue holding at most max_states; the
+    oldest are dropped if they aren't taken in time.
+    """
+
+    def __init__(self, port = PORT, timeout = 5.0, max_states = 100000):
+        self.timeout = timeout
+        try:
+            self.sock = socket.create_connection(("127.0.0.1", port), timeout)
+        except socket.error as e:
+            raise FreeloaderError("Could not reach the machine daemon on port " +
+                                  str(port) + ": " + str(e))
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.states = Queue.Queue(max_states)
+        self._replies = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target = self._run, name = "DaemonClient")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.error:
+                line = ""
+            if not line:
+                break
+            message = json.loads(line)
+            if 'state' in message:
+                self._put_state(message['state'])
+                continue
+            with self._lock:
+                waiting = self._replies.pop(message.get('id'), None)
+            if waiting is not None:
+                waiting.put(message)
+            elif message.get('error'):
+                print "The machine daemon reported an error: " + message['error']
+        # Wake anyone still waiting for a reply.
+        with self._lock:
+            for waiting in self._replies.values():
+                waiting.put({'error': "Lost the connection to the machine daemon."})
+            self._replies.clear()
+
+    def _put_state(self, state):
+        try:
+            self.states.put_nowait(state)
+        except Queue.Full:
+            try:
+                self.states.get_nowait()
+                self.states.put_nowait(state)
+            except (Queue.Empty, Queue.Full):
+                pass
+
+    def _send(self, cmd, args, waiting = None):
+        with self._lock:
+            self._next_id += 1
+            id = self._next_id
+            if waiting is not None:
+                self._replies[id] = waiting
+            try:
+                self.sock.sendall(json.dumps({'id': id, 'cmd': cmd, 'args': args}) + "\n")
+            except socket.error as e:
+                self._replies.pop(id, None)
+                raise FreeloaderError("Lost the connection to the machine daemon: " + str(e))
+
+    def send(self, cmd, *args):
+        """Sends a command without waiting for its result. Errors are printed."""
+        self._send(cmd, list(args))
+
+    def call(self, cmd, *args):
+        """Sends a command and returns its result. Raises FreeloaderError on errors."""
+        waiting = Queue.Queue(1)
+        self._send(cmd, list(args), waiting)
+        try:
+            reply = waiting.get(timeout = self.timeout)
+        except Queue.Empty:
+            raise FreeloaderError("The machine daemon did not answer " + cmd + ".")
+        if reply.get('error'):
+            raise FreeloaderError(reply['error'])
+        return reply.get('result')
+
+    def subscribe(self):
+        self.call("subscribe")
+
+    def unsubscribe(self):
+        self.call("unsubscribe")
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        self._thread.join()
+
+class RemoteFreeloader():
+    """
+    Stands in for a Freeloader whose connections are held by a MachineDaemon.
+    Position and load come from the samples the daemon takes continuously:
+    get_linear_position waits for the next new sample, and a read_cell right
+    after it returns the load of that same sample. Motor commands take effect
+    on the daemon's next sample.
+    """
+
+    def __init__(self, port = PORT, timeout = 5.0):
+        self.port = port
+        self.timeout = timeout
+        self.client = None
+        self.dyna_online = 0
+        self.cell_online = 0
+        self._sample = None
+
+    def autoconnect(self, verbose = False, **kwargs):
+        """
+        Connects to the daemon, which is already connected to the machine.
+        Arguments for Freeloader.autoconnect are accepted and ignored.
+        """
+        self.client = DaemonClient(self.port, self.timeout)
+        self.client.subscribe()
+        self.dyna_online = 1
+        self.cell_online = 1
+        if verbose:
+            print "Connected to the machine daemon on port " + str(self.port)
+
+    def _call(self, cmd, *args):
+        if self.client is None:
+            raise FreeloaderError("Not connected to the machine daemon.")
+        return self.client.call(cmd, *args)
+
+    def _next_sample(self):
+        """Waits for a state newer than any returned so far, and skips to the newest."""
+        if self.client is None:
+            raise FreeloaderError("Not connected to the machine daemon.")
+        try:
+            state = self.client.states.get(timeout = self.timeout)
+        except Queue.Empty:
+            raise FreeloaderError("No data from the machine daemon.")
+        try:
+            while True:
+                state = self.client.states.get_nowait()
+        except Queue.Empty:
+            pass
+        if state['error']:
+            raise FreeloaderError(state['error'])
+        return state
+
+    def start_motor(self, speed, down = False):
+        self._call("start_motor", speed, down)
+
+    def stop_motor(self):
+        self._call("stop")
+
+    def get_linear_position(self):
+        self._sample = self._next_sample()
+        return self._sample['position']
+
+    def reset_linear_position(self):
+        self._call("zero")
+
+    def read_cell(self):
+        if self._sample is None:
+            self._sample = self._next_sample()
+        load = self._sample['load']
+        self._sample = None
+        return load
+
+    def tare_cell(self):
+        self._call("tare")
+
+    def disconnect(self):
+        """
+        Stops the motor and any recording, like Freeloader.disconnect, then
+        disconnects from the daemon, which stays connected to the machine.
+        """
+        if self.client is not None:
+            for cmd in ("stop", "stop_record"):
+                try:
+                    self.client.call(cmd)
+                except FreeloaderError:
+                    pass                # The daemon is gone; nothing to stop.
+            self.client.close()
+            self.client = None
+        self.dyna_online = 0
+        self.cell_online = 0
+
+class RemoteWorker():
+    """
+    Stands in for a MachineWorker, for the control panel, when a MachineDaemon
+    is driving the machine. fl is a connected RemoteFreeloader.
+    """
+
+    def __init__(self, fl):
+        self.fl = fl
+        self.state = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        """Leaves the daemon running; only the GUI goes away."""
+        pass
+
+    def command(self, name, *args):
+        if name == "record":
+            # The daemon only records into its own directory.
+            try:
+                path = self.fl.client.call(name, os.path.basename(args[0]), *args[1:])
+            except FreeloaderError as e:
+                print "Could not start recording: " + e.msg
+                return
+            print "The daemon is recording to " + path
+            return
+        self.fl.client.send(name, *args)
+
+    def drain(self):
+        out = []
+        try:
+            while True:
+                out.append(self.fl.client.states.get_nowait())
+        except Queue.Empty:
+            pass
+        if out:
+            self.state = out[-1]
+        return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Share a Freeloader with local clients.")
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--simulated", action = "store_true",
+                        help = "serve a simulated machine (see simulated.py)")
+    parser.add_argument("--loadbaud", type = int,
+                        help = "load cell baud rate (default: as saved by loadcal.py)")
+    parser.add_argument("--loadsps", type = int,
+                        help = "load cell SPS (default: as saved by loadcal.py)")
+    parser.add_argument("--dynabaud", type = int, default = 1000000)
+    parser.add_argument("--protocol", type = int, choices = [1, 2], default = 1,
+                        help = "Dynamixel protocol version")
+    parser.add_argument("--record-dir",
+                        help = "directory recordings are written to (default: this one)")
+    args = parser.parse_args()
+
+    if args.simulated:
+        from simulated import simulated_freeloader
+        fl = simulated_freeloader(dynabaud = args.dynabaud, loadbaud = args.loadbaud or 9600,
+                                  sps = args.loadsps or 120, protocol = args.protocol)
+    else:
+        fl = Freeloader()
+        try:
+            fl.autoconnect(verbose = True, loadbaud = args.loadbaud,
+                           loadsps = args.loadsps, dynabaud = args.dynabaud,
+                           protocol = args.protocol)
+        except FreeloaderError as fe:
+            print "Autoconnect failed"
+            print fe.msg
+            sys.exit(1)
+    machine = MachineDaemon(fl, args.port, record_dir = args.record_dir)
+    # SIGTERM shuts down cleanly, stopping the motor.
+    signal.signal(signal.SIGTERM, lambda s, frame:
+                  threading.Thread(target = machine.shutdown).start())
+    print "Serving the machine on port " + str(args.port) + ". Ctrl-C to stop."
+    try:
+        machine.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fl.disconnect()
@@ -0,0 +1,249 @@
+"""
+datastream.py
+
+Crash-safe streaming storage for data collected by a BasicTest.
+
+BasicTest normally keeps every datapoint in memory until write_file is called
+at the end of the test. If the program crashes, the power goes out, or
+exit_error is called halfway through, everything is lost. A StreamWriter
+fixes this by appending datapoints to disk as they are collected.
+
+The acquisition loop only ever hands a datapoint to StreamWriter.append(),
+which puts it on an in-memory queue and returns immediately. A background
+thread takes whatever has been queued every so often, packs it into a block
+and writes it to disk. The file is fsync'd to the disk at most once per
+fsync_interval seconds, so a power loss costs at most that much data.
+
+File format (all little-endian):
+    - 8 byte magic string "PYLDSTRM"
+    - uint32 length, followed by that many bytes of JSON describing the
+      columns, the text header, and the creation time
+    - Any number of blocks, each of which is:
+        uint32 number of rows, uint32 CRC32 of the payload, payload
+      where the payload is rows * columns doubles.
+
+Because every block carries its own length and checksum, a file that was
+cut off in the middle of a write can always be read back up to the last
+complete block. See recover_stream().
+
+Usage from a BasicTest is simple:
+
+    self.initialize_data()
+    self.start_stream("specimen1.pyld")
+    self.collect_until("load", "greaterthan", 10)
+    self.stop_stream()
+
+and afterwards, stream_to_csv("specimen1.pyld", "specimen1.csv") gives the
+same CSV that write_file would have.
+"""
+
+import os, time, json, zlib, struct, atexit, threading, collections, weakref
+import csvexport
+
+MAGIC = "PYLDSTRM"
+_BLOCK = struct.Struct("<II")
+_LENGTH = struct.Struct("<I")
+
+# Every writer which is still open, so they can be closed at interpreter exit.
+_open_writers = weakref.WeakValueDictionary()
+
+class StreamWriter():
+    """
+    Appends datapoints to a binary stream file from a background thread.
+    The file is created (or overwritten) when the writer is instantiated.
+    """
+
+    def __init__(self, fname, columns, header = "", flush_interval = .1,
+                 fsync_interval = 1.0):
+        """
+        fname is the file to write to. columns is a list of column labels, in
+        order, and every datapoint appended must have exactly that many values.
+        header is free text stored with the data, like the header of write_file.
+        Queued data is written every flush_interval seconds, and forced to the
+        physical disk every fsync_interval seconds.
+        """
+        self.fname = fname
+        self.columns = list(columns)
+        self.ncols = len(self.columns)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.rows_written = 0
+        self.error = None
+        self._queue = collections.deque()
+        self._closing = threading.Event()
+        self._closed = False
+
+        info = json.dumps({'columns': self.columns, 'header': header,
+                           'created': time.time()})
+        self._f = open(fname, 'wb')
+        self._f.write(MAGIC + _LENGTH.pack(len(info)) + info)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_sync = time.time()
+
+        self._thread = threading.Thread(target = self._run, name = "StreamWriter")
+        self._thread.daemon = True
+        self._thread.start()
+        _open_writers[id(self)] = self
+
+    def append(self, point):
+        """
+        Queues a single datapoint (list of numbers) to be written.
+        This never touches the disk, so it is safe to call in the acquisition loop.
+        Once writing has failed, points are dropped; close() reports the error.
+        """
+        if self.error is not None:
+            return
+        if len(point) != self.ncols:
+            raise ValueError("Datapoint has %d values, stream has %d columns." \
+                % (len(point), self.ncols))
+        self._queue.append(point)
+
+    def extend(self, points):
+        """Queues several datapoints at once."""
+        for point in points:
+            self.append(point)
+
+    def _run(self):
+        """Writer thread main loop. Drains the queue until the writer is closed."""
+        while not self._closing.is_set():
+            self._closing.wait(self.flush_interval)
+            try:
+                self._drain()
+            except Exception as e:
+                # Keep the error for close() to report. The acquisition loop
+                # must never be interrupted by a full or missing disk, or by
+                # a point which can't be packed.
+                self.error = e
+                self._queue.clear()
+                return
+
+    def _drain(self):
+        """Writes everything queued so far as one block, and fsyncs if due."""
+        rows = []
+        queue = self._queue
+        while queue:
+            rows.append(queue.popleft())
+        if rows:
+            flat = [float(value) for row in rows for value in row]
+            payload = struct.pack("<%dd" % len(flat), *flat)
+            crc = zlib.crc32(payload) & 0xFFFFFFFF
+            self._f.write(_BLOCK.pack(len(rows), crc) + payload)
+            self._f.flush()
+            self.rows_written += len(rows)
+        if time.time() - self._last_sync >= self.fsync_interval:
+            os.fsync(self._f.fileno())
+            self._last_sync = time.time()
+
+    def close(self):
+        """
+        Writes out anything still queued, syncs and closes the file.
+        Raises an IOError if the writer thread failed at any point.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._closing.set()
+        self._thread.join()
+        _open_writers.pop(id(self), None)
+        try:
+            if self.error is None:
+                self._drain()
+                os.fsync(self._f.fileno())
+        except Exception as e:
+            self.error = e
+        finally:
+            self._f.close()
+        if self.error is not None:
+            raise IOError("Stream writer for %s failed: %s" % (self.fname, self.error))
+
+def _close_all():
+    """Closes any writers left open, so sys.exit() doesn't lose queued data."""
+    for writer in list(_open_writers.values()):
+        try:
+            writer.close()
+        except IOError:
+            pass
+
+atexit.register(_close_all)
+
+def _read_info(f):
+    """Reads the file preamble. Returns the info dict and the offset of the first block."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a PyLoader stream file.")
+    raw = f.read(_LENGTH.size)
+    if len(raw) < _LENGTH.size:
+        raise ValueError("Stream file header is truncated.")
+    (length,) = _LENGTH.unpack(raw)
+    raw = f.read(length)
+    if len(raw) < length:
+        raise ValueError("Stream file header is truncated.")
+    return json.loads(raw), len(MAGIC) + _LENGTH.size + length
+
+def _iter_blocks(f, ncols):
+    """
+    Yields (rows, offset after block) for every complete, valid block in f.
+    Stops silently at the first partial or corrupt block.
+    """
+    while True:
+        raw = f.read(_BLOCK.size)
+        if len(raw) < _BLOCK.size:
+            return
+        nrows, crc = _BLOCK.unpack(raw)
+        payload = f.read(nrows * ncols * 8)
+        if len(payload) < nrows * ncols * 8 or \
+                (zlib.crc32(payload) & 0xFFFFFFFF) != crc:
+            return
+        flat = struct.unpack("<%dd" % (nrows * ncols), payload)
+        rows = [list(flat[i:i + ncols]) for i in xrange(0, len(flat), ncols)]
+        yield rows, f.tell()
+
+def iter_stream(fname):
+    """
+    Opens a stream file and yields its data one block (list of rows) at a time.
+    Use this for big files which shouldn't be loaded into memory all at once.
+    """
+    with open(fname, 'rb') as f:
+        info, offset = _read_info(f)
+        for rows, offset in _iter_blocks(f, len(info['columns'])):
+            yield rows
+
+def read_stream(fname):
+    """
+    Reads a stream file. Returns (columns, header, data), where data is a list
+    of datapoints just like BasicTest.data. Partial blocks at the end are ignored.
+    """
+    with open(fname, 'rb') as f:
+        info, offset = _read_info(f)
+    data = []
+    for rows in iter_stream(fname):
+        data.extend(rows)
+    return info['columns'], info['header'], data
+
+def recover_stream(fname):
+    """
+    Truncates a stream file after its last complete, valid block, which is
+    what's left of a file after a crash. Returns the number of rows kept.
+    """
+    nrows = 0
+    with open(fname, 'r+b') as f:
+        info, offset = _read_info(f)
+        for rows, offset in _iter_blocks(f, len(info['columns'])):
+            nrows += len(rows)
+        f.truncate(offset)
+    return nrows
+
+def stream_to_csv(fname, csvname, precision = None):
+    """
+    Exports a stream file to CSV, with its header at the top, in the
+    same layout write_file uses. The file is converted one block at a time.
+    """
+    with open(fname, 'rb') as f:
+        info, offset = _read_info(f)
+    return csvexport.write_csv_chunks(csvname, iter_stream(fname), info['header'],
+                                      precision)
+
+
+if __name__ == '__main__':
+    print "This is a module to be imported into a program."
+    print "Use 'from datastream import StreamWriter'"
@@ -21,6 +21,19 @@ Attribution-Noncommercial-Share-Alike 3.0 license. See
 <http://creativecommons.org/licenses/by-nc-sa/3.0> for details. If you'd
 like some other license, send Mac Mason an email.
 
+ServoController speaks Protocol 1.0 by default. With protocol=2 it speaks
+Protocol 2.0 instead, which newer firmware supports: packets have a longer
+header, a table-driven CRC16 instead of the one-byte checksum, and byte
+stuffing so that the header never appears inside a packet. The same methods
+work under both protocols, so Freeloader doesn't need to know which is in
+use; speeds, for example, are always given in Protocol 1.0 units, and loads
+are always returned in them, converted from the present current which the
+MX-64 reports under Protocol 2.0 instead of load. Protocol
+2.0 also has SYNC_READ and BULK_READ, which read several servos in a single
+transaction (see SyncRead, BulkRead and GetPositionsAndLoads). Servos on
+Protocol 2.0 must already be in velocity control mode with torque enabled,
+which is the equivalent of wheel mode.
+
 Anthony McNicoll's modifications circa July 2014:
 Packets are only accepted if they rigorously follow the expected format,
 including a valid checksum. If not, the original request is re-sent up to
@@ -30,7 +43,9 @@ Several range checks were changed throught to accomodate MX-64 values.
 Servo-mode commands for AX-12 (set degrees, etc) were removed.
 """
 
-import serial, time
+import threading
+import serial
+import clock, profiler
 
 # The types of packets.
 PING       = [0x01]
@@ -41,6 +56,29 @@ ACTION     = [0x05]
 RESET      = [0x06]
 SYNC_WRITE = [0x83]
 
+# Protocol 2.0 only.
+SYNC_READ  = [0x82]
+BULK_READ  = [0x92]
+STATUS     = 0x55
+BROADCAST  = 0xFE
+HEADER2    = [0xFF, 0xFF, 0xFD, 0x00]
+
+# Control table addresses and sizes, in bytes, of the MX-64 under each protocol.
+TABLE = {1: {'id': (0x03, 1), 'goal_position': (0x1e, 2), 'moving_speed': (0x20, 2),
+             'present_position': (0x24, 2), 'present_load': (0x28, 2),
+             'moving': (0x2e, 1)},
+         2: {'id': (7, 1), 'goal_position': (116, 4), 'moving_speed': (104, 4),
+             'present_position': (132, 4), 'present_current': (126, 2),
+             'moving': (122, 1)}}
+
+# Protocol 2.0 velocity units (0.229 rpm) per Protocol 1.0 speed unit (0.114 rpm).
+P2_PER_P1 = 0.114 / 0.229
+
+# Protocol 2.0 current units (3.36 mA) per Protocol 1.0 load unit. Load is
+# measured as current by the MX-64 too, with 1000 (100%) at its 4.1 A stall
+# current, so a load unit is about 4.1 mA.
+CURRENT_PER_LOAD = 0.0041 / 0.00336
+
 # The various errors that might take place.
 ERRORS = {64 : "Instruction",
           32 : "Overload",
@@ -49,6 +87,16 @@ ERRORS = {64 : "Instruction",
            4 : "Overheating",
            2 : "AngleLimit",
            1 : "InputVoltage"}
+
+# Protocol 2.0 reports one error number instead, plus an alert bit (0x80)
+# which means the servo has a hardware error.
+ERRORS2 = {1 : "ResultFail",
+           2 : "Instruction",
+           3 : "CRC",
+           4 : "DataRange",
+           5 : "DataLength",
+           6 : "DataLimit",
+           7 : "Access"}
            
 def _Checksum(s):
   """Returns the Dynamixel checksum (~(ID + length + ...)) & 0xFF."""
@@ -72,6 +120,70 @@ def _DeWire(v):
   """ Returns the 16-bit number in v, which should be the list [lsbyte, msbyte]"""
   return (v[1] << 8) + v[0]
 
+def _ToBytes(v, size):
+  """The size byte little-endian two's complement form of the int v."""
+  return [(v >> (8 * i)) & 0xFF for i in range(size)]
+
+def _FromBytes(v, signed = False):
+  """The int in the little-endian bytes v."""
+  n = sum(b << (8 * i) for i, b in enumerate(v))
+  if signed and v and n >= 1 << (8 * len(v) - 1):
+    n -= 1 << (8 * len(v))
+  return n
+
+def _MakeCrcTable():
+  """The lookup table of the CRC16 (polynomial 0x8005) used by Protocol 2.0."""
+  table = []
+  for i in range(256):
+    crc = i << 8
+    for j in range(8):
+      crc = ((crc << 1) ^ 0x8005) if crc & 0x8000 else crc << 1
+    table.append(crc & 0xFFFF)
+  return table
+
+_CRC_TABLE = _MakeCrcTable()
+
+def _Crc16(data, crc = 0):
+  """The Protocol 2.0 CRC of data, a list of ints, one table lookup per byte."""
+  for b in data:
+    crc = ((crc << 8) ^ _CRC_TABLE[((crc >> 8) ^ b) & 0xFF]) & 0xFFFF
+  return crc
+
+def _LoadFromCurrent(current):
+  """Protocol 1.0 load, within +-1023, for a signed Protocol 2.0 present current."""
+  return max(-1023, min(1023, int(round(current / CURRENT_PER_LOAD))))
+
+def _Stuff(body):
+  """Inserts 0xFD after every FF FF FD in body, so it can't look like a header."""
+  out = []
+  for b in body:
+    out.append(b)
+    if out[-3:] == [0xFF, 0xFF, 0xFD]:
+      out.append(0xFD)
+  return out
+
+def _Unstuff(body):
+  """Removes the bytes _Stuff inserted."""
+  out = []
+  stuffed = False
+  for b in body:
+    if stuffed:
+      stuffed = False
+      continue
+    out.append(b)
+    stuffed = out[-3:] == [0xFF, 0xFF, 0xFD]
+  return out
+
+def _Packet2(id, body):
+  """
+  A complete Protocol 2.0 packet to or from id, whose body is the instruction
+  and its parameters.
+  """
+  body = _Stuff(body)
+  P = HEADER2 + [id] + _EnWire(len(body) + 2) + body
+  crc = _Crc16(P)
+  return P + [crc & 0xFF, crc >> 8]
+
 class Response:
   """
   A response packet. Takes care of parsing the response, and figuring what (if
@@ -107,6 +219,27 @@ class Response:
       raise ValueError, "ERRORS: %s" % " ".join(self.errors)
     return self  # Syntactic sugar; lets us do return foo.Verify().
 
+class Response2(Response):
+  """A Protocol 2.0 status packet. See Response."""
+  def __init__(self, data):
+    self.errors = []
+    if data[:4] != HEADER2:
+        self.errors.append("Bad header")
+    if len(data) < 11 or _Crc16(data[:-2]) != _DeWire(data[-2:]):
+        self.errors.append("Bad checksum")
+    self.data = data
+    self.id = data[4]
+    self.length = _DeWire(data[5:7])
+    body = _Unstuff(data[7:-2])
+    if len(self.errors) == 0:
+        if body[0] != STATUS:
+          self.errors.append("Not a status packet")
+        if body[1] & 0x7F:
+          self.errors.append(ERRORS2.get(body[1] & 0x7F, "Unknown"))
+        if body[1] & 0x80:
+          self.errors.append("Alert")
+    self.parameters = body[2:]
+
 class ServoController:
   """
   Interface to a servo. Most of the real work happens in Interact(), which
@@ -114,17 +247,36 @@ class ServoController:
   entire _collection_ of servos, not just a single servo: therefore, each 
   function takes a servo ID as its first argument, to specify the servo that 
   should get the command.
+
+  A ServoController may be shared between threads. Each exchange of packets
+  has the port to itself, and priority exchanges (see Halt) go ahead of any
+  ordinary ones waiting for it, so they wait for one exchange at most.
   """
 
-  def __init__(self, portstring="/dev/ttyUSB0", baud=1000000, to=1):
+  def __init__(self, portstring="/dev/ttyUSB0", baud=1000000, to=1, port=None,
+               protocol=1):
     """
     portstring should be the port of the USB2Dynamixel or other serial adapter,
     in form 'COM17' for Windows or '/dev/ttyUSB0' for Unix. Baud is the baud
     rate at which the target Dynamixels are communicating. to is the timeout
     duration, after which a connection is determined to have failed.
+    Alternatively, an already open serial-like object can be passed as port,
+    in which case portstring, baud and to are ignored. See simulated.py.
+    protocol is the Dynamixel protocol version to speak, 1 or 2.
     """
+    if protocol not in TABLE:
+      raise ValueError, "Protocol %s isn't supported!" % protocol
+    self.portstring = portstring
+    self.protocol = protocol
+    self.table = TABLE[protocol]
+    self.halted = set()
+    self._bus = threading.Condition(threading.Lock())
+    self._busy = False
+    self._urgent = 0
+    if port is not None:
+      self.port = port
+      return
     try:
-        self.portstring = portstring
         self.port = serial.Serial(self.portstring, baudrate=baud, timeout=to)
     except:
         raise ValueError("Unable to open COM port.")
@@ -138,7 +290,7 @@ class ServoController:
     """Make sure serial port is closed upon deleting."""
     self.Close()
 
-  def Interact(self, id, packet):
+  def Interact(self, id, packet, priority = False):
     """
     Given an (assembled) packet, add the various extra bits, and transmit to
     servo at id. Returns the status packet as a Response. id must be in the
@@ -147,28 +299,112 @@ class ServoController:
     Note that the payload should be a list of integers, suitable for passing
     to chr().
 
+    With priority, each try goes ahead of ordinary exchanges waiting for the
+    port. Without, a packet which would start a halted servo moving raises a
+    ValueError instead of being sent.
+
     This is the low-level communication function; you probably want to call 
     one of the other, more specific functions.
     """
+    _VerifyID(id)
+    return self._Exchange(id, packet, 1, priority)[0]
+
+  def _Exchange(self, id, packet, replies, priority = False):
+    """
+    Sends packet to id, which may be BROADCAST, and waits for replies status
+    packets. Returns them as a list of verified Responses. See Interact.
+    """
+    t = profiler.tic()
+    if self.protocol == 2:
+        data = _Packet2(id, packet)
+    else:
+        P = [id, len(packet)+1] + packet
+        data = [0xFF, 0xFF] + P + [_Checksum(P)]
     tries = 0
     while tries < 15:
-        _VerifyID(id)
-        P = [id, len(packet)+1] + packet
-        self.port.write("".join(map(chr, [0xFF, 0xFF] + P + [_Checksum(P)])))
-        self.port.flushInput()
-        self.port.flush()
-        
-        # Wait for a valid packet to come in, with time-out.
+        self._Acquire(priority)
         try:
-            res = self.GetPacket(.005)
-            out = Response(res).Verify()
-            return out
+            halted = not priority and id in self.halted and self._StartsMotion(packet)
+            if not halted:
+                self.port.write("".join(map(chr, data)))
+                self.port.flushInput()
+                self.port.flush()
+                # Wait for valid packets to come in, with time-out.
+                if self.protocol == 2:
+                    out = [Response2(self.GetPacket2(.005)).Verify()
+                           for i in range(replies)]
+                else:
+                    out = [Response(self.GetPacket(.005)).Verify()
+                           for i in range(replies)]
         except ValueError as e:
             # Uncomment the line below to debug communication failures
             # print e
             tries += 1
+            continue
+        finally:
+            self._Release()
+        if halted:
+            raise ValueError("Servo %d is halted, cannot move" % id)
+        profiler.toc("dynamixel.Interact", t)
+        return out
     raise ValueError("Communication failure")
 
+  def _StartsMotion(self, packet):
+    """True if packet writes a nonzero moving speed."""
+    address, size = self.table['moving_speed']
+    prefix = self._WritePacket(address, [])
+    if packet[:len(prefix)] != prefix:
+      return False
+    speed = _FromBytes(packet[len(prefix):len(prefix) + size])
+    return speed != 0 if self.protocol == 2 else speed & 1023 != 0
+
+  def _ReadPacket(self, address, size):
+    """A READ_DATA instruction for size bytes from address."""
+    if self.protocol == 2:
+      return READ_DATA + _EnWire(address) + _EnWire(size)
+    return READ_DATA + [address, size]
+
+  def _WritePacket(self, address, values):
+    """A WRITE_DATA instruction of the bytes values to address."""
+    if self.protocol == 2:
+      return WRITE_DATA + _EnWire(address) + values
+    return WRITE_DATA + [address] + values
+
+  def _Read(self, id, name, signed = False, priority = False):
+    """Reads the control table entry called name (see TABLE) from servo id."""
+    _VerifyID(id)
+    address, size = self.table[name]
+    Q = self.Interact(id, self._ReadPacket(address, size), priority).Verify()
+    if len(Q.parameters) != size:
+      raise ValueError, "Reading %s got %d bytes, not %d!" % (name,
+        len(Q.parameters), size)
+    return _FromBytes(Q.parameters, signed)
+
+  def _Write(self, id, name, value, priority = False):
+    """Writes value to the control table entry called name of servo id."""
+    _VerifyID(id)
+    address, size = self.table[name]
+    packet = self._WritePacket(address, _ToBytes(value, size))
+    self.Interact(id, packet, priority).Verify()
+
+  def _Acquire(self, priority):
+    """Waits for the port, letting priority exchanges go first."""
+    with self._bus:
+      if priority:
+        self._urgent += 1
+        while self._busy:
+          self._bus.wait()
+        self._urgent -= 1
+      else:
+        while self._busy or self._urgent:
+          self._bus.wait()
+      self._busy = True
+
+  def _Release(self):
+    with self._bus:
+      self._busy = False
+      self._bus.notify_all()
+
   def GetPacket(self, timeout):
     """
     This method carefully waits for bytes forming a response packet, and
@@ -208,14 +444,41 @@ class ServoController:
         res.append(ord(self.port.read()))
     return res
       
+  def GetPacket2(self, timeout):
+    """
+    GetPacket for Protocol 2.0: waits for the four byte header, then the ID,
+    length and as many bytes as the length says, raising a ValueError if any
+    of them doesn't come in time.
+    """
+    res = []
+    tries = 0
+    while res != HEADER2:
+        tries += 1
+        if self.ListenWithTimeout(1, timeout*5) or (tries > 40):
+            raise ValueError("Timed out while waiting for the header")
+        res = (res + [ord(self.port.read())])[-4:]
+        while res != HEADER2[:len(res)]:
+            res = res[1:]
+    # Wait for the ID and length bytes
+    if self.ListenWithTimeout(3, timeout*3):
+        raise ValueError("Timed out while waiting for ID and length")
+    res += [ord(c) for c in self.port.read(3)]
+    length = _DeWire(res[5:7])
+    # Read as many bytes as indicated by the length
+    for i in range(length):
+        if self.ListenWithTimeout(1, timeout*length):
+            raise ValueError("Timed out while waiting for data byte")
+        res.append(ord(self.port.read()))
+    return res
+
   def ListenWithTimeout(self, num, timeout):
     """
     Waits for num bytes to be received, but not longer than timeout.
     Note this returns 1's and 0's in a funny way which makes it useful
     for if statements such as those in GetPacket."""
-    start = time.time()
+    start = clock.now()
     while self.port.inWaiting() < num:
-        if time.time() - start > timeout:
+        if clock.now() - start > timeout:
             return 1
     return 0
             
@@ -225,16 +488,16 @@ class ServoController:
     could be messy if you have many servos plugged in.
     """
     _VerifyID(id)
-    self.Interact(id, RESET).Verify()
+    if self.protocol == 2:
+      self.Interact(id, RESET + [0xFF]).Verify()
+    else:
+      self.Interact(id, RESET).Verify()
 
   def GetPosition(self, id):
-    """Return the current position of the servo as a 16-bit value."""
-    _VerifyID(id)
-    packet = READ_DATA + [0x24] + [2]
-    res = self.Interact(id, packet).Verify()
-    if len(res.parameters) != 2:
-      raise ValueError, "GetPosition didn't get two parameters!"
-    return _DeWire(res.parameters)
+    """Return the current position of the servo, from 0 to 4095."""
+    if self.protocol == 2:
+      return self._Read(id, 'present_position', True) % 4096
+    return self._Read(id, 'present_position')
 
   def GetPositionDegrees(self, id):
     """Returns position in degrees for an MX-64"""
@@ -242,11 +505,9 @@ class ServoController:
 
   def SetPosition(self, id, position):
     """Set servo id to be at a position from 0-4096 for MX-64."""
-    _VerifyID(id)
     if not (0 <= position <= 4096):
       raise ValueError, "Invalid position!"
-    packet = WRITE_DATA + [0x1e] + _EnWire(position)
-    self.Interact(id, packet).Verify()
+    self._Write(id, 'goal_position', position)
 
   def SetPositionDegrees(self, id, deg):
     """Set the position in degrees for a servo-mode MX-64."""
@@ -259,35 +520,119 @@ class ServoController:
     Change the ID of a servo. Note that this is persistent; you may also be
     interested in Reset().
     """
-    _VerifyID(id)
     if not 0 <= nid <= 253:
       raise ValueError, "%id is not a valid servo ID!" % nid
-    packet = WRITE_DATA + [0x03] + [nid]
-    self.Interact(id, packet).Verify()
+    self._Write(id, 'id', nid)
   
-  def GetMovingSpeed(self, id):
-    """Get the moving speed. 0 means stopped for MX-64 in wheel mode."""
-    _VerifyID(id)
-    packet = READ_DATA + [0x20] + [2]
-    Q = self.Interact(id, packet).Verify()
-    if len(Q.parameters) != 2:
-      raise ValueError, "GetMovingSpeed has the wrong return shape!"
-    return _DeWire(Q.parameters)
-
-  def SetMovingSpeed(self, id, speed):
-    """Set the moving speed. 0 means stopped for MX-64 in wheel mode."""
-    _VerifyID(id)
+  def GetMovingSpeed(self, id, priority = False):
+    """
+    Get the moving speed. 0 means stopped for MX-64 in wheel mode. Under
+    Protocol 2.0 the goal velocity is converted to the same units and form.
+    """
+    if self.protocol == 2:
+      v = self._Read(id, 'moving_speed', True, priority)
+      speed = min(1023, int(round(abs(v) / P2_PER_P1)))
+      return speed + 1024 if v < 0 else speed
+    return self._Read(id, 'moving_speed', False, priority)
+
+  def SetMovingSpeed(self, id, speed, priority = False):
+    """
+    Set the moving speed. 0 means stopped for MX-64 in wheel mode. Under
+    Protocol 2.0 it is converted to a goal velocity, which has half the
+    resolution.
+    """
     if not 0 <= speed <= 2048:
       raise ValueError, "%d is not a valid moving speed!" % speed
-    packet = WRITE_DATA + [0x20] + _EnWire(speed)
-    self.Interact(id, packet).Verify()
+    if self.protocol == 2:
+      v = int(round((speed & 1023) * P2_PER_P1))
+      self._Write(id, 'moving_speed', -v if speed & 1024 else v, priority)
+    else:
+      self._Write(id, 'moving_speed', speed, priority)
+
+  def GetLoad(self, id):
+    """
+    Return the present load of the servo, in about 0.1% of its maximum,
+    negative when the load is clockwise. Under Protocol 2.0 it is converted
+    from the present current.
+    """
+    if self.protocol == 2:
+      return _LoadFromCurrent(self._Read(id, 'present_current', True))
+    load = self._Read(id, 'present_load')
+    return -(load & 1023) if load & 1024 else load & 1023
+
+  def Halt(self, id):
+    """
+    Stops servo id as a priority exchange, then reads its moving speed back
+    to verify the stop. Until Resume(id), ordinary commands which would
+    start it moving raise a ValueError. Raises a ValueError if the stop
+    can't be verified.
+    """
+    _VerifyID(id)
+    self.halted.add(id)
+    self.SetMovingSpeed(id, 0, priority = True)
+    if self.GetMovingSpeed(id, priority = True) & 1023 != 0:
+      raise ValueError, "Halt could not verify that the servo stopped!"
+
+  def Resume(self, id):
+    """Allows servo id to be moved again after Halt."""
+    self.halted.discard(id)
 
   def Moving(self, id):
     """Return True if the servo is currently moving, False otherwise."""
-    _VerifyID(id)
-    packet = READ_DATA + [0x2e] + [1]
-    Q = self.Interact(id, packet).Verify()
-    return Q.parameters[0] == 1
+    return self._Read(id, 'moving') == 1
+
+  def SyncRead(self, ids, address, size):
+    """
+    Protocol 2.0 only. Reads size bytes from address of every servo in ids
+    in one transaction: a single instruction, which each servo answers in
+    turn. Returns {id: list of bytes}.
+    """
+    for id in ids:
+      _VerifyID(id)
+    packet = SYNC_READ + _EnWire(address) + _EnWire(size) + list(ids)
+    return self._Collect(packet, [(id, size) for id in ids])
+
+  def BulkRead(self, requests):
+    """
+    Protocol 2.0 only. Like SyncRead, but requests is a list of (id,
+    address, size), so each servo can be asked for a different entry. Each
+    id may appear only once. Returns {id: list of bytes}.
+    """
+    packet = list(BULK_READ)
+    for id, address, size in requests:
+      _VerifyID(id)
+      packet += [id] + _EnWire(address) + _EnWire(size)
+    return self._Collect(packet, [(id, size) for id, address, size in requests])
+
+  def _Collect(self, packet, expected):
+    """Broadcasts packet, and returns the replies of the servos in expected."""
+    if self.protocol != 2:
+      raise ValueError, "SYNC_READ and BULK_READ need Protocol 2.0!"
+    out = {}
+    for Q in self._Exchange(BROADCAST, packet, len(expected)):
+      out[Q.id] = Q.parameters
+    for id, size in expected:
+      if len(out.get(id, [])) != size:
+        raise ValueError, "Servo %d didn't reply with %d bytes!" % (id, size)
+    return out
+
+  def GetPositionsAndLoads(self, ids):
+    """
+    Returns {id: (position, load)} for every servo in ids, as GetPosition and
+    GetLoad would. Under Protocol 2.0, this is one SYNC_READ transaction of
+    the control table from present current to present position; under 1.0,
+    every servo is read in turn.
+    """
+    if self.protocol != 2:
+      return dict((id, (self.GetPosition(id), self.GetLoad(id))) for id in ids)
+    load_address, load_size = self.table['present_current']
+    position_address, position_size = self.table['present_position']
+    size = position_address + position_size - load_address
+    out = {}
+    for id, values in self.SyncRead(ids, load_address, size).items():
+      out[id] = (_FromBytes(values[-position_size:], True) % 4096,
+                 _LoadFromCurrent(_FromBytes(values[:load_size], True)))
+    return out
 
 if __name__ == "__main__":
   print "Can't run this directly."
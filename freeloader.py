@@ -16,9 +16,8 @@ Attribution-Noncommercial-Share-Alike 3.0 license. See
 <http://creativecommons.org/licenses/by-nc-sa/3.0> for details.
 """
 
-import time
 import serial
-import dynamixel
+import clock, dynamixel, profiler, loadcal
 from serial.tools import list_ports
 
 class FreeloaderError(Exception):
@@ -47,12 +46,22 @@ class Freeloader():
         self.last_encoder = 9999
         self.mmpm2speed = float( pitch * (1/25.4) * gear_ratio * 7.95 )
         self.mm2enc = float( pitch * (1/25.4) * gear_ratio * 4096 )
+        # The latest load and position read, and when (clock.now()), for
+        # anything watching the machine from another thread (see watchdog.py).
+        self.last_load = None
+        self.last_load_time = None
+        self.last_position = None
+        self.last_position_time = None
+        # Whether the motor was last told to move, and when it was told.
+        self.moving = False
+        self.moving_since = None
 
-    def connect_dynamixel(self, port, baudr):
+    def connect_dynamixel(self, port, baudr, protocol = 1):
         """ 
         Method to connect to the Dynamixel motor.
         port is a string of form "COM5" for Windows. 
         baudr is the baudrate provided as an int.
+        protocol is the Dynamixel protocol version it speaks, 1 or 2.
         If a Dynamixel is found, connect_dynamixel will return normally
         and the dyna_online attribute will be set to True.
         If not, a descriptive FreeloaderError will be raised.
@@ -62,7 +71,8 @@ class Freeloader():
             return
         # Connect
         try:
-            self.dyna = dynamixel.ServoController(portstring = port, baud = baudr, to=1)
+            self.dyna = dynamixel.ServoController(portstring = port, baud = baudr, to=1,
+                                                  protocol = protocol)
         except:
             raise FreeloaderError("Error opening Dynamixel serial port!")
         # Check to confirm there's a Dynamixel.
@@ -74,12 +84,14 @@ class Freeloader():
         self.dyna.SetMovingSpeed(1,0)
         self.dyna_online = True
 
-    def connect_load(self, port, baudr, sps = 120):
+    def connect_load(self, port, baudr = None, sps = None):
         """ 
         Method to connect to the load cell interface.
         port is a string of form "COM5" for Windows. 
         baudr is the baudrate provided as an int.
         User can optionally set "sps" for lower, more accurate rate.
+        If baudr or sps is not given, the setting saved for this load cell by
+        loadcal.py is used, or 9600 baud and 120 SPS if it was never calibrated.
         If a load cell is found, connect_load will return normally
         and the cell_online attribute will be set to True.
         If not, a descriptive FreeloaderError will be raised.
@@ -87,6 +99,10 @@ class Freeloader():
         # Make sure there is need to connect in first place
         if self.cell_online == 1:
             return
+        if baudr is None or sps is None:
+            saved_baud, saved_sps = loadcal.saved_config(port)
+            baudr = baudr or saved_baud
+            sps = sps or saved_sps
         # Establish connection to the load cell.
         # Set SPS to preferred value to confirm communication.
         try:
@@ -105,13 +121,16 @@ class Freeloader():
             out = "Load connect failed: " + fe.msg
             raise FreeloaderError(out)
 
-    def autoconnect(self, verbose = False, loadbaud = 9600, loadsps = 120, dynabaud = 1000000):
+    def autoconnect(self, verbose = False, loadbaud = None, loadsps = None, dynabaud = 1000000,
+                    protocol = 1):
         """
         A convenient method which automatically finds the Dynamixel and load cell 
         on whatever port they may be connected to, if they are indeed available.
         To print status updates, call with verbose = True. 
-        loadbaud, loadsps, and dynabaud are all options as well.
-        Simply calling autoconnect() will scan with most common settings as above.
+        loadbaud, loadsps, dynabaud and protocol (of the Dynamixel, 1 or 2)
+        are all options as well.
+        Simply calling autoconnect() will scan with the settings saved by
+        loadcal.py for each load cell, or the most common settings otherwise.
         Failure to connect in any case will raise a descriptive FreeloaderError.
         """
         if verbose:
@@ -133,7 +152,7 @@ class Freeloader():
             print "Scanning for Dynamixel..."
         for port in list_ports.comports():
             try:
-                self.connect_dynamixel(port[0], dynabaud)
+                self.connect_dynamixel(port[0], dynabaud, protocol)
                 if verbose:
                     print"Connected to Dynamixel on " + port[0]
                 break
@@ -155,9 +174,13 @@ class Freeloader():
             speed = 70
         speed = int(round(speed*self.mmpm2speed))
         if self.dyna_online == 1:
+            if 1 in self.dyna.halted:
+                raise FreeloaderError("Motor halted by the watchdog, cannot move")
             if not down:
                 speed += 1024
             self.dyna.SetMovingSpeed(1,speed)
+            self.moving = speed & 1023 != 0
+            self.moving_since = clock.now()
         else:
             raise FreeloaderError("Motor not connected, cannot move")
 
@@ -165,6 +188,7 @@ class Freeloader():
         """Stops the motor."""
         if self.dyna_online == 1:
             self.dyna.SetMovingSpeed(1,0)
+            self.moving = False
         else:
             raise FreeloaderError("Motor not connected, cannot stop")
 
@@ -185,6 +209,8 @@ class Freeloader():
         """
         if self.last_encoder == 9999:
             self.last_encoder = self.get_raw_encoder()
+            self.last_position = 0
+            self.last_position_time = clock.now()
             return 0
         current_encoder = self.get_raw_encoder()
         if abs(self.last_encoder - current_encoder) > 2048:      # ie, overflow
@@ -196,6 +222,8 @@ class Freeloader():
             difference = self.last_encoder - current_encoder
         self.last_encoder = current_encoder
         self.linpos += difference/self.mm2enc
+        self.last_position = self.linpos
+        self.last_position_time = clock.now()
         return self.linpos
 
     def reset_linear_position(self):
@@ -209,10 +237,12 @@ class Freeloader():
         If it waits for longer than timeout, a FreeloaderError is raised.
         """
         if self.cell_online == 1:
+            t = profiler.tic()
             elapsed = 0
-            start = time.time()
+            start = clock.now()
             while (self.cell.inWaiting() < len) and (elapsed <= timeout):
-                elapsed = time.time() - start
+                elapsed = clock.now() - start
+            profiler.toc("freeloader.wait_for_cell", t)
             if elapsed > timeout:
                 msg = "Load cell response timed out with " + str(self.cell.inWaiting())
                 msg += " bytes after " + str(round(elapsed,3)) + " seconds."
@@ -236,7 +266,10 @@ class Freeloader():
             self.cell.write("W\r")
             self.wait_for_cell(14, .5)
             out = self.read_raw_cell()
-            return float(out.split()[0])
+            load = float(out.split()[0])
+            self.last_load = load
+            self.last_load_time = clock.now()
+            return load
         else:
             raise FreeloaderError("Load cell not connected, cannot read.")
 
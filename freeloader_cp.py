@@ -1,8 +1,14 @@
 """
 Simple GUI for controlling a Freeloader.
-Buttons and controls generally change state variables stored in the handles
-object, h. Every few hundred milliseconds, update_GUI runs and communicates
-with the machine based on what the state variables are asking for. 
+The machine itself is driven by a MachineWorker (see machineworker.py) on a
+background thread, which polls position and load as fast as the bus allows
+and runs move-to-target control at that rate. Buttons and controls send it
+commands, and every few tens of milliseconds, update_GUI displays the latest
+state it reported. So a slow or failed serial read never freezes the window.
+Every state is also added to a live plot of load against position (see
+liveplot.py), in a second window. The Record button makes the worker save
+every sample it takes to a stream file, until it is pressed again; use
+datastream.stream_to_csv to turn the recording into a CSV.
 
 This is a Tkinter GUI. Fully documenting it here would be a little cumbersome,
 but the below should be self-explanatory enough.
@@ -10,76 +16,100 @@ but the below should be self-explanatory enough.
 
 from Tkinter import *
 from freeloader import Freeloader, FreeloaderError
-import ttk, sys
-
-def update_GUI(gui, h, fl):
-    if (not h.stopped) and (not h.override):
-        try:
-            fl.start_motor(h.SliderSpeed.get(), down = h.down)
-        except:
-            print "There was an error setting speed!"
-    h.position = fl.get_linear_position()
-    h.load = fl.read_cell()
-    h.PositionOut.configure(text=str(round(h.position,2))+" mm")
-    h.LoadOut.configure(text=str(round(h.load,2))+" lbs")
-    if not (h.target == None):
-        if h.target > h.position:
-            h.down = False
-            h.stopped = False
-        if h.target < h.position:
-            h.down = True
-            h.stopped = False
-        if (abs(h.target - h.position) < 1) and (h.SliderSpeed.get() > 30):
-            h.override = True
-            fl.start_motor(30, down = h.down)
-        if abs(h.target - h.position) < .5:
-            h.override = True
-            fl.start_motor(abs(h.target - h.position)*60, down = h.down)
-        if abs(h.target - h.position) < .01:
-            h.override = False
-            stop(h,fl)
-    h.alarm = gui.after(h.poll_rate,update_GUI,gui,h,fl)
-
-def go_up(h, fl):
-    h.stopped = False
-    h.down = False
-
-def go_down(h, fl):
-    h.stopped = False
-    h.down = True
-
-def move(h, fl):
-    h.target = h.position + float(h.TextMove.get(1.0,END))
-    print "Moving to position " + str(round(h.target,2))
-
-def stop(h, fl):
-    h.target = None
-    h.stopped = True
+from machineworker import MachineWorker
+from daemon import RemoteFreeloader, RemoteWorker
+from liveplot import plot_window
+import ttk, sys, tkFileDialog
+
+def update_GUI(gui, h, worker):
+    speed = h.SliderSpeed.get()
+    if speed != h.speed:
+        h.speed = speed
+        worker.command("speed", speed)
+    states = worker.drain()
+    for state in states:
+        if not state['error']:
+            h.plot.add(state['position'], state['load'])
+    h.plot.render()
+    if states:
+        state = states[-1]
+        h.position = state['position']
+        h.load = state['load']
+        h.PositionOut.configure(text=str(round(h.position,2))+" mm")
+        h.LoadOut.configure(text=str(round(h.load,2))+" lbs")
+        if state['error'] and state['error'] != h.error:
+            print "There was an error talking to the machine!"
+            print state['error']
+        h.error = state['error']
+        if state['recording']:
+            h.ButtonRecord.configure(text="Stop (%d)" % state['recorded'])
+        else:
+            h.ButtonRecord.configure(text="Record")
+        h.recording = state['recording']
+    h.alarm = gui.after(h.poll_rate,update_GUI,gui,h,worker)
+
+def go_up(h, worker):
+    worker.command("up")
+
+def go_down(h, worker):
+    worker.command("down")
+
+def move(h, worker):
     try:
-        fl.stop_motor()
-    except:
-        print "There was an error sending the stop command!"
+        distance = float(h.TextMove.get(1.0,END))
+    except ValueError:
+        print "Enter a distance in mm to move by."
+        return
+    worker.command("move", distance)
+    print "Moving to position " + str(round(h.position + distance,2))
 
-def init_GUI(gui, h, fl):
+def stop(h, worker):
+    worker.command("stop")
+
+def record(h, worker):
+    if h.recording:
+        worker.command("stop_record")
+        print "Recording saved to " + h.recording
+        return
+    fname = tkFileDialog.asksaveasfilename(defaultextension='.pyld',
+        filetypes=[('PyLoader stream','.pyld')])
+    if fname:
+        worker.command("record", fname, "Recorded from the control panel")
+        print "Recording to " + fname
+
+def quit(gui, h, worker):
+    gui.after_cancel(h.alarm)
+    worker.stop()
+    worker.fl.disconnect()
+    gui.destroy()
+
+def init_GUI(gui, h, worker):
     """This initializes callbacks and bindings (functions that get called when
     buttons get hit, etc). It also initializes all the state variables.)
     """
-    h.ButtonUp.config(command=lambda: go_up(h,fl))
-    h.ButtonStop.config(command=lambda: stop(h,fl))
-    h.ButtonDown.config(command=lambda: go_down(h,fl))
+    h.ButtonUp.config(command=lambda: go_up(h,worker))
+    h.ButtonStop.config(command=lambda: stop(h,worker))
+    h.ButtonDown.config(command=lambda: go_down(h,worker))
     h.SliderSpeed.set(10)
-    h.ButtonGo.config(command=lambda: move(h,fl))
-    h.ButtonZero.config(command=lambda: fl.reset_linear_position())
+    h.ButtonGo.config(command=lambda: move(h,worker))
+    h.ButtonZero.config(command=lambda: worker.command("zero"))
+    h.ButtonRecord.config(command=lambda: record(h,worker))
+    gui.protocol("WM_DELETE_WINDOW", lambda: quit(gui,h,worker))
+    h.plot = plot_window(gui, "Load vs. Position", "Position (mm)", "Load (lbs)")
+    h.plot.window.protocol("WM_DELETE_WINDOW", h.plot.window.withdraw)
+    h.ButtonClear = Button(h.plot.window, text="Clear", command=h.plot.clear)
+    h.ButtonClear.pack()
     # fl.tare_cell()
 
-    # Define GUI state variables
-    h.poll_rate = 300
-    h.target = None
+    # Define GUI state variables. The display refreshes every poll_rate ms;
+    # the machine is polled by the worker, independently.
+    h.poll_rate = 40
+    h.speed = None
     h.position = 0
     h.load = 0
-    h.stopped = True
-    h.down = False
-    h.override = False
+    h.error = None
+    h.recording = None
+    h.alarm = None
     return h
 
 class Handle():
@@ -306,14 +336,31 @@ def populate_gui(gui):
     h.PositionOut.configure(text='''None''')
     h.PositionOut.configure(width=180)
 
+    h.ButtonRecord = Button (gui)
+    h.ButtonRecord.place(relx=0.62,rely=0.84,height=32,width=130)
+    h.ButtonRecord.configure(activebackground="#d9d9d9")
+    h.ButtonRecord.configure(activeforeground="#000000")
+    h.ButtonRecord.configure(background=_bgcolor)
+    h.ButtonRecord.configure(disabledforeground="#a3a3a3")
+    h.ButtonRecord.configure(font=font11)
+    h.ButtonRecord.configure(foreground="#000000")
+    h.ButtonRecord.configure(highlightbackground="#d9d9d9")
+    h.ButtonRecord.configure(highlightcolor="black")
+    h.ButtonRecord.configure(pady="0")
+    h.ButtonRecord.configure(text='''Record''')
+
     return h
 
 """
 This is what actually runs, ending the in gui.mainloop, the GUI loop.
 Note that a connection to the machine must be established before the GUI
-appears and becomes usable.
+appears and becomes usable. With --daemon, the machine held by a running
+daemon (see daemon.py) is used instead, and can be shared with test scripts.
 """
-fl = Freeloader()
+if "--daemon" in sys.argv:
+    fl = RemoteFreeloader()
+else:
+    fl = Freeloader()
 try:
     fl.autoconnect()
 except FreeloaderError as fe:
@@ -321,8 +368,13 @@ except FreeloaderError as fe:
     print fe.msg
     out = raw_input("Hit enter to exit program.")
     sys.exit(0)
+if "--daemon" in sys.argv:
+    worker = RemoteWorker(fl)
+else:
+    worker = MachineWorker(fl)
+worker.start()
 gui = Tk()
 h = populate_gui(gui)
-init_GUI(gui, h, fl)
-update_GUI(gui, h, fl)
+init_GUI(gui, h, worker)
+update_GUI(gui, h, worker)
 gui.mainloop()
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+liveplot.py
+
+A live x-y plot on a Tkinter Canvas, for watching a curve form while it is
+being collected.
+
+Redrawing every point on every frame gets slower as the data grows, until the
+GUI can't keep up. LivePlot instead divides the plot into one bin per pixel
+column and only remembers the lowest and highest y value that fell in each.
+Each column is drawn as one vertical line from its minimum to its maximum,
+which looks the same as drawing every point at that resolution. A new point
+changes at most one column, so adding points is cheap and the canvas never
+holds more items than the plot is wide, however many points there are:
+
+    plot = LivePlot(canvas, "Position (mm)", "Load (lbs)")
+    for x, y in new_points:
+        plot.add(x, y)
+    plot.render()                       # once per GUI frame
+
+The axes grow automatically, by doubling, when a point falls outside them.
+Growing the x axis merges pairs of bins, so no original points are needed.
+"""
+
+from Tkinter import Canvas, Toplevel
+
+class LivePlot():
+    """
+    Plots points on canvas, a Tkinter Canvas, within margin pixels of its
+    edges. x_span and y_span are the initial ranges of the axes, centered on
+    the first point. x_label and y_label go along the axes.
+    """
+
+    def __init__(self, canvas, x_label = "", y_label = "", x_span = 1.0,
+                 y_span = 1.0, color = "blue", margin = 40):
+        self.canvas = canvas
+        self.x_label = x_label
+        self.y_label = y_label
+        self.x_span = x_span
+        self.y_span = y_span
+        self.color = color
+        self.margin = margin
+        self.left = margin
+        self.top = margin / 4
+        width = int(canvas['width']) - self.left - margin / 4
+        self.columns = max(2, width - width % 2)   # Even, so bins merge in pairs
+        self.height = int(canvas['height']) - self.top - margin
+        self._items = [None] * self.columns
+        self._axes = []
+        self._marker = None
+        self.clear()
+
+    def clear(self):
+        """Removes every point."""
+        for item in self._items:
+            if item is not None:
+                self.canvas.delete(item)
+        if self._marker is not None:
+            self.canvas.delete(self._marker)
+            self._marker = None
+        self._items = [None] * self.columns
+        self.lo = [None] * self.columns
+        self.hi = [None] * self.columns
+        self.count = 0
+        self.last = None
+        self.x0 = None
+        self.dx = None
+        self.y_lo = None
+        self.y_hi = None
+        self._dirty = set()
+        self._full = True
+
+    def add(self, x, y):
+        """Adds the point (x, y). It appears on the next render()."""
+        if x != x or y != y:
+            return                      # NaN: nothing to draw
+        if self.x0 is None:
+            self.x0 = x - self.x_span / 2.0
+            self.dx = float(self.x_span) / self.columns
+            self.y_lo = y - self.y_span / 2.0
+            self.y_hi = y + self.y_span / 2.0
+        while x < self.x0:
+            self._grow_x(left = True)
+        while x >= self.x0 + self.dx * self.columns:
+            self._grow_x(left = False)
+        while y < self.y_lo or y > self.y_hi:
+            span = self.y_hi - self.y_lo
+            if y > self.y_hi:
+                self.y_hi = self.y_lo + 2 * span
+            else:
+                self.y_lo = self.y_hi - 2 * span
+            self._full = True
+        b = min(int((x - self.x0) / self.dx), self.columns - 1)
+        if self.lo[b] is None:
+            self.lo[b] = self.hi[b] = y
+            self._dirty.add(b)
+        elif y < self.lo[b]:
+            self.lo[b] = y
+            self._dirty.add(b)
+        elif y > self.hi[b]:
+            self.hi[b] = y
+            self._dirty.add(b)
+        self.count += 1
+        self.last = (x, y)
+
+    def extend(self, points):
+        """Adds every (x, y) in points."""
+        for x, y in points:
+            self.add(x, y)
+
+    def _grow_x(self, left):
+        """Doubles the x range, towards the left or the right, merging bin pairs."""
+        n = self.columns
+        lo = [None] * n
+        hi = [None] * n
+        offset = n / 2 if left else 0
+        for i in range(n / 2):
+            pair = [v for v in self.lo[2 * i:2 * i + 2] if v is not None]
+            if pair:
+                lo[offset + i] = min(pair)
+                hi[offset + i] = max(v for v in self.hi[2 * i:2 * i + 2] if v is not None)
+        if left:
+            self.x0 -= n * self.dx
+        self.dx *= 2
+        self.lo = lo
+        self.hi = hi
+        self._full = True
+
+    def _y_pixel(self, y):
+        return self.top + self.height * (self.y_hi - y) / (self.y_hi - self.y_lo)
+
+    def render(self):
+        """Brings the canvas up to date with the points added so far."""
+        if self.x0 is None:
+            return
+        if self._full:
+            self._draw_axes()
+            dirty = range(self.columns)
+        else:
+            dirty = self._dirty
+        for b in dirty:
+            item = self._items[b]
+            if self.lo[b] is None:
+                if item is not None:
+                    self.canvas.delete(item)
+                    self._items[b] = None
+                continue
+            px = self.left + b + .5
+            y1 = self._y_pixel(self.hi[b])
+            y2 = max(self._y_pixel(self.lo[b]), y1 + 1)
+            if item is None:
+                self._items[b] = self.canvas.create_line(px, y1, px, y2,
+                                                         fill = self.color)
+            else:
+                self.canvas.coords(item, px, y1, px, y2)
+        self._dirty = set()
+        self._full = False
+        if self.last is not None:
+            px = self.left + (self.last[0] - self.x0) / self.dx
+            py = self._y_pixel(self.last[1])
+            if self._marker is None:
+                self._marker = self.canvas.create_oval(px - 3, py - 3, px + 3,
+                    py + 3, outline = "red")
+            else:
+                self.canvas.coords(self._marker, px - 3, py - 3, px + 3, py + 3)
+
+    def _draw_axes(self):
+        """Draws the frame, the axis labels and the limits of both axes."""
+        for item in self._axes:
+            self.canvas.delete(item)
+        c = self.canvas
+        right = self.left + self.columns
+        bottom = self.top + self.height
+        x1 = self.x0 + self.dx * self.columns
+        self._axes = [
+            c.create_rectangle(self.left, self.top, right, bottom),
+            c.create_text(self.left, bottom + 2, anchor = "nw",
+                          text = "%.4g" % self.x0),
+            c.create_text(right, bottom + 2, anchor = "ne", text = "%.4g" % x1),
+            c.create_text((self.left + right) / 2, bottom + 16, anchor = "n",
+                          text = self.x_label),
+            c.create_text(self.left - 2, self.top, anchor = "ne",
+                          text = "%.4g" % self.y_hi),
+            c.create_text(self.left - 2, bottom, anchor = "se",
+                          text = "%.4g" % self.y_lo),
+            c.create_text(2, (self.top + bottom) / 2, anchor = "w",
+                          text = self.y_label.replace(" ", "\n"))]
+
+def plot_window(parent, title, x_label = "", y_label = "", width = 600,
+                height = 400, **kwargs):
+    """
+    Makes a Canvas of the given size in a new Toplevel window of parent, and
+    returns a LivePlot on it. Extra arguments go to LivePlot.
+    """
+    window = Toplevel(parent)
+    window.title(title)
+    canvas = Canvas(window, width = width, height = height, background = "white")
+    canvas.pack()
+    plot = LivePlot(canvas, x_label, y_label, **kwargs)
+    plot.window = window
+    return plot
@@ -0,0 +1,197 @@
+"""
+loadcal.py
+
+Finds the fastest settings a Loadstar load cell interface sustains, and remembers them.
+
+autoconnect used to connect every load cell at 9600 baud and 120 samples per
+second, which limits collection to around 30 Hz whatever the hardware could
+do. This module tries every combination of the candidate baud rates and SPS
+settings on a load cell, and measures each one: how many readings per second
+read_cell actually gets, how noisy they are, and whether any failed. The best
+combination is saved per device, in CONFIG_FILE, and from then on
+Freeloader.connect_load uses it whenever no baud rate or SPS is given.
+
+Calibrate with the load cell connected, unloaded and left still, since noise
+is measured as the standard deviation of the readings:
+
+    python loadcal.py                   # every load cell found
+    python loadcal.py --port COM5 --duration 5
+
+The best combination is the fastest one, among those which never failed and
+whose noise is within noise_factor times that of the quietest.
+"""
+
+import os, sys, json, math, time, argparse
+import clock
+from serial.tools import list_ports
+
+BAUDS = [9600, 19200, 38400, 57600, 115200, 230400]
+SPS = [120, 240, 480, 960]
+
+# Used for devices which have not been calibrated.
+DEFAULT_BAUD = 9600
+DEFAULT_SPS = 120
+
+# Fraction by which measured rates may differ and still count as the same.
+RATE_TOLERANCE = .05
+
+CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".pyloader", "loadcell.json")
+
+def device_id(port):
+    """
+    A string identifying the device on port which survives it moving to
+    another port: its hardware ID, including any USB serial number. Falls
+    back to the port name if the hardware ID is unknown.
+    """
+    for info in list_ports.comports():
+        if info[0] == port and len(info) > 2 and info[2] and info[2] != 'n/a':
+            return info[2]
+    return port
+
+def load_configs(fname = CONFIG_FILE):
+    """Returns {device id: configuration} from fname, or {} if there is none."""
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def save_config(device, config, fname = CONFIG_FILE):
+    """Saves the configuration of device in fname, keeping those of other devices."""
+    configs = load_configs(fname)
+    configs[device] = config
+    directory = os.path.dirname(fname)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(fname, 'w') as f:
+        json.dump(configs, f, indent = 2, sort_keys = True)
+
+def saved_config(port, fname = CONFIG_FILE):
+    """Returns (baud, sps) saved for the device on port, or the defaults."""
+    config = load_configs(fname).get(device_id(port))
+    if config is None:
+        return DEFAULT_BAUD, DEFAULT_SPS
+    return config['baud'], config['sps']
+
+def measure(fl, duration = 2.0):
+    """
+    Reads the load cell of the connected Freeloader fl as fast as possible for
+    duration seconds. Returns a dictionary of the readings per second
+    (rate_hz), their standard deviation in lbs (noise), the number taken
+    (samples) and the number which failed (errors).
+    """
+    from freeloader import FreeloaderError
+    values = []
+    errors = 0
+    for i in range(3):              # Let the new settings take effect.
+        try:
+            fl.read_cell()
+        except (FreeloaderError, ValueError, IndexError):
+            pass
+    start = clock.now()
+    end = start + duration
+    while clock.now() < end:
+        try:
+            values.append(fl.read_cell())
+        except (FreeloaderError, ValueError, IndexError):
+            errors += 1
+            fl.cell.flushInput()
+    elapsed = clock.now() - start
+    n = len(values)
+    mean = sum(values) / n if n else float('nan')
+    noise = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1)) if n > 1 \
+        else float('nan')
+    return {'rate_hz': n / elapsed, 'noise': noise, 'samples': n, 'errors': errors}
+
+def probe(port, bauds = BAUDS, sps = SPS, duration = 2.0, verbose = True):
+    """
+    Measures (see measure) every combination of bauds and sps on the load cell
+    on port. Returns a list of result dictionaries, which also have the keys
+    baud and sps. Combinations the load cell doesn't answer at are left out.
+    """
+    from freeloader import Freeloader, FreeloaderError
+    results = []
+    for baud in bauds:
+        for s in sps:
+            fl = Freeloader()
+            try:
+                fl.connect_load(port, baud, s)
+            except FreeloaderError:
+                if verbose:
+                    print "%6d baud, %4d SPS: no answer" % (baud, s)
+                if s == sps[0]:
+                    break               # Nothing at this baud rate at all.
+                continue
+            try:
+                result = measure(fl, duration)
+            finally:
+                fl.disconnect()
+            result['baud'] = baud
+            result['sps'] = s
+            results.append(result)
+            if verbose:
+                print "%6d baud, %4d SPS: %7.1f readings/s, noise %.4f lbs, %d errors" % \
+                    (baud, s, result['rate_hz'], result['noise'], result['errors'])
+    return results
+
+def choose(results, noise_factor = 2.0):
+    """
+    Returns the best of the results of probe: the fastest without errors whose
+    noise is at most noise_factor times the lowest noise seen. Rates within
+    RATE_TOLERANCE of the fastest count as equally fast, and then the quietest
+    wins. None if every combination had errors.
+    """
+    good = [r for r in results if not r['errors'] and r['samples'] > 1]
+    if not good:
+        return None
+    quietest = min(r['noise'] for r in good)
+    quiet = [r for r in good if r['noise'] <= quietest * noise_factor or r['noise'] == 0]
+    fastest = max(r['rate_hz'] for r in quiet)
+    fast = [r for r in quiet if r['rate_hz'] >= fastest * (1 - RATE_TOLERANCE)]
+    return min(fast, key = lambda r: (r['noise'], r['baud']))
+
+def calibrate(port, bauds = BAUDS, sps = SPS, duration = 2.0, noise_factor = 2.0,
+              fname = CONFIG_FILE, verbose = True):
+    """
+    Probes the load cell on port, then saves and returns the best configuration,
+    or returns None if nothing worked. See probe and choose.
+    """
+    results = probe(port, bauds, sps, duration, verbose)
+    best = choose(results, noise_factor)
+    if best is None:
+        if verbose:
+            print "No working configuration found on " + port
+        return None
+    best = dict(best, port = port, calibrated = time.time())
+    save_config(device_id(port), best, fname)
+    if verbose:
+        print "Using %d baud, %d SPS on %s: %.1f readings/s" % (best['baud'],
+            best['sps'], port, best['rate_hz'])
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Find and save the fastest "
+                                     "settings of every connected load cell.")
+    parser.add_argument("--port", action = "append",
+                        help = "calibrate only this port (may be repeated)")
+    parser.add_argument("--duration", type = float, default = 2.0,
+                        help = "seconds to measure each combination for")
+    parser.add_argument("--baud", type = int, action = "append",
+                        help = "baud rate to try (may be repeated)")
+    parser.add_argument("--sps", type = int, action = "append",
+                        help = "SPS setting to try (may be repeated)")
+    parser.add_argument("--noise-factor", type = float, default = 2.0)
+    args = parser.parse_args()
+
+    ports = args.port or [info[0] for info in list_ports.comports()]
+    found = 0
+    for port in ports:
+        print "Probing " + port + "..."
+        if calibrate(port, args.baud or BAUDS, args.sps or SPS, args.duration,
+                     args.noise_factor):
+            found += 1
+    if not found:
+        print "No load cells were calibrated."
+        sys.exit(1)
+    print "Saved to " + CONFIG_FILE
@@ -0,0 +1,235 @@
+"""
+machineworker.py
+
+Runs a Freeloader on a background thread, for user interfaces.
+
+A GUI which talks to the machine itself freezes whenever a serial read is slow
+or times out, and can only poll as often as it can afford to freeze. A
+MachineWorker owns the Freeloader instead. Its thread reads position and load
+as fast as the bus allows and makes every control decision, including moving
+to a target position, at that rate. The GUI only exchanges messages with it:
+
+    worker = MachineWorker(fl)
+    worker.start()
+    worker.command("speed", 20)
+    worker.command("up")
+    worker.command("move", 5.0)         # relative move, in mm
+    ...
+    for state in worker.drain():        # in a GUI timer
+        ...
+
+Commands go in through worker.commands and states come out through
+worker.states, both Queue.Queues. Every state is a dictionary with the keys
+time, position, load, target, stopped, down, error, recording and recorded.
+The most recent one is also always in worker.state.
+
+The worker can also record every sample it takes, at the full polling rate,
+to a stream file (see datastream.py) with the columns time, position and
+load. Time is in seconds since the recording started:
+
+    worker.command("record", "jog1.pyld")
+    ...
+    worker.command("stop_record")
+"""
+
+import Queue, threading
+import serial
+import clock
+from freeloader import FreeloaderError
+from datastream import StreamWriter
+
+# Errors talking to the machine, which the worker reports and carries on from.
+MACHINE_ERRORS = (FreeloaderError, ValueError, IOError, serial.SerialException)
+
+class MachineWorker():
+    """Owns a connected Freeloader and drives it from a background thread."""
+
+    def __init__(self, fl, speed = 10, rate = None, max_states = 100000):
+        """
+        fl is a connected Freeloader, which no other thread should use while
+        the worker runs. speed is the initial jog speed in mm/min. rate limits
+        how often the machine is polled, in Hz (None for as fast as possible).
+        At most max_states unread states are queued; older ones are dropped.
+        """
+        self.fl = fl
+        self.speed = speed
+        self.period = 1.0 / rate if rate else 0.0
+        self.commands = Queue.Queue()
+        self.states = Queue.Queue(max_states)
+        self.state = None
+        self.listeners = []
+        self.target = None
+        self.stopped = True
+        self.down = False
+        self.position = 0.0
+        self.load = 0.0
+        self.writer = None
+        self.record_start = None
+        self.recorded = 0
+        self._sent = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the worker thread."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target = self._run, name = "MachineWorker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the motor, any recording and the worker thread. The Freeloader
+        stays connected.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def command(self, name, *args):
+        """
+        Queues a command: up, down, stop, speed (mm/min), move (mm), zero,
+        tare, record (file name, optional header) or stop_record.
+        """
+        self.commands.put((name,) + args)
+
+    def drain(self):
+        """Returns every state queued since the last call, oldest first."""
+        out = []
+        try:
+            while True:
+                out.append(self.states.get_nowait())
+        except Queue.Empty:
+            return out
+
+    def _run(self):
+        # Whatever goes wrong, the motor must not be left running.
+        try:
+            self._loop()
+        finally:
+            try:
+                self.fl.stop_motor()
+            except MACHINE_ERRORS:
+                pass
+            self._stop_recording()
+
+    def _loop(self):
+        error = None
+        while not self._stopping.is_set():
+            start = clock.now()
+            try:
+                self._handle_commands()
+                self.position = self.fl.get_linear_position()
+                self.load = self.fl.read_cell()
+                t = clock.now()
+                self._control()
+                if self.writer is not None:
+                    self.writer.append([t - self.record_start, self.position, self.load])
+                    self.recorded += 1
+                error = None
+            except MACHINE_ERRORS as e:
+                error = getattr(e, 'msg', None) or str(e)
+                self._sent = None       # Resend the speed once things recover.
+                t = clock.now()
+            self._publish(t, error)
+            clock.sleep(self.period - (clock.now() - start))
+
+    def _handle_commands(self):
+        """Applies every queued command."""
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except Queue.Empty:
+                return
+            name = command[0]
+            if name == "up":
+                self.target = None
+                self.stopped = False
+                self.down = False
+            elif name == "down":
+                self.target = None
+                self.stopped = False
+                self.down = True
+            elif name == "stop":
+                self.target = None
+                self.stopped = True
+            elif name == "speed":
+                self.speed = command[1]
+            elif name == "move":
+                self.target = self.position + command[1]
+            elif name == "zero":
+                self.fl.reset_linear_position()
+                self.position = 0.0
+                self.target = None
+            elif name == "tare":
+                self.fl.tare_cell()
+            elif name == "record":
+                self._stop_recording()
+                try:
+                    self.writer = StreamWriter(command[1], ["time", "position", "load"],
+                                               command[2] if len(command) > 2 else "")
+                except IOError as e:
+                    print "Could not start recording to " + command[1]
+                    print e
+                    continue
+                self.record_start = clock.now()
+                self.recorded = 0
+            elif name == "stop_record":
+                self._stop_recording()
+
+    def _stop_recording(self):
+        """Closes the stream file being recorded to, if any."""
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        try:
+            writer.close()
+        except IOError as e:
+            print "Recording to " + writer.fname + " failed!"
+            print e
+
+    def _control(self):
+        """Decides on the motor speed and sends it if it changed."""
+        speed = self.speed
+        if self.target is not None:
+            distance = self.target - self.position
+            self.down = distance < 0
+            self.stopped = False
+            # Slow down on the approach, so the target isn't overshot.
+            if abs(distance) < 1:
+                speed = min(speed, 30)
+            if abs(distance) < .5:
+                speed = abs(distance) * 60
+            if abs(distance) < .01:
+                self.target = None
+                self.stopped = True
+        if self.stopped:
+            wanted = (0, False)
+        else:
+            wanted = (speed, self.down)
+        if wanted != self._sent:
+            if self.stopped:
+                self.fl.stop_motor()
+            else:
+                self.fl.start_motor(speed, down = self.down)
+            self._sent = wanted
+
+    def _publish(self, t, error):
+        """Makes a new state available to the GUI and any listeners."""
+        state = {'time': t, 'position': self.position, 'load': self.load,
+                 'target': self.target, 'stopped': self.stopped,
+                 'down': self.down, 'error': error,
+                 'recording': self.writer.fname if self.writer else None,
+                 'recorded': self.recorded}
+        self.state = state
+        try:
+            self.states.put_nowait(state)
+        except Queue.Full:
+            try:
+                self.states.get_nowait()
+                self.states.put_nowait(state)
+            except (Queue.Empty, Queue.Full):
+                pass
+        for listener in self.listeners:
+            listener(state)
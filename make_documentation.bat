@@ -4,5 +4,28 @@
 @python c:\Python27\Lib\pydoc.py -w basictest
 @python c:\Python27\Lib\pydoc.py -w tensiontest
 @python c:\Python27\Lib\pydoc.py -w griptest
+@python c:\Python27\Lib\pydoc.py -w datastream
+@python c:\Python27\Lib\pydoc.py -w csvexport
+@python c:\Python27\Lib\pydoc.py -w clock
+@python c:\Python27\Lib\pydoc.py -w scheduler
+@python c:\Python27\Lib\pydoc.py -w conditions
+@python c:\Python27\Lib\pydoc.py -w onlinestats
+@python c:\Python27\Lib\pydoc.py -w reporter
+@python c:\Python27\Lib\pydoc.py -w storage
+@python c:\Python27\Lib\pydoc.py -w cyclic
+@python c:\Python27\Lib\pydoc.py -w analysis
+@python c:\Python27\Lib\pydoc.py -w simulated
+@python c:\Python27\Lib\pydoc.py -w benchmark
+@python c:\Python27\Lib\pydoc.py -w profiler
+@python c:\Python27\Lib\pydoc.py -w sensors
+@python c:\Python27\Lib\pydoc.py -w machineworker
+@python c:\Python27\Lib\pydoc.py -w liveplot
+@python c:\Python27\Lib\pydoc.py -w stopsignal
+@python c:\Python27\Lib\pydoc.py -w daemon
+@python c:\Python27\Lib\pydoc.py -w shmring
+@python c:\Python27\Lib\pydoc.py -w loadcal
+@python c:\Python27\Lib\pydoc.py -w recipes
+@python c:\Python27\Lib\pydoc.py -w watchdog
+@python c:\Python27\Lib\pydoc.py -w archive
 xcopy *.html docs /i /y /q
 del *.html
\ No newline at end of file
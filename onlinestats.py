@@ -0,0 +1,209 @@
+"""
+onlinestats.py
+
+Streaming statistics on collected channels.
+
+Numbers like peak load, stiffness, a moving average or the noise level would
+normally be calculated from BasicTest.data after the test, or by scanning all
+of it every time they are needed. The accumulators here are instead updated
+with each new datapoint, at a constant cost per datapoint, and always hold
+the current answer.
+
+    MinMax("load")                      running min and max (peak load)
+    EWMA("load", alpha = .1)            exponentially weighted moving average
+    WindowedMeanVar("load", 50)         mean, variance and standard deviation
+                                        of the last 50 samples (noise level)
+    RollingSlope("load", "position", 20)
+                                        least-squares slope over the last 20
+                                        samples (stiffness)
+
+Register them with a test and they are updated as data is collected:
+
+    self.add_stat("peak", MinMax("load"), display = True)
+    self.add_stat("stiffness", RollingSlope("load", "position", 20))
+    ...
+    print self.stats["peak"].max
+
+Every accumulator has a value attribute holding its main result, which is
+what gets displayed and what conditions.stat_above/stat_below compare against.
+"""
+
+import math, collections
+
+class Accumulator():
+    """
+    Base class of all accumulators. Subclasses override _bind, reset and update.
+    After update, self.value holds the main result (None until there is one).
+    """
+
+    def bind(self, col):
+        """
+        Resolves column names with col, a dictionary like BasicTest.col, and
+        resets the accumulator. Raises KeyError for an unknown column.
+        """
+        self._bind(col)
+        self.reset()
+        return self
+
+    def _bind(self, col):
+        self.index = col[self.column]
+
+    def reset(self):
+        """Forgets everything seen so far."""
+        self.value = None
+
+    def update(self, point):
+        """Feeds in the newest datapoint."""
+        raise NotImplementedError
+
+class MinMax(Accumulator):
+    """Running minimum and maximum of a column. value is the maximum."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def reset(self):
+        self.value = self.min = self.max = None
+
+    def update(self, point):
+        x = point[self.index]
+        if self.max is None:
+            self.min = self.max = x
+        elif x > self.max:
+            self.max = x
+        elif x < self.min:
+            self.min = x
+        self.value = self.max
+
+    def __str__(self):
+        return "min/max of %s" % self.column
+
+class EWMA(Accumulator):
+    """
+    Exponentially weighted moving average of a column. alpha is the weight of
+    each new sample, between 0 and 1; smaller is smoother.
+    """
+
+    def __init__(self, column, alpha = .1):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1], not %s" % alpha)
+        self.column = column
+        self.alpha = alpha
+
+    def update(self, point):
+        x = point[self.index]
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+
+    def __str__(self):
+        return "EWMA of %s" % self.column
+
+class WindowedMeanVar(Accumulator):
+    """
+    Mean and variance of a column over the last window samples, kept with
+    a windowed form of Welford's algorithm. value is the mean; the variance
+    and standard deviation are in var and std.
+    """
+
+    def __init__(self, column, window = 50):
+        self.column = column
+        self.window = window
+
+    def reset(self):
+        self.value = None
+        self.var = self.std = 0.0
+        self.samples = collections.deque()
+        self._m2 = 0.0
+
+    def update(self, point):
+        x = float(point[self.index])
+        samples = self.samples
+        samples.append(x)
+        if self.value is None:
+            self.value = x
+        elif len(samples) <= self.window:
+            old = self.value
+            self.value += (x - old) / len(samples)
+            self._m2 += (x - old) * (x - self.value)
+        else:
+            y = samples.popleft()
+            old = self.value
+            self.value += (x - y) / self.window
+            self._m2 += (x - y) * (x - self.value + y - old)
+        n = len(samples)
+        if n > 1:
+            self.var = max(self._m2, 0.0) / (n - 1)
+            self.std = math.sqrt(self.var)
+
+    def __str__(self):
+        return "mean of %s over %d samples" % (self.column, self.window)
+
+class RollingSlope(Accumulator):
+    """
+    Least-squares slope of column y against column x over the last window
+    samples, for example load against position for stiffness. value is the
+    slope, or None until the window is full and x has moved. The intercept
+    is in intercept.
+    """
+
+    def __init__(self, y, x, window = 20):
+        self.y = y
+        self.x = x
+        self.window = window
+
+    def _bind(self, col):
+        self.yi = col[self.y]
+        self.xi = col[self.x]
+
+    def reset(self):
+        self.value = self.intercept = None
+        self.points = collections.deque()
+        self._rebase()
+
+    def _rebase(self):
+        """
+        Recomputes the sums from the points in the window, relative to the
+        oldest of them. Done every window updates, so that neither large x
+        nor long runs cost precision to cancellation or drift.
+        """
+        self.x0, self.y0 = self.points[0] if self.points else (0.0, 0.0)
+        self.sx = self.sy = self.sxx = self.sxy = 0.0
+        for x, y in self.points:
+            self._add(x, y, 1)
+        self._updates = 0
+
+    def _add(self, x, y, sign):
+        dx = x - self.x0
+        dy = y - self.y0
+        self.sx += sign * dx
+        self.sy += sign * dy
+        self.sxx += sign * dx * dx
+        self.sxy += sign * dx * dy
+
+    def update(self, point):
+        x = point[self.xi]
+        y = point[self.yi]
+        self.points.append((x, y))
+        if len(self.points) > self.window:
+            ox, oy = self.points.popleft()
+            self._add(ox, oy, -1)
+        self._updates += 1
+        if self._updates >= self.window or len(self.points) == 1:
+            self._rebase()
+        else:
+            self._add(x, y, 1)
+        if len(self.points) < self.window:
+            return
+        n = len(self.points)
+        denom = n * self.sxx - self.sx * self.sx
+        if denom <= 0:
+            self.value = self.intercept = None    # x hasn't moved
+            return
+        self.value = (n * self.sxy - self.sx * self.sy) / denom
+        self.intercept = self.y0 + (self.sy - self.value * self.sx) / n - \
+            self.value * self.x0
+
+    def __str__(self):
+        return "slope of %s vs %s" % (self.y, self.x)
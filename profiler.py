@@ -0,0 +1,151 @@
+"""
+profiler.py
+
+Low-overhead timing instrumentation for the acquisition path.
+
+When sample rates disappoint, this shows where the time goes. The acquisition
+code is instrumented with named spans:
+
+    collect_data.position, collect_data.load
+    collect_until.wait, collect_until.collect, collect_until.store,
+    collect_until.condition, collect_until.report, collect_until.keyboard
+    freeloader.wait_for_cell, dynamixel.Interact
+
+Profiling is off by default, and then each span costs two trivial function
+calls. Turn it on, run a test, then look at the results:
+
+    import profiler
+    profiler.enable()
+    test.run_test()
+    profiler.report()                   # table of every span
+    profiler.dump("profile.json")       # or save it
+
+Each span's durations go into a histogram with ten logarithmic buckets per
+decade from one microsecond, so memory use doesn't grow with the test and
+percentiles can be read at any time with snapshot().
+
+To instrument your own code:
+
+    t = profiler.tic()
+    ... work ...
+    t = profiler.lap("my.first", t)
+    ... more work ...
+    profiler.toc("my.second", t)
+"""
+
+import math, json
+import clock
+
+enabled = False
+
+# Histogram buckets: BUCKETS_PER_DECADE per factor of ten, starting at MIN_TIME.
+BUCKETS_PER_DECADE = 10
+MIN_TIME = 1e-6
+_SCALE = BUCKETS_PER_DECADE / math.log(10)
+
+_spans = {}
+
+class Histogram():
+    """Logarithmic histogram of durations, with exact count, total, min and max."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, dt):
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+        if self.min is None or dt < self.min:
+            self.min = dt
+        if dt > MIN_TIME:
+            b = int(math.log(dt / MIN_TIME) * _SCALE)
+        else:
+            b = 0
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def percentile(self, p):
+        """Approximate p-th percentile (0-100): the upper edge of its bucket."""
+        if not self.count:
+            return float('nan')
+        rank = p / 100.0 * self.count
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return min(MIN_TIME * 10 ** ((b + 1.0) / BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+    def summary(self):
+        """Returns a dictionary of statistics, with times in milliseconds."""
+        return {'count': self.count, 'total_ms': self.total * 1000,
+                'mean_ms': self.total / self.count * 1000 if self.count else float('nan'),
+                'min_ms': (self.min or 0.0) * 1000, 'max_ms': self.max * 1000,
+                'p50_ms': self.percentile(50) * 1000,
+                'p90_ms': self.percentile(90) * 1000,
+                'p99_ms': self.percentile(99) * 1000}
+
+def enable(on = True):
+    """Turns profiling on (or off, with on = False). Collected data is kept."""
+    global enabled
+    enabled = on
+
+def disable():
+    """Turns profiling off."""
+    enable(False)
+
+def reset():
+    """Discards everything collected so far."""
+    _spans.clear()
+
+def tic():
+    """Starts a span. Returns a start time, or 0 if profiling is off."""
+    if enabled:
+        return clock.now()
+    return 0
+
+def toc(name, start):
+    """Ends the span called name which tic() started at start."""
+    if start:
+        record(name, clock.now() - start)
+
+def lap(name, start):
+    """
+    Ends the span called name which started at start, and returns the start
+    time of the next one. Saves a call when timing consecutive steps.
+    """
+    if start:
+        now = clock.now()
+        record(name, now - start)
+        return now
+    return 0
+
+def record(name, dt):
+    """Adds a duration of dt seconds to the span called name."""
+    h = _spans.get(name)
+    if h is None:
+        h = _spans[name] = Histogram()
+    h.add(dt)
+
+def snapshot():
+    """Returns {span name: statistics dictionary} for every span so far."""
+    return dict((name, h.summary()) for name, h in _spans.items())
+
+def report():
+    """Prints a table of every span, sorted by total time."""
+    stats = snapshot()
+    print "%-28s %9s %10s %9s %9s %9s %9s" % ("span", "count", "total ms",
+        "mean ms", "p50 ms", "p99 ms", "max ms")
+    for name in sorted(stats, key = lambda n: -stats[n]['total_ms']):
+        s = stats[name]
+        print "%-28s %9d %10.1f %9.3f %9.3f %9.3f %9.3f" % (name, s['count'],
+            s['total_ms'], s['mean_ms'], s['p50_ms'], s['p99_ms'], s['max_ms'])
+
+def dump(fname):
+    """Saves snapshot() as JSON to fname."""
+    with open(fname, 'w') as f:
+        json.dump(snapshot(), f, indent = 2, sort_keys = True)
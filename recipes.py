@@ -0,0 +1,355 @@
+"""
+recipes.py
+
+Runs batches of specimens, described by a recipe file, on one connected machine.
+
+Testing a batch with tensiontest.py means connecting, answering prompts and
+picking a file name again for every specimen. Instead, describe the test
+once in a JSON recipe, list the specimens, and run them all:
+
+    python recipes.py batch.json
+    python recipes.py batch.json --daemon       # use a running daemon.py
+
+A recipe looks like this:
+
+    {
+      "name": "pla-tensile",
+      "output": "{recipe}_{index:03d}_{specimen}.csv",
+      "params": {"speed": 5, "break_load": 10},
+      "steps": [
+        {"do": "pause", "message": "Load specimen {specimen}, then hit a key."},
+        {"do": "move", "speed": "$speed", "direction": "up",
+         "until": {"any": [{"drop_from_peak": {"value": "load", "fraction": 0.5,
+                                               "min_peak": "$break_load"}},
+                           {"elapsed": [1800]}]}},
+        {"do": "pause", "message": "Remove the broken specimen, then hit a key."},
+        {"do": "return", "speed": 30}
+      ],
+      "specimens": ["A1", "A2", {"specimen": "B1", "params": {"speed": 10}}]
+    }
+
+Specimens are names, or dictionaries with a name and their own params, which
+override the recipe's. A string "$name" anywhere in a step is replaced by
+the param called name, and {name} in messages and the output pattern by its
+value, as are {recipe}, {specimen}, {index} (counting from 1) and {date}.
+
+Steps ("do"):
+    move        Moves at speed (mm/min) up or down until the condition until
+                is met, collecting data unless "collect" is false. "rate" and
+                "storage" are as for collect_until. Stops unless "keep_moving".
+    hold        Stays put for "seconds", collecting unless "collect" is false.
+    return      Moves at speed back to where the specimen started.
+    pause       Prints message and waits for a key hit (see wait_for_keyboard).
+    stop, zero, tare
+                Stops the motor, zeroes the position, or tares the load cell.
+
+Conditions are dictionaries with one key, naming a function of conditions.py
+(above, below, window, drop_from_peak, slope_below, elapsed), whose value
+is a list of positional arguments or a dictionary of keyword arguments.
+"any", "all" and "not" combine them. Storage policies are built the same
+way from storage.py: deadband, decimate or log_spacing.
+
+Each specimen's data is written to a CSV named by the output pattern, never
+overwriting an existing file, and streamed to a .pyld file while it runs.
+Progress is checkpointed after every specimen, by default to the recipe
+file name plus ".progress.json", so if a batch is interrupted, running it
+again carries on with the specimen that was interrupted.
+"""
+
+import os, sys, json, time, argparse
+import conditions, storage
+from basictest import BasicTest
+from freeloader import Freeloader, FreeloaderError
+
+# Condition and storage policy constructors recipes may use, by name.
+CONDITIONS = {'above': conditions.above, 'below': conditions.below,
+              'window': conditions.window, 'drop_from_peak': conditions.drop_from_peak,
+              'slope_below': conditions.slope_below, 'elapsed': conditions.elapsed}
+STORAGE = {'deadband': storage.Deadband, 'decimate': storage.Decimate,
+           'log_spacing': storage.LogSpacing}
+ACTIONS = ["move", "hold", "return", "pause", "stop", "zero", "tare"]
+
+HEADER = "Time,Displacement,Load\nsec,mm,lbs\n"
+
+# The columns a RecipeTest collects, as in BasicTest.col.
+COLUMNS = {'time': 0, 'position': 1, 'load': 2}
+
+def resolve(value, params):
+    """Replaces every "$name" string in value, however deeply nested, with params[name]."""
+    if isinstance(value, basestring) and value.startswith("$"):
+        try:
+            return params[value[1:]]
+        except KeyError:
+            raise ValueError("Unknown param " + value)
+    if isinstance(value, list):
+        return [resolve(v, params) for v in value]
+    if isinstance(value, dict):
+        return dict((k, resolve(v, params)) for k, v in value.items())
+    return value
+
+def _call(table, spec, kind):
+    """Calls the constructor spec names in table with the arguments it gives."""
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ValueError("A " + kind + " must be a dictionary with one key: " + json.dumps(spec))
+    name, args = spec.items()[0]
+    if name not in table:
+        raise ValueError("Unknown " + kind + ": " + name)
+    try:
+        if isinstance(args, dict):
+            return table[name](**dict((str(k), v) for k, v in args.items()))
+        return table[name](*args)
+    except TypeError as e:
+        raise ValueError("Bad arguments for " + kind + " " + name + ": " + str(e))
+
+def make_condition(spec):
+    """Builds a condition (see conditions.py) from its recipe form."""
+    if isinstance(spec, dict) and len(spec) == 1:
+        name, args = spec.items()[0]
+        if name == "any":
+            return conditions.Any(*[make_condition(s) for s in args])
+        if name == "all":
+            return conditions.All(*[make_condition(s) for s in args])
+        if name == "not":
+            return ~make_condition(args)
+    return _call(CONDITIONS, spec, "condition")
+
+def make_storage(spec):
+    """Builds a storage policy (see storage.py) from its recipe form, or None."""
+    if spec is None:
+        return None
+    return _call(STORAGE, spec, "storage policy")
+
+class Recipe():
+    """A recipe, loaded from the JSON file fname and checked for mistakes."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname) as f:
+            recipe = json.load(f)
+        self.name = recipe.get('name') or os.path.splitext(os.path.basename(fname))[0]
+        self.output = recipe.get('output', "{recipe}_{index:03d}_{specimen}.csv")
+        self.params = recipe.get('params', {})
+        self.steps = recipe.get('steps', [])
+        self.specimens = []
+        for s in recipe.get('specimens', []):
+            if not isinstance(s, dict):
+                s = {'specimen': s}
+            params = dict(self.params)
+            params.update(s.get('params', {}))
+            self.specimens.append((unicode(s['specimen']), params))
+        if not self.specimens:
+            raise ValueError("Recipe " + fname + " has no specimens.")
+        names = [name for name, params in self.specimens]
+        if len(set(names)) != len(names):
+            raise ValueError("Recipe " + fname + " names a specimen twice.")
+        for name, params in self.specimens:
+            for i in range(len(self.steps)):
+                try:
+                    self.step(i, params)
+                except ValueError as e:
+                    raise ValueError("Step %d for specimen %s: %s" % (i + 1, name, e))
+
+    def step(self, i, params):
+        """Step i with its params filled in, and its condition and storage built."""
+        step = resolve(self.steps[i], params)
+        if step.get('do') not in ACTIONS:
+            raise ValueError("Unknown step: " + str(step.get('do')))
+        if step['do'] == "move":
+            if 'until' not in step or 'speed' not in step:
+                raise ValueError("A move needs a speed and an until condition.")
+            if step.get('direction', "up") not in ("up", "down"):
+                raise ValueError("Direction must be up or down.")
+            step['until'] = make_condition(step['until'])
+            step['storage'] = make_storage(step.get('storage'))
+            try:
+                # Catch misspelled columns now, not halfway through a batch.
+                step['until'].bind(COLUMNS)
+                if step['storage'] is not None:
+                    step['storage'].bind(COLUMNS)
+            except KeyError as ke:
+                raise ValueError("Unknown column " + str(ke))
+        elif step['do'] == "hold" and 'seconds' not in step:
+            raise ValueError("A hold needs seconds.")
+        elif step['do'] == "return" and 'speed' not in step:
+            raise ValueError("A return needs a speed.")
+        return step
+
+    def fields(self, index, specimen, params):
+        """The values available to the output pattern and messages."""
+        fields = dict(params)
+        fields.update(recipe = self.name, specimen = specimen, index = index + 1,
+                      date = time.strftime("%Y%m%d"))
+        return fields
+
+class RecipeTest(BasicTest):
+    """A BasicTest which runs the steps of a recipe for one specimen."""
+
+    def __init__(self, machine, recipe, index):
+        BasicTest.__init__(self, machine)
+        self.recipe = recipe
+        self.index = index
+        self.specimen, self.params = recipe.specimens[index]
+        self.fields = recipe.fields(index, self.specimen, self.params)
+
+    def run_test(self):
+        self.initialize_data()
+        for i in range(len(self.recipe.steps)):
+            self.run_step(self.recipe.step(i, self.params))
+
+    def run_step(self, step):
+        action = step['do']
+        if action == "move":
+            self.fl.start_motor(step['speed'], down = step.get('direction') == "down")
+            if step.get('collect', True):
+                self.collect_until(step['until'], rate = step.get('rate'),
+                                   storage = step['storage'])
+            else:
+                self.wait_until(step['until'])
+            if not step.get('keep_moving'):
+                self.fl.stop_motor()
+        elif action == "hold":
+            if step.get('collect', True):
+                self.collect_for(step['seconds'], rate = step.get('rate'))
+            else:
+                self.wait_for(step['seconds'])
+        elif action == "return":
+            start = self.get_first_value("position")
+            if self.fl.get_linear_position() > start:
+                self.fl.start_motor(step['speed'], down = True)
+                self.wait_until("position", "lessthan", start)
+            else:
+                self.fl.start_motor(step['speed'], down = False)
+                self.wait_until("position", "greaterthan", start)
+            self.fl.stop_motor()
+        elif action == "pause":
+            print step.get('message', "Hit any key to continue.").format(**self.fields)
+            self.wait_for_keyboard()
+        elif action == "stop":
+            self.fl.stop_motor()
+        elif action == "zero":
+            self.fl.reset_linear_position()
+        elif action == "tare":
+            self.fl.tare_cell()
+
+    def header(self):
+        """The text header of the output file."""
+        h = "Recipe: " + self.recipe.name + "\n"
+        h += "Specimen: " + self.specimen + "\n"
+        for name in sorted(self.params):
+            h += name + ": " + str(self.params[name]) + "\n"
+        return h + HEADER
+
+def _unique(fname):
+    """fname, or fname with -2, -3... added before the extension if it exists."""
+    base, ext = os.path.splitext(fname)
+    n = 1
+    while os.path.exists(fname):
+        n += 1
+        fname = base + "-" + str(n) + ext
+    return fname
+
+class RecipeRunner():
+    """
+    Runs every specimen of a Recipe on the connected Freeloader fl, keeping
+    track of progress in the JSON file checkpoint. Raises ValueError if the
+    checkpoint belongs to a different recipe.
+    """
+
+    def __init__(self, fl, recipe, checkpoint = None, verbose = True):
+        self.fl = fl
+        self.recipe = recipe
+        self.checkpoint = checkpoint or recipe.fname + ".progress.json"
+        self.verbose = verbose
+        self.progress = {'recipe': recipe.name, 'done': {}, 'current': None}
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as f:
+                progress = json.load(f)
+            if progress.get('recipe') != recipe.name:
+                raise ValueError("The checkpoint %s is for the recipe %s, not %s." %
+                                 (self.checkpoint, progress.get('recipe'), recipe.name))
+            self.progress = progress
+
+    def save_progress(self):
+        """Writes the checkpoint, replacing the old one only once the new one is complete."""
+        temp = self.checkpoint + ".tmp"
+        with open(temp, 'w') as f:
+            json.dump(self.progress, f, indent = 2, sort_keys = True)
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)      # Windows can't rename over a file.
+        os.rename(temp, self.checkpoint)
+
+    def remaining(self):
+        """Indices of the specimens not yet done, in order."""
+        return [i for i, (name, params) in enumerate(self.recipe.specimens)
+                if name not in self.progress['done']]
+
+    def run(self):
+        """Runs every remaining specimen. Returns the progress dictionary."""
+        current = self.progress.get('current')
+        if current and self.verbose:
+            print "Specimen " + current + " was interrupted; running it again."
+        for i in self.remaining():
+            test = RecipeTest(self.fl, self.recipe, i)
+            fname = _unique(self.recipe.output.format(**test.fields))
+            if self.verbose:
+                print "Specimen %s (%d of %d) -> %s" % (test.specimen, i + 1,
+                    len(self.recipe.specimens), fname)
+            self.progress['current'] = test.specimen
+            self.save_progress()
+            stream = os.path.splitext(fname)[0] + ".pyld"
+            if os.path.exists(stream):
+                # Keep what an interrupted run of this specimen collected.
+                os.rename(stream, _unique(os.path.splitext(fname)[0] + ".interrupted.pyld"))
+            test.start_stream(stream, test.header())
+            try:
+                test.run_test()
+            finally:
+                # However the specimen ends, leave the motor stopped and
+                # what was collected safely on disk.
+                test.stop_stream()
+                test.ensure_stopped()
+            test.write_file(test.header(), fname = fname)
+            os.remove(stream)
+            self.progress['done'][test.specimen] = {'file': fname,
+                'points': len(test.data), 'finished': time.time()}
+            self.progress['current'] = None
+            self.save_progress()
+        if self.verbose:
+            print "All %d specimens done." % len(self.recipe.specimens)
+        return self.progress
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Run a batch of specimens from a recipe.")
+    parser.add_argument("recipe", help = "recipe JSON file")
+    parser.add_argument("--checkpoint", help = "progress file (default: recipe.progress.json)")
+    parser.add_argument("--daemon", action = "store_true",
+                        help = "use the machine held by a running daemon.py")
+    args = parser.parse_args()
+
+    try:
+        recipe = Recipe(args.recipe)
+    except (IOError, ValueError) as e:
+        print "Could not load the recipe: " + str(e)
+        sys.exit(1)
+    if args.daemon:
+        from daemon import RemoteFreeloader
+        fl = RemoteFreeloader()
+    else:
+        fl = Freeloader()
+    try:
+        fl.autoconnect()
+    except FreeloaderError as fe:
+        print "Autoconnect failed"
+        print fe.msg
+        sys.exit(1)
+    try:
+        runner = RecipeRunner(fl, recipe, args.checkpoint)
+    except (IOError, ValueError) as e:
+        print "Could not load the checkpoint: " + str(e)
+        fl.disconnect()
+        sys.exit(1)
+    try:
+        runner.run()
+    finally:
+        fl.disconnect()
@@ -0,0 +1,70 @@
+"""
+reporter.py
+
+Throttled console status output for collection loops.
+
+Printing to a Windows console can take milliseconds per line, so printing
+every sample from inside collect_until noticeably lowers the achieved sample
+rate. A StatusReporter moves the printing to a background thread. The
+collection loop only calls post() with the newest datapoint, which just stores
+a reference to it. The reporter thread wakes up rate times a second and prints
+the latest datapoint it was given, if there is a new one.
+
+When the reporter is stopped, the last datapoint posted is always printed, so
+the final state of a phase is never hidden.
+"""
+
+import sys, threading
+
+class StatusReporter():
+    """Prints the latest posted datapoint at a fixed rate from a background thread."""
+
+    def __init__(self, format, rate = 5, out = None):
+        """
+        format is a function turning a datapoint into the line to print.
+        rate is how many lines to print per second, at most.
+        out is the file to print to, sys.stdout by default.
+        """
+        self.format = format
+        self.interval = 1.0 / rate
+        self.out = out or sys.stdout
+        self.latest = None
+        self._printed = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the reporter thread. Returns the reporter itself."""
+        self._thread = threading.Thread(target = self._run, name = "StatusReporter")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def post(self, point):
+        """Hands over the newest datapoint. Costs a single assignment."""
+        self.latest = point
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._stopping.wait(self.interval)
+            self._report()
+
+    def _report(self):
+        """Prints the latest datapoint, unless it was already printed."""
+        point = self.latest
+        if point is None or point is self._printed:
+            return
+        self._printed = point
+        try:
+            self.out.write(self.format(point) + "\n")
+        except Exception as e:
+            # Never let a formatting problem take down the reporter silently.
+            self.out.write("Status unavailable: " + str(e) + "\n")
+
+    def stop(self):
+        """Stops the reporter thread, then prints the final datapoint."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._report()
@@ -0,0 +1,147 @@
+"""
+scheduler.py
+
+Drift-free sample pacing for BasicTest's collection loops.
+
+The naive way to collect at a fixed rate is to time each loop and wait out
+whatever is left of the period. Any time spent outside the measured part of
+the loop adds up, so the actual rate slowly drifts below the requested one.
+A RateScheduler instead computes an absolute deadline for every sample,
+start + n * period, so a late sample never pushes back the ones after it.
+
+Waiting is a hybrid of sleeping and spinning. Sleeping is cheap but the OS
+may wake us late, spinning is precise but burns a whole CPU core. The
+scheduler sleeps through most of the wait, then spins only for the last part
+of it. spin_budget sets the largest fraction of each period which may be
+spent spinning; 0 means never spin, 1 means never sleep.
+
+Every scheduler records statistics for its run (achieved rate, interval
+jitter, lateness, missed deadlines) in a PhaseStats object.
+"""
+
+import math
+import clock
+
+# Never spin for longer than this, however generous the budget.
+MAX_SPIN = .002
+
+class PhaseStats():
+    """
+    Timing statistics for one collection phase. The interesting attributes are
+    samples, duration, rate, target_rate, jitter (standard deviation of the
+    interval between samples, in seconds), max_late (worst lateness relative
+    to the deadline, in seconds) and missed (deadlines skipped entirely).
+    """
+
+    def __init__(self, name, target_rate):
+        self.name = name
+        self.target_rate = target_rate
+        self.samples = 0
+        self.missed = 0
+        self.duration = 0.0
+        self.max_late = 0.0
+        self._first = None
+        self._last = None
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add_tick(self, t, late):
+        """Records a sample taken at time t, late seconds after its deadline."""
+        self.samples += 1
+        if late > self.max_late:
+            self.max_late = late
+        if self._last is not None:
+            # Welford's running variance of the intervals.
+            interval = t - self._last
+            self._n += 1
+            delta = interval - self._mean
+            self._mean += delta / self._n
+            self._m2 += delta * (interval - self._mean)
+        else:
+            self._first = t
+        self._last = t
+        self.duration = t - self._first
+
+    @property
+    def rate(self):
+        """Achieved sample rate in Hz."""
+        if self._n == 0 or self._mean <= 0:
+            return 0.0
+        return 1.0 / self._mean
+
+    @property
+    def jitter(self):
+        """Standard deviation of the sample interval, in seconds."""
+        if self._n < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self._n - 1))
+
+    def as_dict(self):
+        """Returns the statistics as a plain dictionary, for saving or printing."""
+        return {'name': self.name, 'samples': self.samples,
+                'duration': self.duration, 'rate': self.rate,
+                'target_rate': self.target_rate, 'jitter': self.jitter,
+                'max_late': self.max_late, 'missed': self.missed}
+
+    def __str__(self):
+        if self.target_rate:
+            target = "%.2f Hz" % self.target_rate
+        else:
+            target = "as fast as possible"
+        return "%s: %d samples in %.2f s, %.2f Hz (target %s), " \
+            "jitter %.2f ms, max late %.2f ms, %d missed" % (self.name,
+            self.samples, self.duration, self.rate, target, self.jitter * 1000,
+            self.max_late * 1000, self.missed)
+
+class RateScheduler():
+    """
+    Paces a loop at a fixed rate using absolute deadlines.
+    Call wait() at the top of every loop iteration; the first call returns
+    immediately and sets the time reference.
+    """
+
+    def __init__(self, rate = None, spin_budget = .1, name = "collection"):
+        """
+        rate is the target rate in Hz. None or 0 means as fast as possible.
+        spin_budget is the largest fraction of each period spent busy-waiting.
+        name labels the statistics for this phase.
+        """
+        if rate:
+            self.period = 1.0 / rate
+        else:
+            self.period = 0.0
+        self.spin = min(max(spin_budget, 0.0), 1.0) * self.period
+        if spin_budget < 1.0:
+            self.spin = min(self.spin, MAX_SPIN)
+        self.stats = PhaseStats(name, rate or None)
+        self.next_deadline = None
+
+    def wait(self):
+        """
+        Waits for the next deadline and returns the time it was reached.
+        If a deadline was already missed by more than a whole period, the
+        skipped deadlines are counted as missed instead of being caught up
+        with a burst of samples.
+        """
+        t = clock.now()
+        if self.next_deadline is None:
+            self.next_deadline = t
+        deadline = self.next_deadline
+        remaining = deadline - t
+        # Virtual time only moves when slept on, so never spin on it.
+        spin = 0.0 if clock.virtual() else self.spin
+        if remaining > spin:
+            clock.sleep(remaining - spin)
+        t = clock.now()
+        while t < deadline:
+            t = clock.now()
+        late = t - deadline
+        self.stats.add_tick(t, late)
+        if self.period:
+            skipped = int(late / self.period)
+            self.stats.missed += skipped
+            self.next_deadline = deadline + (skipped + 1) * self.period
+        else:
+            self.next_deadline = t
+        return t
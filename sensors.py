@@ -0,0 +1,156 @@
+"""
+sensors.py
+
+A registry of extra sensors, each sampled on its own thread.
+
+Adding an extensometer or a thermocouple used to mean overriding collect_data
+and reading it in line with position and load, which slows every sample down
+by however long the new sensor takes. Instead, register it:
+
+    self.add_sensor("strain", extensometer.read, rate = 50)
+    self.add_sensor("temperature", thermocouple.read, rate = 2)
+
+Each sensor gets a worker thread which reads it at its preferred rate, into
+its own buffer of timestamped readings. collect_data just appends the latest
+reading of every sensor to each datapoint, which costs next to nothing, so
+position and load are collected exactly as fast as before. The sensors' full
+readings can also be combined into rows on demand with SensorRegistry.rows(),
+for example at each sensor's own full rate.
+
+Sensor read functions must be safe to call from another thread, and should
+talk to a different port than the Freeloader, or they'll just wait on it.
+"""
+
+import bisect, threading, collections
+import clock
+from scheduler import RateScheduler
+
+# Stands in for readings a sensor hasn't taken yet, so data stays numeric.
+NAN = float('nan')
+
+# Least time in seconds a sensor waits after a failed reading before trying
+# again, so one which keeps failing doesn't spin at full speed.
+ERROR_BACKOFF = .01
+
+class Sensor():
+    """
+    One sensor: a column name, a function returning a reading, and the rate
+    in Hz it should be read at (None for as fast as it will go). The latest
+    buffer_size readings are kept in self.buffer as (time, value) pairs.
+    """
+
+    def __init__(self, name, read, rate = None, buffer_size = 100000):
+        self.name = name
+        self.read = read
+        self.rate = rate
+        self.buffer = collections.deque(maxlen = buffer_size)
+        self.latest = None
+        self.errors = 0
+        self.last_error = None
+        self.stats = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts reading on a new thread."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target = self._run, name = "Sensor " + self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        sched = RateScheduler(self.rate, 0.0, "sensor " + self.name)
+        self.stats = sched.stats
+        while not self._stopping.is_set():
+            sched.wait()
+            try:
+                value = self.read()
+            except Exception as e:
+                # Keep going: one bad reading mustn't end the sensor. But back
+                # off, or an unplugged one would busy-wait when rate is None.
+                self.errors += 1
+                self.last_error = e
+                self._stopping.wait(max(ERROR_BACKOFF, 1.0 / self.rate if self.rate
+                                        else 0.0))
+                continue
+            reading = (clock.now(), value)
+            self.buffer.append(reading)
+            self.latest = reading
+
+    def stop(self):
+        """Stops reading and waits for the thread to finish."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def running(self):
+        return self._thread is not None
+
+    def value_at(self, t):
+        """Returns the last reading taken at or before time t, or None."""
+        readings = list(self.buffer)
+        i = bisect.bisect_right(readings, (t, float('inf')))
+        if i == 0:
+            return None
+        return readings[i - 1][1]
+
+class SensorRegistry():
+    """An ordered set of Sensors, started and stopped together."""
+
+    def __init__(self):
+        self.sensors = []
+
+    def add(self, sensor):
+        """Adds a sensor. Raises ValueError if its name is already taken."""
+        if sensor.name in self.names():
+            raise ValueError("There is already a sensor called " + sensor.name)
+        self.sensors.append(sensor)
+        return sensor
+
+    def names(self):
+        """The column names of the sensors, in order."""
+        return [s.name for s in self.sensors]
+
+    def start(self):
+        """Starts every sensor which isn't running yet."""
+        for s in self.sensors:
+            if not s.running():
+                s.start()
+
+    def stop(self):
+        """Stops every sensor."""
+        for s in self.sensors:
+            s.stop()
+
+    def latest(self):
+        """The most recent reading of every sensor, in order (NaN if none yet)."""
+        return [s.latest[1] if s.latest is not None else NAN for s in self.sensors]
+
+    def rows(self, times = None, offset = 0.0):
+        """
+        Combines the sensors' buffered readings into rows of
+        [time, sensor 1, sensor 2, ...]. By default there is a row for every
+        reading of any sensor; otherwise, one for each time in times, which
+        must be in ascending order. Each sensor contributes its last reading
+        at or before that time (NaN if it had none yet). offset is subtracted
+        from every time in the result, for example BasicTest.start_time.
+        """
+        buffers = [list(s.buffer) for s in self.sensors]
+        if times is None:
+            times = sorted(set(t for b in buffers for t, v in b))
+        else:
+            times = [t + offset for t in times]
+        rows = []
+        index = [0] * len(buffers)
+        for t in times:
+            row = [t - offset]
+            for n, b in enumerate(buffers):
+                # times are sorted, so each buffer is walked once.
+                i = index[n]
+                while i < len(b) and b[i][0] <= t:
+                    i += 1
+                index[n] = i
+                row.append(b[i - 1][1] if i else NAN)
+            rows.append(row)
+        return rows
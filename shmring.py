@@ -0,0 +1,186 @@
+"""
+shmring.py
+
+A shared-memory ring buffer of samples, for watching a test from other processes.
+
+Datapoints collected by a BasicTest only exist inside its process. A
+RingWriter publishes them into a memory-mapped file instead, where any
+number of other processes, such as plotters, loggers or analysis tools, can
+read them with RingReader while the test runs. Readers never write to the
+mapping and never lock anything, so they can't slow down or block the
+test, which only copies each sample into shared memory.
+
+    # In the test:
+    self.start_publishing(shmring.default_path("tensile"))
+
+    # In another process:
+    reader = RingReader(shmring.default_path("tensile"))
+    for block in reader.follow():
+        ...                             # lists of new samples
+
+Layout of the file (all little-endian):
+    - 64 byte header: 8 byte magic "PYLDRING", uint32 version, uint32 number
+      of columns, uint32 capacity in records, uint32 record size, uint32
+      closed flag, uint32 length of the column JSON, uint64 number of records
+      written, then padding
+    - The column labels as JSON, padded to a multiple of 8 bytes
+    - capacity records, each a uint64 sequence number followed by one double
+      per column
+
+Record n lives in slot n % capacity. The writer sets its sequence number to
+2n + 1 while writing it and to 2n + 2 once it is complete, then updates the
+count. A reader checks the sequence number before and after copying a record,
+and so can tell if the writer was in the middle of it or has since written a
+newer record over it. Readers which fall more than capacity records behind
+skip ahead, and count what they missed.
+"""
+
+import os, json, mmap, struct, tempfile
+import clock
+
+MAGIC = "PYLDRING"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIIIIIQ")
+HEADER_SIZE = 64
+_COUNT_OFFSET = 32
+_CLOSED_OFFSET = 24
+_SEQ = struct.Struct("<Q")
+
+def default_path(name):
+    """A path for the ring called name, in shared memory where the OS has it."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "pyloader-" + name + ".ring")
+
+class RingWriter():
+    """
+    Publishes samples with the given column labels into a new ring file,
+    fname, which holds the latest capacity samples. Only one writer may use a
+    ring at a time.
+    """
+
+    def __init__(self, fname, columns, capacity = 65536):
+        self.fname = fname
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.count = 0
+        self._record = struct.Struct("<Q%dd" % len(self.columns))
+        info = json.dumps(self.columns)
+        info += " " * (-len(info) % 8)
+        self._data_offset = HEADER_SIZE + len(info)
+        size = self._data_offset + capacity * self._record.size
+        with open(fname, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(self.columns), capacity,
+                                 self._record.size, 0, len(info), 0))
+            f.write("\0" * (HEADER_SIZE - _HEADER.size))
+            f.write(info)
+            f.truncate(size)
+        self._file = open(fname, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def append(self, point):
+        """Publishes one sample. It must have one value per column."""
+        n = self.count
+        offset = self._data_offset + (n % self.capacity) * self._record.size
+        _SEQ.pack_into(self._map, offset, 2 * n + 1)
+        self._record.pack_into(self._map, offset, 2 * n + 1, *point)
+        _SEQ.pack_into(self._map, offset, 2 * n + 2)
+        self.count = n + 1
+        _SEQ.pack_into(self._map, _COUNT_OFFSET, n + 1)
+
+    def close(self):
+        """Marks the ring closed, so readers know no more samples are coming."""
+        if self._map is None:
+            return
+        struct.pack_into("<I", self._map, _CLOSED_OFFSET, 1)
+        self._map.close()
+        self._file.close()
+        self._map = None
+
+class RingReader():
+    """
+    Reads samples from the ring file fname as a RingWriter publishes them.
+    Starts from the oldest sample still in the ring, or from the newest one
+    if from_start is False.
+    """
+
+    def __init__(self, fname, from_start = True):
+        self.fname = fname
+        self._file = open(fname, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, ncols, self.capacity, record_size, closed, info_len, count = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a PyLoader ring file.")
+        self.columns = json.loads(self._map[HEADER_SIZE:HEADER_SIZE + info_len])
+        self._record = struct.Struct("<Q%dd" % ncols)
+        self._data_offset = HEADER_SIZE + info_len
+        self.missed = 0
+        self.next = max(0, count - self.capacity) if from_start else count
+
+    def written(self):
+        """The number of samples the writer has published so far."""
+        return _SEQ.unpack_from(self._map, _COUNT_OFFSET)[0]
+
+    def closed(self):
+        return struct.unpack_from("<I", self._map, _CLOSED_OFFSET)[0] == 1
+
+    def _get(self, n):
+        """Record n as a list, or None if it has been overwritten."""
+        offset = self._data_offset + (n % self.capacity) * self._record.size
+        values = self._record.unpack_from(self._map, offset)
+        if values[0] != 2 * n + 2 or _SEQ.unpack_from(self._map, offset)[0] != values[0]:
+            return None
+        return list(values[1:])
+
+    def read(self):
+        """Returns a list of every sample published since the last read."""
+        count = self.written()
+        if count - self.next > self.capacity:
+            self.missed += count - self.capacity - self.next
+            self.next = count - self.capacity
+        out = []
+        while self.next < count:
+            point = self._get(self.next)
+            if point is None:
+                # The writer lapped us while we were reading.
+                self.missed += 1
+            else:
+                out.append(point)
+            self.next += 1
+        return out
+
+    def latest(self):
+        """The newest sample, or None if there are none yet."""
+        count = self.written()
+        if not count:
+            return None
+        return self._get(count - 1)
+
+    def follow(self, poll = .01):
+        """
+        Yields lists of new samples as they are published, checking every
+        poll seconds, until the writer closes the ring.
+        """
+        while True:
+            closed = self.closed()
+            block = self.read()
+            if block:
+                yield block
+            elif closed:
+                return
+            else:
+                clock.sleep(poll)
+
+    def array(self):
+        """
+        A NumPy record array viewing every slot of the ring in place, without
+        copying. Fields are "seq" and the column labels. Slots are not in
+        time order, and may change while being looked at. Needs NumPy.
+        """
+        import numpy as np
+        dtype = np.dtype([("seq", "<u8")] + [(str(c), "<f8") for c in self.columns])
+        return np.frombuffer(self._map, dtype, self.capacity, self._data_offset)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,411 @@
+"""
+simulated.py
+
+Simulated Freeloader hardware, for benchmarking and testing without a machine.
+
+SimulatedMX64 and SimulatedLoadstar stand in for the serial ports of the two
+devices. They speak the same byte-level protocols (Dynamixel Protocol 1.0 and
+the Loadstar's text commands), so everything above them, ServoController,
+Freeloader and BasicTest, runs unmodified. They are paced realistically:
+
+    - Bytes take 10 bit times each to cross the wire at the configured baud.
+    - The MX-64 answers after its return delay time.
+    - The Loadstar answers W with the next reading it completes at its SPS.
+
+The MX-64 also turns: its encoder advances according to the moving speed,
+optionally with limited acceleration, wrapping at 4096 like the real one.
+
+A Specimen in the grips makes the load depend on how far the crosshead has
+moved: LinearSpecimen is elastic, and PlasticSpecimen yields and hardens.
+Either can break at a given extension, after which it carries no load.
+
+To get a connected Freeloader backed by simulated devices:
+
+    fl = simulated_freeloader()
+    test = TensionTest(fl)
+
+With virtual = True, a virtual clock is installed as well (see clock.py), so
+time only passes when the test waits on the simulated devices, and does so
+instantly. A test which would take hours then runs in seconds, while seeing
+the same timestamps, sample rates and loads it would in real time:
+
+    fl = simulated_freeloader(specimen = PlasticSpecimen(50, 200, 5,
+                              break_extension = 12), noise = .05, virtual = True)
+"""
+
+import math, random, collections
+import clock, dynamixel
+from freeloader import Freeloader
+
+class SimulatedPort():
+    """
+    A serial port connected to a simulated device. Implements the parts of
+    pyserial's Serial which PyLoader uses. Subclasses override handle(), which
+    receives what was written and the time it finished arriving at the device.
+    """
+
+    def __init__(self, baud, timeout = 1):
+        self.baud = baud
+        self.byte_time = 10.0 / baud
+        self.timeout = timeout
+        self.is_open = True
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self._rx = collections.deque()      # (time available, character)
+        self._tx_free = 0.0
+        self._polled = None                 # inWaiting's answer, until a read
+
+    def write(self, data):
+        """Sends data to the device. Returns immediately, like a real port."""
+        start = max(clock.now(), self._tx_free)
+        self._tx_free = start + len(data) * self.byte_time
+        self.bytes_written += len(data)
+        self.handle(data, self._tx_free)
+        return len(data)
+
+    def handle(self, data, t):
+        """Processes data which has finished arriving at the device at time t."""
+        pass
+
+    def respond(self, data, t):
+        """Sends data back from the device, starting at time t."""
+        if self._rx:
+            t = max(t, self._rx[-1][0])
+        for i, c in enumerate(data):
+            self._rx.append((t + (i + 1) * self.byte_time, c))
+
+    def _arrived(self):
+        """The number of bytes which have arrived by now."""
+        now = clock.now()
+        n = 0
+        for t, c in self._rx:
+            if t > now:
+                break
+            n += 1
+        return n
+
+    def inWaiting(self):
+        """
+        Returns the number of bytes received so far. Under a virtual clock,
+        being asked again without a read in between means the caller is
+        waiting for more, so time moves on to the arrival of the next byte
+        (or by a millisecond, if none is on its way).
+        """
+        n = self._arrived()
+        if clock.virtual():
+            if n == self._polled:
+                if n < len(self._rx):
+                    clock.sleep(self._rx[n][0] - clock.now())
+                    n += 1
+                else:
+                    clock.sleep(.001)
+            self._polled = n
+        return n
+
+    def read(self, size = 1):
+        """Reads up to size bytes, waiting no longer than the timeout."""
+        deadline = clock.now() + self.timeout
+        while self._arrived() < size and clock.now() < deadline:
+            if self._rx:
+                clock.sleep(min(self._rx[-1][0], deadline) - clock.now())
+            else:
+                clock.sleep(deadline - clock.now())
+        out = []
+        now = clock.now()
+        while self._rx and len(out) < size and self._rx[0][0] <= now:
+            out.append(self._rx.popleft()[1])
+        self.bytes_read += len(out)
+        self._polled = None
+        return "".join(out)
+
+    def flushInput(self):
+        """Discards bytes already received. Bytes still on their way are kept."""
+        now = clock.now()
+        while self._rx and self._rx[0][0] <= now:
+            self._rx.popleft()
+        self._polled = None
+
+    def flush(self):
+        """Waits until everything written has left the port."""
+        clock.sleep(self._tx_free - clock.now())
+
+    def close(self):
+        self.is_open = False
+
+class SimulatedMX64(SimulatedPort):
+    """
+    An MX-64 in wheel mode on a Protocol 1.0 bus, or in velocity control mode
+    on a Protocol 2.0 bus if protocol is 2. Supports reading present position,
+    present load and the moving flag, and reading and writing the moving speed
+    (goal velocity under 2.0), at the addresses in dynamixel.TABLE. Other
+    reads return zeros and other writes are acknowledged and ignored. Under
+    2.0, SYNC_READ and BULK_READ work too. If acceleration is given, in
+    counts/s^2, the motor ramps to a new speed instead of reaching it at once.
+
+    More servos can be added to the same bus by appending them to chain.
+    Every one of them sees every packet, and answers those meant for it.
+    """
+
+    # Encoder counts per second for one unit of moving speed. The datasheet
+    # says 0.114 rpm, but Freeloader's calibration (mmpm2speed) measured 7.95
+    # units per rpm, so that is used to make commanded speeds come out right.
+    COUNTS_PER_UNIT = 1 / 7.95 / 60.0 * 4096
+
+    def __init__(self, baud = 1000000, id = 1, return_delay = .0005, position = 0,
+                 acceleration = None, protocol = 1):
+        SimulatedPort.__init__(self, baud)
+        self.id = id
+        self.return_delay = return_delay
+        self.acceleration = acceleration
+        self.protocol = protocol
+        self.chain = []
+        self.speed = 0                      # Moving speed, under Protocol 1.0
+        self.goal = 0                       # Goal velocity, under Protocol 2.0
+        self.load = 0                       # Present load, in 0.1%
+        self.v = 0.0                        # Actual velocity, in counts/s
+        self.counts = float(position)       # Unwrapped encoder position
+        self._last = clock.now()
+
+    def velocity(self):
+        """Encoder counts per second. Speeds of 1024 and up turn clockwise (negative)."""
+        if self.protocol == 2:
+            return self.goal / dynamixel.P2_PER_P1 * self.COUNTS_PER_UNIT
+        v = (self.speed & 1023) * self.COUNTS_PER_UNIT
+        return -v if self.speed & 1024 else v
+
+    def advance(self, t = None):
+        """Moves the motor on to time t (now by default)."""
+        if t is None:
+            t = clock.now()
+        dt = max(0.0, t - self._last)
+        self._last = max(t, self._last)
+        target = self.velocity()
+        if self.acceleration is None or self.v == target:
+            self.counts += target * dt
+            self.v = target
+            return
+        a = self.acceleration if target > self.v else -self.acceleration
+        ramp = (target - self.v) / a
+        if dt < ramp:
+            self.counts += self.v * dt + a * dt * dt / 2
+            self.v += a * dt
+        else:
+            self.counts += self.v * ramp + a * ramp * ramp / 2 + target * (dt - ramp)
+            self.v = target
+
+    def encoder(self):
+        """Present position as the 0-4095 value the real encoder reports."""
+        return int(self.counts) % 4096
+
+    def registers(self, address, count):
+        """count bytes of the control table, from address."""
+        if self.protocol == 2:
+            current = int(round(self.load * dynamixel.CURRENT_PER_LOAD))
+            values = {'present_position': int(self.counts), 'moving_speed': self.goal,
+                      'present_current': current}
+        else:
+            load = -self.load + 1024 if self.load < 0 else self.load
+            values = {'present_position': self.encoder(), 'moving_speed': self.speed,
+                      'present_load': load}
+        values['moving'] = int(self.v != 0)
+        table = {}
+        for name, value in values.items():
+            start, size = dynamixel.TABLE[self.protocol][name]
+            for i, b in enumerate(dynamixel._ToBytes(value, size)):
+                table[start + i] = b
+        return [table.get(a, 0) for a in range(address, address + count)]
+
+    def handle(self, data, t):
+        for servo in [self] + self.chain:
+            reply = servo.answer([ord(c) for c in data], t)
+            if reply is not None:
+                self.respond("".join(map(chr, reply)), t + servo.return_delay)
+
+    def answer(self, packet, t):
+        """This servo's reply to packet, a list of ints, or None if it has none."""
+        if self.protocol == 2:
+            return self._answer2(packet, t)
+        # A packet is FF FF id length instruction parameters checksum.
+        if len(packet) < 6 or packet[0] != 0xFF or packet[1] != 0xFF:
+            return None
+        id, length, instruction = packet[2:5]
+        params = packet[5:4 + length - 1]
+        if id != self.id or dynamixel._Checksum(packet[2:-1]) != packet[-1]:
+            return None
+        self.advance(t)
+        reply = []
+        if instruction == dynamixel.READ_DATA[0]:
+            reply = self.registers(params[0], params[1])
+        elif instruction == dynamixel.WRITE_DATA[0] and params[:1] == [0x20]:
+            self.speed = dynamixel._DeWire(params[1:3])
+            self.advance(t)
+        P = [self.id, len(reply) + 2, 0] + reply
+        return [0xFF, 0xFF] + P + [dynamixel._Checksum(P)]
+
+    def _answer2(self, packet, t):
+        # A packet is FF FF FD 00 id length(2) instruction parameters crc(2).
+        if packet[:4] != dynamixel.HEADER2 or len(packet) < 10:
+            return None
+        id = packet[4]
+        if len(packet) != 7 + dynamixel._DeWire(packet[5:7]) or \
+                dynamixel._Crc16(packet[:-2]) != dynamixel._DeWire(packet[-2:]):
+            return None
+        body = dynamixel._Unstuff(packet[7:-2])
+        instruction, params = body[0], body[1:]
+        self.advance(t)
+        reply = None
+        if id == dynamixel.BROADCAST and instruction == dynamixel.SYNC_READ[0]:
+            if self.id in params[4:]:
+                reply = self.registers(dynamixel._DeWire(params[0:2]),
+                                       dynamixel._DeWire(params[2:4]))
+        elif id == dynamixel.BROADCAST and instruction == dynamixel.BULK_READ[0]:
+            for i in range(0, len(params), 5):
+                if params[i] == self.id:
+                    reply = self.registers(dynamixel._DeWire(params[i + 1:i + 3]),
+                                           dynamixel._DeWire(params[i + 3:i + 5]))
+        elif id == self.id and instruction == dynamixel.READ_DATA[0]:
+            reply = self.registers(dynamixel._DeWire(params[0:2]),
+                                   dynamixel._DeWire(params[2:4]))
+        elif id == self.id:
+            reply = []
+            address = dynamixel.TABLE[2]['moving_speed'][0]
+            if instruction == dynamixel.WRITE_DATA[0] and \
+                    dynamixel._DeWire(params[0:2]) == address:
+                self.goal = dynamixel._FromBytes(params[2:6], True)
+                self.advance(t)
+        if reply is None:
+            return None
+        return dynamixel._Packet2(self.id, [dynamixel.STATUS, 0] + reply)
+
+class SimulatedLoadstar(SimulatedPort):
+    """
+    A Loadstar load cell interface. Understands SPS, W and TARE. load is a
+    function returning the true load in lbs; readings add Gaussian noise with
+    standard deviation noise. The reading for W is the next one completed at
+    the current SPS, plus latency seconds of processing.
+    """
+
+    def __init__(self, baud = 9600, load = None, noise = 0.0, latency = .001):
+        SimulatedPort.__init__(self, baud, timeout = .5)
+        self.load = load or (lambda: 0.0)
+        self.noise = noise
+        self.latency = latency
+        self.sps = 120
+        self.tare = 0.0
+        self._command = ""
+        self._random = random.Random(0)
+
+    def handle(self, data, t):
+        self._command += data
+        while "\r" in self._command:
+            command, self._command = self._command.split("\r", 1)
+            words = command.split()
+            if not words:
+                continue
+            if words[0] == "W":
+                ready = math.ceil(t * self.sps) / self.sps + self.latency
+                value = self.load() - self.tare + self._random.gauss(0, self.noise)
+                self.respond("%12.3f\r\n" % value, ready)
+            elif words[0] == "SPS" and len(words) > 1:
+                self.sps = int(words[1])
+                self.respond("%-10s\r\n" % ("SPS " + words[1]), t + self.latency)
+            elif words[0] == "TARE":
+                self.tare = self.load()
+                self.respond("TARED\r\n", t + self.latency)
+
+class Specimen():
+    """
+    A specimen in the grips. Relates the load it carries, in lbs, to its
+    extension, the distance in mm the crosshead has moved up since it was
+    gripped. It takes up slack mm before carrying anything, carries nothing
+    in compression (it buckles), and breaks once extended break_extension mm,
+    after which it carries nothing at all. This base class never carries
+    any load; subclasses override force.
+    """
+
+    def __init__(self, slack = 0.0, break_extension = None):
+        self.slack = slack
+        self.break_extension = break_extension
+        self.broken = False
+
+    def load(self, extension):
+        """The load in lbs at extension mm."""
+        if self.break_extension is not None and extension >= self.break_extension:
+            self.broken = True
+        if self.broken:
+            return 0.0
+        return max(0.0, self.force(extension - self.slack))
+
+    def force(self, stretch):
+        """The load in lbs once stretched stretch mm past the slack."""
+        return 0.0
+
+class LinearSpecimen(Specimen):
+    """An elastic specimen of the given stiffness in lbs/mm."""
+
+    def __init__(self, stiffness, slack = 0.0, break_extension = None):
+        Specimen.__init__(self, slack, break_extension)
+        self.stiffness = stiffness
+
+    def force(self, stretch):
+        return self.stiffness * stretch
+
+class PlasticSpecimen(Specimen):
+    """
+    An elastic-plastic specimen: elastic with the given stiffness in lbs/mm
+    up to yield_load lbs, then yielding, with the yield load growing by
+    hardening lbs per mm of plastic stretch. Plastic stretch is permanent, so
+    unloading follows the elastic slope and a stretched specimen goes slack
+    sooner on the way back.
+    """
+
+    def __init__(self, stiffness, yield_load, hardening = 0.0, slack = 0.0,
+                 break_extension = None):
+        Specimen.__init__(self, slack, break_extension)
+        self.stiffness = stiffness
+        self.yield_load = yield_load
+        self.hardening = hardening
+        self.plastic = 0.0                  # Permanent stretch, in mm
+
+    def force(self, stretch):
+        f = self.stiffness * (stretch - self.plastic)
+        limit = self.yield_load + self.hardening * self.plastic
+        if f > limit:
+            # Yield just enough to bring the load back onto the limit.
+            self.plastic += (f - limit) / (self.stiffness + self.hardening)
+            f = self.stiffness * (stretch - self.plastic)
+        return f
+
+def simulated_freeloader(load = None, noise = 0.0, dynabaud = 1000000,
+                         loadbaud = 9600, sps = 120, specimen = None,
+                         acceleration = None, virtual = False, protocol = 1,
+                         servos = 1):
+    """
+    Returns a connected Freeloader whose Dynamixel and load cell are simulated.
+    load and noise are passed to SimulatedLoadstar, and acceleration and
+    protocol to SimulatedMX64. servos - 1 more MX-64s, with IDs from 2 up,
+    share its bus. If a Specimen is given, it provides the load instead,
+    gripped where the crosshead starts. If virtual is True, the virtual clock
+    is installed first (see clock.use_virtual). The simulated devices are
+    available as fl.dyna.port and fl.cell.
+    """
+    if virtual:
+        clock.use_virtual()
+    fl = Freeloader()
+    motor = SimulatedMX64(dynabaud, acceleration = acceleration, protocol = protocol)
+    motor.chain = [SimulatedMX64(dynabaud, id = i, protocol = protocol)
+                   for i in range(2, servos + 1)]
+    if specimen is not None:
+        start = motor.counts
+        def load():
+            motor.advance()
+            return specimen.load((start - motor.counts) / fl.mm2enc)
+    fl.dyna = dynamixel.ServoController(port = motor, protocol = protocol)
+    fl.dyna.SetMovingSpeed(1, 0)
+    fl.dyna_online = True
+    fl.cell = SimulatedLoadstar(loadbaud, load, noise)
+    fl.cell_online = 1
+    fl.cell.write("SPS " + str(sps) + "\r")
+    fl.wait_for_cell(12, .5)
+    fl.cell.flushInput()
+    return fl
@@ -0,0 +1,186 @@
+"""
+stopsignal.py
+
+Non-blocking keyboard checks and stop signals, for Windows and POSIX.
+
+BasicTest used to call msvcrt directly so the user could end a test by
+hitting a key, which made it Windows-only. A StopSignal does the same job
+anywhere, and also works when nobody is at a keyboard, as on a server. It
+reports a reason to stop when any of these happen:
+
+    - A key is hit, if there is a console or terminal to hit it in.
+    - The process is sent SIGTERM (or SIGBREAK on Windows), for example by
+      kill or a service manager.
+    - The stop file exists, if one was given: touch it to stop a test.
+    - Another thread calls set().
+
+For example:
+
+    stop = StopSignal(stop_file = "/tmp/pyloader.stop")
+    try:
+        while not stop.check():
+            ...
+    finally:
+        stop.release()
+
+Key hits are consumed, so each one stops a single loop. The other reasons
+last until clear() is called, which also removes the stop file, so they stop
+every loop that follows.
+
+A signal can only stop a loop which is polling check(), from its first check
+until release(). One which arrives at any other time, say during a prompt or
+while a file is written, raises SystemExit instead, so the process can still
+be terminated normally.
+
+On POSIX the terminal is switched to cbreak mode while keys are being
+checked for, since otherwise keys only arrive once Enter is hit. release()
+switches it back, which should be done before asking for input again.
+"""
+
+import os, sys, signal, threading, atexit
+import clock
+
+# How often the stop file is looked for, in seconds.
+STOP_FILE_INTERVAL = .25
+
+def interactive():
+    """True if standard input is a terminal someone could type into."""
+    try:
+        return sys.stdin.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+class Keyboard():
+    """Checks for key hits without blocking, if there is a keyboard to hit."""
+
+    def __init__(self):
+        self._fd = None
+        self._saved = None
+        if sys.platform == 'win32':
+            # The console is read directly, even if stdin is redirected.
+            import msvcrt
+            self._msvcrt = msvcrt
+            self.enabled = True
+        else:
+            self._msvcrt = None
+            self.enabled = interactive()
+            if self.enabled:
+                self._fd = sys.stdin.fileno()
+
+    def hit(self):
+        """Returns True, and consumes the key, if a key has been hit."""
+        if not self.enabled:
+            return False
+        if self._msvcrt is not None:
+            if self._msvcrt.kbhit():
+                self._msvcrt.getch()
+                return True
+            return False
+        import select
+        if self._saved is None:
+            self._cbreak()
+        if select.select([self._fd], [], [], 0)[0]:
+            os.read(self._fd, 1024)
+            return True
+        return False
+
+    def _cbreak(self):
+        import termios, tty
+        try:
+            self._saved = termios.tcgetattr(self._fd)
+            tty.setcbreak(self._fd)
+        except termios.error:
+            self.enabled = False
+            return
+        atexit.register(self.release)
+
+    def release(self):
+        """Puts the terminal back the way it was, if it was changed."""
+        if self._saved is not None:
+            import termios
+            termios.tcsetattr(self._fd, termios.TCSADRAIN, self._saved)
+            self._saved = None
+
+class StopSignal():
+    """
+    Collects the reasons a test might have to stop early. stop_file is a path
+    whose existence means stop, or None. keyboard and signals say whether to
+    check the keyboard and handle SIGTERM. Signals can only be handled when
+    the StopSignal is made on the main thread.
+    """
+
+    def __init__(self, stop_file = None, keyboard = True, signals = True):
+        self.stop_file = stop_file
+        self.keyboard = Keyboard() if keyboard else None
+        self.reason = None
+        self._event = threading.Event()
+        self._next_file_check = 0.0
+        self._polling = False
+        if signals:
+            self._install(getattr(signal, 'SIGTERM', None))
+            self._install(getattr(signal, 'SIGBREAK', None))
+
+    def _install(self, signum):
+        if signum is None:
+            return
+        try:
+            signal.signal(signum, self._handle)
+        except ValueError:
+            pass                        # Not the main thread.
+
+    def _handle(self, signum, frame):
+        self.set("signal")
+        if not self._polling:
+            raise SystemExit("Terminated by signal %d." % signum)
+
+    def set(self, reason = "request"):
+        """Asks everything checking this signal to stop."""
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    def clear(self):
+        """Forgets any reason to stop, and removes the stop file if it exists."""
+        self.reason = None
+        self._event.clear()
+        if self.stop_file is not None:
+            try:
+                os.remove(self.stop_file)
+            except OSError:
+                pass                    # Already gone.
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout = None):
+        """Waits until set() is called or timeout seconds pass. Returns is_set()."""
+        self._event.wait(timeout)
+        return self._event.is_set()
+
+    def check(self):
+        """
+        Returns the reason to stop ("user" for a key hit, "signal", "stop file"
+        or whatever was passed to set()), or None to keep going.
+        """
+        self._polling = True
+        if self._event.is_set():
+            return self.reason
+        if self.stop_file is not None:
+            now = clock.now()
+            if now >= self._next_file_check:
+                self._next_file_check = now + STOP_FILE_INTERVAL
+                if os.path.exists(self.stop_file):
+                    self.set("stop file")
+                    return self.reason
+        if self.keyboard is not None and self.keyboard.hit():
+            return "user"
+        return None
+
+    def release(self):
+        """
+        Gives the keyboard back, so input can be asked for normally. Signals
+        end the process again until check() is next called.
+        """
+        self._polling = False
+        if self.keyboard is not None:
+            self.keyboard.release()
@@ -0,0 +1,304 @@
+"""
+storage.py
+
+Storage policies, which decide which collected datapoints are kept.
+
+Creep and relaxation tests can run for days. Collecting at full rate the
+whole time fills BasicTest.data with millions of nearly identical points,
+but collecting slowly makes stop conditions and safety checks sluggish.
+A storage policy separates the two: collect_until and collect_until_keyboard
+still collect and check conditions at full rate, but only store the
+datapoints the policy lets through.
+
+    Deadband({"load": .05, "position": .01})
+        Store a point only once some channel has changed by more than its
+        tolerance since the last stored point.
+    Decimate(1.0, envelope = ["load"])
+        Store at most one second's worth of summary at a time: the points
+        where load reached its minimum and maximum within each second.
+    LogSpacing(.01, per_decade = 20)
+        Store points at logarithmically spaced times after the start of the
+        phase, 20 per decade, starting at 10 ms. Ideal for relaxation.
+    TriggerCapture(sharp_drop("load", 5), pre = 2000, post = 500,
+                   storage = Decimate(1.0, envelope = ["load"]))
+        Store the 2000 points before and the 500 after load suddenly drops,
+        every one of them, and otherwise let Decimate decide. Collect as
+        fast as possible (rate = None) so the window is at full rate.
+
+Pass one to a collection phase:
+
+    self.collect_until("time", "greaterthan", 86400, storage = Decimate(10))
+
+A policy is reset at the start of every phase it is used in. The first and
+last points of a phase are always stored.
+"""
+
+import math, collections
+
+class StoragePolicy():
+    """
+    Base class of all storage policies. Subclasses override _bind, reset,
+    offer and flush. Without overriding, every datapoint is stored.
+    """
+
+    def bind(self, col):
+        """
+        Resolves column names with col, a dictionary like BasicTest.col, and
+        resets the policy. Raises KeyError for an unknown column.
+        """
+        self._bind(col)
+        self.reset()
+        return self
+
+    def _bind(self, col):
+        pass
+
+    def reset(self):
+        """Forgets all points seen, ready for a new phase."""
+        pass
+
+    def offer(self, point):
+        """Offers a new datapoint. Returns a list of datapoints to store now."""
+        return [point]
+
+    def flush(self):
+        """Called at the end of a phase. Returns any datapoints still to be stored."""
+        return []
+
+StoreAll = StoragePolicy
+
+class Deadband(StoragePolicy):
+    """
+    Stores a datapoint only when at least one channel differs from the last
+    stored datapoint by more than its tolerance. tolerances maps column names
+    to tolerances. If max_interval is given, a point is also stored whenever
+    that many seconds have passed without one.
+    """
+
+    def __init__(self, tolerances, max_interval = None, time_column = "time"):
+        self.tolerances = tolerances
+        self.max_interval = max_interval
+        self.time_column = time_column
+
+    def _bind(self, col):
+        self.checks = [(col[name], tol) for name, tol in self.tolerances.items()]
+        self.ti = col[self.time_column]
+
+    def reset(self):
+        self.stored = None
+        self.pending = None
+
+    def offer(self, point):
+        stored = self.stored
+        keep = stored is None
+        if not keep:
+            for i, tol in self.checks:
+                if abs(point[i] - stored[i]) > tol:
+                    keep = True
+                    break
+        if not keep and self.max_interval is not None:
+            keep = point[self.ti] - stored[self.ti] >= self.max_interval
+        if keep:
+            self.stored = point
+            self.pending = None
+            return [point]
+        self.pending = point
+        return []
+
+    def flush(self):
+        if self.pending is None:
+            return []
+        point = self.pending
+        self.pending = None
+        return [point]
+
+class Decimate(StoragePolicy):
+    """
+    Splits time into intervals of interval seconds and stores a few points
+    per interval. For each column in envelope, the points where that column
+    was lowest and highest are kept, so peaks and dips are never lost. With
+    no envelope, the last point of each interval is kept.
+    """
+
+    def __init__(self, interval, envelope = (), time_column = "time"):
+        self.interval = float(interval)
+        self.envelope = list(envelope)
+        self.time_column = time_column
+
+    def _bind(self, col):
+        self.ti = col[self.time_column]
+        self.ei = [col[name] for name in self.envelope]
+
+    def reset(self):
+        self.bucket = None
+        self.first = True
+        self._clear()
+
+    def _clear(self):
+        self.lows = [None] * len(self.ei)
+        self.highs = [None] * len(self.ei)
+        self.last = None
+
+    def _emit(self):
+        """Returns the points kept for the current interval, in time order."""
+        if self.last is None:
+            return []
+        if not self.ei:
+            return [self.last]
+        out = []
+        for point in self.lows + self.highs:
+            if not any(point is p for p in out):
+                out.append(point)
+        out.sort(key = lambda p: p[self.ti])
+        return out
+
+    def offer(self, point):
+        if self.first:
+            self.first = False
+            self.bucket = math.floor(point[self.ti] / self.interval)
+            return [point]
+        out = []
+        bucket = math.floor(point[self.ti] / self.interval)
+        if bucket != self.bucket:
+            out = self._emit()
+            self._clear()
+            self.bucket = bucket
+        for n, i in enumerate(self.ei):
+            if self.lows[n] is None or point[i] < self.lows[n][i]:
+                self.lows[n] = point
+            if self.highs[n] is None or point[i] > self.highs[n][i]:
+                self.highs[n] = point
+        self.last = point
+        return out
+
+    def flush(self):
+        out = self._emit()
+        if out and out[-1] is not self.last:
+            out.append(self.last)       # Always end the phase on its last point.
+        self._clear()
+        return out
+
+class LogSpacing(StoragePolicy):
+    """
+    Stores points at logarithmically spaced times after the first point of
+    the phase: first seconds after it, then per_decade points per factor of
+    ten in elapsed time. The number of points stored grows only with the
+    logarithm of the test duration.
+    """
+
+    def __init__(self, first = .01, per_decade = 20, time_column = "time"):
+        self.first = float(first)
+        self.ratio = 10 ** (1.0 / per_decade)
+        self.time_column = time_column
+
+    def _bind(self, col):
+        self.ti = col[self.time_column]
+
+    def reset(self):
+        self.start = None
+        self.next = None
+        self.pending = None
+
+    def offer(self, point):
+        t = point[self.ti]
+        if self.start is None:
+            self.start = t
+            self.next = self.first
+            return [point]
+        elapsed = t - self.start
+        if elapsed < self.next:
+            self.pending = point
+            return []
+        while self.next <= elapsed:
+            self.next *= self.ratio
+        self.pending = None
+        return [point]
+
+    def flush(self):
+        if self.pending is None:
+            return []
+        point = self.pending
+        self.pending = None
+        return [point]
+
+class TriggerCapture(StoragePolicy):
+    """
+    Stores every datapoint from pre points before, to post points after,
+    the one at which trigger, a condition from conditions.py, is met, and
+    otherwise lets storage, another policy (StoreAll by default), decide.
+    The last pre points are kept in a ring buffer, and what storage keeps is
+    held back until it leaves the ring, so that when the trigger fires the
+    window can be merged in without breaking time order. So stored data
+    trails collection by up to pre points; BasicTest.get_last_point still
+    returns the latest point. storage is never flushed before the end of
+    the phase, so it carries on at its own rate, and whatever it keeps from
+    inside a window is simply stored once. Each window is also kept in
+    windows, a list of lists of datapoints. The trigger fires once per
+    phase, or again after each window if repeat is True.
+    """
+
+    def __init__(self, trigger, pre = 1000, post = 1000, storage = None,
+                 repeat = False, time_column = "time"):
+        self.trigger = trigger
+        self.pre = pre
+        self.post = post
+        self.storage = storage or StoreAll()
+        self.repeat = repeat
+        self.time_column = time_column
+
+    def _bind(self, col):
+        self.trigger._bind(col)
+        self.storage._bind(col)
+        self.ti = col[self.time_column]
+
+    def reset(self):
+        self.trigger.reset()
+        self.storage.reset()
+        self.ring = collections.deque(maxlen = max(1, self.pre))
+        self.held = collections.deque()
+        self.armed = True
+        self.remaining = 0
+        self.last = None
+        self.windows = []
+
+    def _release(self, points):
+        """Returns points newer than the last one released, in time order."""
+        out = []
+        for point in sorted(points, key = lambda p: p[self.ti]):
+            if self.last is None or point[self.ti] > self.last:
+                out.append(point)
+                self.last = point[self.ti]
+        return out
+
+    def offer(self, point):
+        self.ring.append(point)
+        if self.remaining:
+            # Inside a window: keep everything. The other policy still sees
+            # the points, but anything it keeps from here on is already stored.
+            self.storage.offer(point)
+            self.windows[-1].append(point)
+            self.remaining -= 1
+            if not self.remaining and self.repeat:
+                self.trigger.reset()
+                self.armed = True
+            return self._release([point])
+        self.held.extend(self.storage.offer(point))
+        if self.armed and self.trigger.update(point):
+            self.armed = False
+            self.remaining = self.post
+            window = list(self.ring)
+            self.windows.append(list(window))
+            unique = dict((id(p), p) for p in list(self.held) + window)
+            self.held.clear()
+            return self._release(unique.values())
+        out = []
+        oldest = self.ring[0][self.ti]
+        while self.held and self.held[0][self.ti] < oldest:
+            out.append(self.held.popleft())
+        return self._release(out)
+
+    def flush(self):
+        out = list(self.held) + self.storage.flush()
+        self.held.clear()
+        self.remaining = 0
+        return self._release(out)
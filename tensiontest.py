@@ -8,16 +8,19 @@ This class executes a simple tension test using the BasicTest class.
 It illustrates that a short, procedural test can be written painlessly
 simply by overriding the run_test() method, and illustrates how to do so.
 
-Note the import statement:
+Note the import statements:
 
 from basictest import BasicTest, Freeloader, FreeloaderError
+from conditions import drop_from_peak, elapsed
 
 You need Freeloader to create a machine and connect to it.
 You need FreeloaderError to catch any errors while connecting.
 And you need BasicTest, which is the class you are extending.
+The conditions are building blocks for deciding when collection should stop.
 """
 
 from basictest import BasicTest, Freeloader, FreeloaderError
+from conditions import drop_from_peak, elapsed
 import traceback
 
 class TensionTest(BasicTest):
@@ -33,8 +36,9 @@ class TensionTest(BasicTest):
 
             - Ask user for speed and break detection force
             - Initialize data collection
-            - Move up and collect until force is greater than break
-            - Keep moving up and collect until force is less than break
+            - Move up and collect until the specimen breaks, which is when
+              force has passed the break detect load, then dropped by half
+              from its peak (or 30 minutes have passed, just in case)
             - Stop motor
             - Wait for user to remove test piece (keyboard input)
             - Move back down until position is less than original.
@@ -57,8 +61,7 @@ class TensionTest(BasicTest):
         print "Beginning test."
         self.initialize_data()
         self.fl.start_motor(linspd, down = False)
-        self.collect_until("load", "greaterthan", broken)
-        self.collect_until("load", "lessthan", broken)
+        self.collect_until(drop_from_peak("load", .5, min_peak = broken) | elapsed(1800))
         self.fl.stop_motor()
 
         # POST-TEST: USER INTERACTION, IF ANY, AND CLEANUP
@@ -71,7 +74,7 @@ class TensionTest(BasicTest):
 
         # DEFINE HEADER AND WRITE FILE
         h = "Speed setting (mm/min): " + str(linspd) + "\n"
-        h += "User-specified break force (lbs): " + str(broken) + "\n"
+        h += "User-specified break detect load (lbs): " + str(broken) + "\n"
         h += "Time,Displacement,Load\n"
         h += "sec,mm,lbs\n"
         self.write_file(h)
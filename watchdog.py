@@ -0,0 +1,248 @@
+"""
+watchdog.py
+
+A safety watchdog which stops the motor on overload, overtravel or loss of
+communication, whatever the test code is doing.
+
+Limits used to be enforced only by the test loop itself, between samples, so
+a test which didn't check load could overload the machine, and a hung read
+stalled everything, including stopping. A Watchdog runs on its own thread
+instead. Every period seconds it looks at the latest load and position the
+Freeloader has read (fl.last_load and fl.last_position, whoever read them),
+and trips if:
+    - load or position is outside its limits
+    - the motor has been told to move, but no new load or position has been
+      read for heartbeat seconds, so nobody knows what it is doing
+
+Tripping halts the motor through ServoController.Halt, which gets the
+Dynamixel's port ahead of any other thread and reads the speed back to
+verify the stop; it is retried every period until it succeeds. The motor
+then refuses to move until reset() is called. Nothing that goes wrong,
+such as the USB adapter being unplugged, ends the watchdog's thread: errors
+are recorded and it carries on. For each trip, the reaction
+time is measured, from the reading which broke a limit (or the moment the
+heartbeat ran out) to the verified stop:
+
+    dog = Watchdog(fl, max_load = 200, max_position = 50).start()
+    ...
+    if dog.tripped:
+        print dog.tripped
+    dog.stop()
+    print dog.report()
+
+So while the motor moves, both load and position must be read at least
+every heartbeat seconds, by a collection loop or otherwise; a long sleep or
+a prompt with the motor running trips it. pace() stretches the heartbeat to
+HEARTBEAT_PERIODS sample periods of a slow phase, which BasicTest's
+collection phases do for their rate. heartbeat = None turns the check off.
+
+Loads are compared as read_cell returns them, less load_offset. BasicTest's
+start_watchdog starts one with the test's own zero load. Run this module to
+measure reaction times on a simulated machine.
+
+The Watchdog needs a Freeloader connected locally, not a RemoteFreeloader.
+"""
+
+import threading
+import clock
+
+# pace() makes the heartbeat last at least this many sample periods.
+HEARTBEAT_PERIODS = 3
+
+class Watchdog():
+    """
+    Watches the connected Freeloader fl from its own thread, and halts its
+    motor if load or position leave the given limits (None for no limit), or
+    if nothing has been read for heartbeat seconds while it is moving (None
+    to not check).
+    """
+
+    def __init__(self, fl, max_load = None, min_load = None, max_position = None,
+                 min_position = None, heartbeat = .5, period = .002,
+                 load_offset = 0.0):
+        if not hasattr(fl, 'dyna'):
+            raise ValueError("The watchdog needs a locally connected Freeloader.")
+        self.fl = fl
+        self.max_load = max_load
+        self.min_load = min_load
+        self.max_position = max_position
+        self.min_position = min_position
+        self.heartbeat = heartbeat
+        self.base_heartbeat = heartbeat
+        self.period = period
+        self.load_offset = load_offset
+        self.tripped = None         # The reason for the current trip, if any
+        self.trips = []             # A dictionary for every trip (see trip)
+        self.checks = 0
+        self.worst_gap = 0.0        # Longest time between two checks
+        self.errors = 0             # Checks which raised an exception
+        self.last_error = None
+        self._verified = True
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts watching, and returns the Watchdog."""
+        self._running = True
+        self._thread = threading.Thread(target = self._run, name = "Watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops watching. A tripped motor stays halted until reset()."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        """Clears a trip and lets the motor move again."""
+        self.fl.dyna.Resume(1)
+        self.tripped = None
+        self._verified = True
+
+    def pace(self, period):
+        """
+        Adjusts the heartbeat to a phase which reads every period seconds
+        (None for as fast as it can): it becomes HEARTBEAT_PERIODS periods,
+        or the heartbeat the Watchdog was made with if that is longer.
+        """
+        if self.base_heartbeat is None or not period:
+            self.heartbeat = self.base_heartbeat
+        else:
+            self.heartbeat = max(self.base_heartbeat, HEARTBEAT_PERIODS * period)
+
+    def _run(self):
+        last = clock.now()
+        while self._running:
+            t = clock.now()
+            self.worst_gap = max(self.worst_gap, t - last)
+            last = t
+            self.checks += 1
+            try:
+                if self.tripped is None:
+                    found = self.check(t)
+                    if found:
+                        self.trip(*found)
+                elif not self._verified:
+                    self._halt(self.trips[-1])
+            except Exception as e:
+                # Whatever happens, keep watching.
+                self.errors += 1
+                self.last_error = e
+            clock.sleep(self.period)
+
+    def check(self, now):
+        """
+        Returns (reason, since), why the motor should stop and the time the
+        problem was first seen, or None if everything is fine.
+        """
+        fl = self.fl
+        if fl.last_load is not None:
+            load = fl.last_load - self.load_offset
+            if self.max_load is not None and load > self.max_load:
+                return ("load %.3f over the limit of %.3f" % (load, self.max_load),
+                        fl.last_load_time)
+            if self.min_load is not None and load < self.min_load:
+                return ("load %.3f under the limit of %.3f" % (load, self.min_load),
+                        fl.last_load_time)
+        position = fl.last_position
+        if position is not None:
+            if self.max_position is not None and position > self.max_position:
+                return ("position %.3f over the limit of %.3f" %
+                        (position, self.max_position), fl.last_position_time)
+            if self.min_position is not None and position < self.min_position:
+                return ("position %.3f under the limit of %.3f" %
+                        (position, self.min_position), fl.last_position_time)
+        if self.heartbeat is not None and fl.moving:
+            for name, seen in (("load", fl.last_load_time),
+                               ("position", fl.last_position_time)):
+                since = max(seen or 0, fl.moving_since) + self.heartbeat
+                if now > since:
+                    return ("no %s read for %.3f s while moving" %
+                            (name, now - since + self.heartbeat), since)
+        return None
+
+    def trip(self, reason, since):
+        """
+        Halts the motor because of reason, a problem first seen at time since.
+        Records the trip as a dictionary of the reason, since, the time it was
+        detected, the time the stop was verified (None until it is), the
+        reaction time from since to the verified stop, and the last error.
+        """
+        self.tripped = reason
+        record = {'reason': reason, 'since': since, 'detected': clock.now(),
+                  'verified': None, 'reaction': None, 'error': None}
+        self.trips.append(record)
+        self._halt(record)
+
+    def _halt(self, record):
+        try:
+            self.fl.dyna.Halt(1)
+        except Exception as e:      # Including the port itself failing
+            self._verified = False
+            record['error'] = str(e)
+            return
+        self._verified = True
+        record['verified'] = clock.now()
+        record['reaction'] = record['verified'] - record['since']
+        self.fl.moving = False
+
+    def worst_reaction(self):
+        """The longest reaction time of any verified trip, or None if none."""
+        times = [r['reaction'] for r in self.trips if r['reaction'] is not None]
+        return max(times) if times else None
+
+    def report(self):
+        """A summary of the checks made, every trip, and the worst reaction time."""
+        lines = ["Watchdog: %d checks, longest gap between checks %.2f ms" %
+                 (self.checks, self.worst_gap * 1000)]
+        if self.errors:
+            lines.append("  %d checks failed, the last with: %s" % (self.errors,
+                                                                   self.last_error))
+        for r in self.trips:
+            if r['reaction'] is None:
+                lines.append("  %s: stop NOT verified (%s)" % (r['reason'], r['error']))
+            else:
+                lines.append("  %s: detected after %.2f ms, stopped after %.2f ms" %
+                             (r['reason'], (r['detected'] - r['since']) * 1000,
+                              r['reaction'] * 1000))
+        worst = self.worst_reaction()
+        if worst is not None:
+            lines.append("Worst-case reaction time: %.2f ms" % (worst * 1000))
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    from simulated import simulated_freeloader, LinearSpecimen
+
+    parser = argparse.ArgumentParser(description = "Measure the watchdog's reaction "
+                                     "times on a simulated machine.")
+    parser.add_argument("--trials", type = int, default = 20)
+    parser.add_argument("--period", type = float, default = .002)
+    args = parser.parse_args()
+
+    # Pull on a stiff specimen until the load limit trips, then back off
+    # with the watchdog stopped, many times over.
+    fl = simulated_freeloader(specimen = LinearSpecimen(400))
+    reactions = []
+    for i in range(args.trials):
+        dog = Watchdog(fl, max_load = 20, period = args.period).start()
+        fl.start_motor(20)
+        while not dog.tripped:
+            fl.get_linear_position()
+            fl.read_cell()
+        dog.stop()
+        print dog.report()
+        reactions.append(dog.worst_reaction())
+        dog.reset()
+        fl.start_motor(70, down = True)
+        while fl.get_linear_position() > 0:
+            fl.read_cell()
+        fl.stop_motor()
+    fl.disconnect()
+    verified = [r for r in reactions if r is not None]
+    print "%d of %d stops verified, worst-case reaction time %.2f ms" % (
+        len(verified), len(reactions), max(verified) * 1000 if verified else float('nan'))